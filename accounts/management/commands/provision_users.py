@@ -0,0 +1,276 @@
+import csv
+import re
+from optparse import make_option
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import RegexValidator
+from django.db import transaction
+
+from django.contrib.auth.models import User
+
+from accounts.models import Household, Profile
+from food.models import bulk_insert
+
+
+# The columns needed in the CSV file's header row, and those which can be
+# left out (in any order and case)
+COLUMNS = ('username', 'email')
+OPTIONAL_COLUMNS = ('password', 'display_name', 'first_name', 'last_name',
+                    'household', 'household_id')
+
+# (as in the registration form and the profile URLs)
+validate_username = RegexValidator(re.compile(r'^[\w.@+-]+$'),
+                                   u'Enter a username of only letters, numbers and @/./+/-/_ characters')
+
+# Maximum number of values in one "IN (...)" query (SQLite allows at most
+# 999 parameters in a query)
+MAX_IN_VALUES = 500
+
+
+def clean_row(values):
+    """
+    Returns a dict of the cleaned values of each column from a dict of CSV
+    values, using the fields of the User, Profile and Household models (and
+    so their validators), or raises ValidationError.
+    """
+    fields = {
+        'username': User._meta.get_field('username'),
+        'email': User._meta.get_field('email'),
+        'password': User._meta.get_field('password'),
+        'first_name': User._meta.get_field('first_name'),
+        'last_name': User._meta.get_field('last_name'),
+        'display_name': Profile._meta.get_field('display_name'),
+        'household': Household._meta.get_field('name'),
+        'household_id': Household._meta.get_field('id'),
+    }
+    cleaned = {}
+    errors = []
+    for column in COLUMNS + OPTIONAL_COLUMNS:
+        value = values.get(column, u'').strip()
+        if not value and column in OPTIONAL_COLUMNS:
+            cleaned[column] = u''
+            continue
+        try:
+            cleaned[column] = fields[column].clean(value, None)
+            if column == 'username':
+                validate_username(cleaned[column])
+        except ValidationError, e:
+            errors.extend(u'%s: %s' % (column, message) for message in e.messages)
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
+
+
+def _in_chunks(values):
+    values = list(values)
+    for start in range(0, len(values), MAX_IN_VALUES):
+        yield values[start:start + MAX_IN_VALUES]
+
+
+class Command(BaseCommand):
+    args = '<csv file>'
+    help = ("Creates users, with their profiles and households, from a CSV file "
+            "with a header row naming the columns username and email, and "
+            "optionally password, display_name, first_name, last_name, "
+            "household and household_id. Users with the same household share "
+            "it (the first of them in the file becomes its admin); the others "
+            "each get a household of their own. An existing household is only "
+            "joined if it's active and given by its id in household_id, or "
+            "has the same name and its admin is earlier in the file (e.g. "
+            "when the file is provisioned again). Users who already exist (matched by username) are left as "
+            "they are, so the same file can be provisioned again safely. Users "
+            "without a password can't log in until they reset it.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of rows to read and save at a time (default 500)'),
+        make_option('--errors', dest='errors', default=None,
+                    help='Write rows which could not be provisioned, with the reasons, to this CSV file'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("need exactly one argument for the csv file")
+        batch_size = options.get('batch_size') or 500
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        self.verbosity = int(options.get('verbosity', 1))
+
+        try:
+            csv_file = open(args[0], 'rb')
+        except IOError, e:
+            raise CommandError("can't open %s: %s" % (args[0], e))
+        error_file = None
+        self.error_writer = None
+        if options.get('errors'):
+            error_file = open(options['errors'], 'wb')
+            self.error_writer = csv.writer(error_file)
+
+        self.created = self.households = self.existing = self.failed = 0
+        # The ids of the households named in the file, once they've been
+        # created or found (for the users in later batches)
+        self.named_households = {}
+        try:
+            reader = csv.reader(csv_file)
+            try:
+                header = [column.strip().lower() for column in reader.next()]
+            except StopIteration:
+                raise CommandError("%s is empty" % args[0])
+            missing = [column for column in COLUMNS if column not in header]
+            if missing:
+                raise CommandError("the header row is missing the column(s): %s" %
+                                   u', '.join(missing))
+            if self.error_writer:
+                self.error_writer.writerow(['line', 'errors'] + header)
+
+            # As in import_ingredients, only one batch is held in memory
+            batch = {}
+            for row in reader:
+                if not any(row):
+                    continue # skip blank lines
+                self.add_row(batch, reader.line_num, header, row)
+                if len(batch) >= batch_size:
+                    self.save_batch(batch)
+                    batch = {}
+            self.save_batch(batch)
+        finally:
+            csv_file.close()
+            if error_file:
+                error_file.close()
+
+        self.stdout.write("%s users created, %s households created, %s users "
+                          "already existed, %s rows with errors\n" % (
+                              self.created, self.households, self.existing,
+                              self.failed))
+
+    def add_row(self, batch, line_num, header, row):
+        """
+        Validates a row and adds it to the batch (keyed by username, so that a
+        later row with the same username replaces an earlier one)
+        """
+        values = dict((column, value.decode('utf-8'))
+                      for column, value in zip(header, row))
+        try:
+            if len(row) != len(header):
+                raise ValidationError(u'expected %s values but found %s' %
+                                      (len(header), len(row)))
+            cleaned = clean_row(values)
+        except ValidationError, e:
+            self.reject(line_num, e.messages, row)
+            return
+        # (rows are saved in the order they were read, so that the first
+        # user of a household is its admin)
+        cleaned['line'] = line_num
+        cleaned['row'] = row
+        batch.pop(cleaned['username'], None)
+        batch[cleaned['username']] = cleaned
+
+    def reject(self, line_num, messages, row):
+        self.failed += 1
+        if self.error_writer:
+            self.error_writer.writerow([line_num,
+                                        u'; '.join(messages).encode('utf-8')] + row)
+
+    @transaction.commit_on_success
+    def save_batch(self, batch):
+        """
+        Creates the new users in a batch, their households and their profiles,
+        with one INSERT for each (rather than saving each user, which creates
+        a household and a profile for it with the signal receiver in
+        accounts.models), and profiles for any existing users without one.
+        """
+        if not batch:
+            return
+        rows = sorted(batch.values(), key=lambda row: row['line'])
+        existing = {}
+        for chunk in _in_chunks(batch):
+            existing.update(User.objects.filter(username__in=chunk).values_list(
+                                'username', 'pk'))
+        with_profiles = set()
+        for chunk in _in_chunks(existing.values()):
+            with_profiles.update(Profile.objects.filter(user__in=chunk).values_list(
+                                     'user', flat=True))
+        # Households given by id (for users who need one) must exist and be
+        # active (not merged into another one)
+        needs_household = lambda row: existing.get(row['username']) not in with_profiles
+        active_ids = set()
+        for chunk in _in_chunks(set(row['household_id'] for row in rows
+                                    if row['household_id'] and needs_household(row))):
+            active_ids.update(Household.objects.filter(
+                                  pk__in=chunk, is_active=True).values_list(
+                                  'pk', flat=True))
+        for row in list(rows):
+            if (row['household_id'] and needs_household(row) and
+                    row['household_id'] not in active_ids):
+                self.reject(row['line'], [u'household_id: there is no active '
+                                          u'household %s' % row['household_id']],
+                            row['row'])
+                rows.remove(row)
+
+        users = []
+        for row in rows:
+            if row['username'] in existing:
+                self.existing += 1
+                continue
+            user = User(username=row['username'], email=row['email'],
+                        first_name=row['first_name'], last_name=row['last_name'])
+            # (an empty password is unusable)
+            user.set_password(row['password'] or None)
+            users.append(user)
+        bulk_insert(users)
+        self.created += len(users)
+        user_ids = dict(existing)
+        for chunk in _in_chunks(user.username for user in users):
+            user_ids.update(User.objects.filter(username__in=chunk).values_list(
+                                'username', 'pk'))
+
+        # A household named in the file is only an existing one if its admin
+        # is a user in the file (so that a new user isn't added to an
+        # unrelated household which happens to have the same name)
+        household_ids = dict(self.named_households)
+        batch_user_ids = set(user_ids.values())
+        for chunk in _in_chunks(set(row['household'] for row in rows
+                                    if row['household'] and not row['household_id']) -
+                                set(household_ids)):
+            # (the oldest, if more than one has the same name)
+            for pk, name, admin_id in Household.objects.filter(
+                    name__in=chunk, is_active=True).order_by('-pk').values_list(
+                    'pk', 'name', 'admin'):
+                if admin_id in batch_user_ids:
+                    household_ids[name] = pk
+        # Only users without a profile need a household
+        rows = [row for row in rows if needs_household(row)]
+        new_households = {}
+        for row in rows:
+            if row['household_id']:
+                continue
+            name = row['household'] or row['username'] + u"'s household"
+            key = row['household'] or (None, row['username'])
+            if key not in household_ids and key not in new_households:
+                new_households[key] = Household(name=name,
+                                                admin_id=user_ids[row['username']])
+        bulk_insert(new_households.values())
+        self.households += len(new_households)
+        # Find the new households' ids by their admins and names (the newest
+        # of those, which are the ones just inserted)
+        admins = dict(((household.admin_id, household.name), key)
+                      for key, household in new_households.items())
+        for chunk in _in_chunks(set(household.admin_id for household in
+                                    new_households.values())):
+            for pk, admin_id, name in Household.objects.filter(
+                    admin__in=chunk).order_by('pk').values_list('pk', 'admin', 'name'):
+                if (admin_id, name) in admins:
+                    household_ids[admins[(admin_id, name)]] = pk
+        self.named_households.update((key, pk) for key, pk in household_ids.items()
+                                     if not isinstance(key, tuple))
+
+        bulk_insert([Profile(user_id=user_ids[row['username']],
+                             household_id=row['household_id'] or
+                                          household_ids[row['household'] or
+                                                        (None, row['username'])],
+                             display_name=row['display_name'] or row['username'])
+                     for row in rows])
+        if self.verbosity >= 1:
+            self.stdout.write("%s rows processed\n" % (self.created + self.existing +
+                                                      self.failed))
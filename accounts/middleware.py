@@ -0,0 +1,59 @@
+"""
+Lazily resolves the profile and household of the user making each request,
+as request.profile and request.household (both None for anonymous users).
+
+They're looked up together with one query the first time either is used in a
+request, and with ACCOUNTS_PROFILE_CACHE_TIMEOUT set, kept in the cache for
+that many seconds (until the profile or household is saved; see the signal
+receivers in accounts.models), so that most requests which need them don't
+query the database for them at all.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from accounts.models import Profile, profile_cache_key
+
+
+PROFILE_CACHE_TIMEOUT = getattr(settings, 'ACCOUNTS_PROFILE_CACHE_TIMEOUT', 0)
+
+
+def get_profile(user):
+    """
+    Returns user's profile, with its household, or None if user is anonymous
+    or has no profile.
+    """
+    if not user.is_authenticated():
+        return None
+    key = profile_cache_key(user.id)
+    profile = PROFILE_CACHE_TIMEOUT and cache.get(key)
+    if not profile:
+        try:
+            profile = Profile.objects.select_related('household').get(user=user)
+        except Profile.DoesNotExist:
+            return None
+        if PROFILE_CACHE_TIMEOUT:
+            cache.set(key, profile, PROFILE_CACHE_TIMEOUT)
+    # (so that profile.user doesn't look the user up again)
+    profile._user_cache = user
+    return profile
+
+
+class LazyProfile(object):
+    def __get__(self, request, obj_type=None):
+        if not hasattr(request, '_cached_profile'):
+            request._cached_profile = get_profile(request.user)
+        return request._cached_profile
+
+
+class LazyHousehold(object):
+    def __get__(self, request, obj_type=None):
+        profile = request.profile
+        return profile and profile.household
+
+
+class ProfileMiddleware(object):
+    def process_request(self, request):
+        assert hasattr(request, 'user'), "The profile middleware requires the authentication middleware to be installed. Edit your MIDDLEWARE_CLASSES setting to insert 'django.contrib.auth.middleware.AuthenticationMiddleware' before it."
+        request.__class__.profile = LazyProfile()
+        request.__class__.household = LazyHousehold()
+        return None
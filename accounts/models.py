@@ -1,7 +1,8 @@
 import sys
 
+from django.core.cache import cache
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from django.contrib.auth.models import User
@@ -42,3 +43,21 @@ def create_household_and_profile_on_create_user(sender, **kwargs):
                                          display_name=user.username
                                          )
 
+
+# Each user's profile and household can be kept in the cache by
+# ProfileMiddleware (see accounts/middleware.py), so they're deleted from it
+# whenever they change, in whichever process that happens
+
+def profile_cache_key(user_id):
+    return 'accounts:profile:%s' % user_id
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def uncache_profile(sender, instance, **kwargs):
+    cache.delete(profile_cache_key(instance.user_id))
+
+@receiver(post_save, sender=Household)
+def uncache_household_profiles(sender, instance, **kwargs):
+    cache.delete_many([profile_cache_key(user_id) for user_id in
+                       Profile.objects.filter(household=instance).values_list(
+                           'user', flat=True)])
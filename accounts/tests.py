@@ -1,8 +1,17 @@
+import csv
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.client import RequestFactory
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 
+import accounts.middleware
+from accounts.middleware import ProfileMiddleware, get_profile
 from accounts.models import Household, Profile
 
 
@@ -67,12 +76,52 @@ class AccountsViewsTestCase(TestCase):
         with self.assertNumQueries(0):
             print "admin:", response.context['household'].admin
         self.assertTrue("members" in response.context)
+        # Only the household's members see its dashboard
+        self.assertFalse("dashboard" in response.context)
+
+        self.client.login(username="jenny", password="password")
+        response = self.client.get(reverse("household_detail",
+                                           kwargs={'pk': user.profile.household.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([member['user'] for member in
+                          response.context['dashboard']['members']], [user])
+        self.assertContains(response, "No leftovers")
+
+    def test_household_merge(self):
+        user = User.objects.create_user("jenny", "a@b.com", "password")
+        other_user = User.objects.create_user("jim", "a@b.com", "password")
+        household = user.profile.household
+        other_household = other_user.profile.household
+        url = reverse("household_merge", kwargs={'pk': other_household.id})
+
+        # Only the admin of both households can merge them
+        self.client.login(username="jenny", password="password")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        Household.objects.filter(pk=other_household.id).update(admin=user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/household_merge.html")
+        self.assertEqual(list(response.context['form'].fields['target'].queryset),
+                         [household])
+        response = self.client.post(url, {'target': other_household.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+
+        response = self.client.post(url, {'target': household.id})
+        self.assertRedirects(response, reverse("household_detail",
+                                               kwargs={'pk': household.id}))
+        self.assertEqual(Profile.objects.get(user=other_user).household, household)
+        self.assertFalse(Household.objects.get(pk=other_household.id).is_active)
+        # (and it can't be merged again)
+        self.assertEqual(self.client.get(url).status_code, 404)
 
     def test_profile_detail(self):
         # Create a user (household and profile created by signal receiver):
         user = User.objects.create_user("jenny", "a@b.com", "password")
 
-        with self.assertNumQueries(3):
+        # (the profile, with its user and household)
+        with self.assertNumQueries(1):
             response = self.client.get(reverse("profile_detail",
                                            kwargs={'username': user.username}),)
         self.assertEqual(response.status_code, 200)
@@ -80,4 +129,201 @@ class AccountsViewsTestCase(TestCase):
         self.assertTemplateUsed(response, "accounts/profile_detail.html")
         self.assertTemplateUsed(response, "food/base.html")
         self.assertTrue("profile" in response.context)
+        with self.assertNumQueries(0):
+            response.context['profile'].user
+            response.context['profile'].household
+
 
+class ProfileMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("jenny", "a@b.com", "password")
+        self.addCleanup(setattr, accounts.middleware, 'PROFILE_CACHE_TIMEOUT',
+                        accounts.middleware.PROFILE_CACHE_TIMEOUT)
+        accounts.middleware.PROFILE_CACHE_TIMEOUT = 60
+
+    def test_get_profile(self):
+        """
+        Tests that a user's profile and household are looked up with one query,
+        and then come from the cache until either is saved.
+        """
+        with self.assertNumQueries(1):
+            profile = get_profile(self.user)
+            self.assertEqual(profile.household.name, "jenny's household")
+            self.assertEqual(profile.user, self.user)
+        with self.assertNumQueries(0):
+            profile = get_profile(self.user)
+            self.assertEqual(profile.household.name, "jenny's household")
+
+        profile.display_name = "Jen"
+        profile.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_profile(self.user).display_name, "Jen")
+
+        household = profile.household
+        household.name = "The Flat"
+        household.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_profile(self.user).household.name, "The Flat")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_profile(AnonymousUser()), None)
+
+    def test_get_profile_uncached(self):
+        """
+        Tests that without ACCOUNTS_PROFILE_CACHE_TIMEOUT the profile is looked
+        up every time.
+        """
+        accounts.middleware.PROFILE_CACHE_TIMEOUT = 0
+        for i in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(get_profile(self.user).household.name,
+                                 "jenny's household")
+
+    def test_request_household(self):
+        """
+        Tests that request.profile and request.household are only looked up
+        when they're used, once per request.
+        """
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            ProfileMiddleware().process_request(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.household.name, "jenny's household")
+            self.assertEqual(request.profile.household, request.household)
+            self.assertEqual(request.profile.user, self.user)
+
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        ProfileMiddleware().process_request(request)
+        with self.assertNumQueries(0):
+            self.assertEqual(request.profile, None)
+            self.assertEqual(request.household, None)
+
+
+class ProvisionUsersTestCase(TestCase):
+    def write_csv(self, content):
+        csv_file = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+        csv_file.write(content)
+        csv_file.close()
+        self.addCleanup(os.remove, csv_file.name)
+        return csv_file.name
+
+    def test_provision_users(self):
+        jenny = User.objects.create_user("jenny", "a@b.com", "password")
+        csv_name = self.write_csv(
+            'Username,email,password,display_name,household\n'
+            'ann,ann@example.com,secret,Ann,Canteen\n'
+            'bob,bob@example.com,,,Canteen\n'
+            'cat,cat@example.com,secret,,\n'
+            'jenny,jenny@example.com,other,,Canteen\n'
+            'bad name,bad@example.com,,,\n'
+            'dan,not an email,,,\n')
+        errors_name = self.write_csv('')
+
+        call_command('provision_users', csv_name, errors=errors_name,
+                     verbosity=0)
+        self.assertEqual(User.objects.count(), 4)
+        canteen = Household.objects.get(name="Canteen")
+        ann = User.objects.get(username="ann")
+        self.assertEqual(canteen.admin, ann)
+        self.assertTrue(ann.check_password("secret"))
+        self.assertEqual(ann.profile.display_name, "Ann")
+        self.assertEqual(ann.profile.household, canteen)
+        bob = User.objects.get(username="bob")
+        self.assertFalse(bob.has_usable_password())
+        self.assertEqual(bob.profile.display_name, "bob")
+        self.assertEqual(bob.profile.household, canteen)
+        cat = User.objects.get(username="cat")
+        self.assertEqual(cat.profile.household.name, "cat's household")
+        self.assertEqual(cat.profile.household.admin, cat)
+        # Existing users are left as they are
+        jenny = User.objects.get(username="jenny")
+        self.assertTrue(jenny.check_password("password"))
+        self.assertEqual(jenny.profile.household.name, "jenny's household")
+
+        errors = list(csv.reader(open(errors_name)))
+        self.assertEqual(errors[0], ['line', 'errors', 'username', 'email',
+                                     'password', 'display_name', 'household'])
+        self.assertEqual([row[0] for row in errors[1:]], ['6', '7'])
+        self.assertTrue(errors[1][1].startswith('username:'))
+        self.assertTrue(errors[2][1].startswith('email:'))
+
+        # Provisioning the same users again (in smaller batches) changes
+        # nothing, and a new user joins the existing household
+        with open(csv_name, 'a') as csv_file:
+            csv_file.write('eve,eve@example.com,,,Canteen\n')
+        call_command('provision_users', csv_name, batch_size=2, verbosity=0)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Household.objects.count(), 3)
+        self.assertEqual(Profile.objects.count(), 5)
+        self.assertEqual(User.objects.get(username="eve").profile.household,
+                         canteen)
+
+        # (call_command reports CommandErrors and exits)
+        self.assertRaises(SystemExit, call_command, 'provision_users',
+                          self.write_csv('username,password\nann,secret\n'))
+
+    def test_provision_users_households(self):
+        # An unrelated household with the same name as one in the file, and
+        # one which has been merged into another
+        stranger = User.objects.create_user("stranger", "s@example.com", "password")
+        smiths = stranger.profile.household
+        smiths.name = "Smith"
+        smiths.save()
+        retired = User.objects.create_user("retired", "r@example.com",
+                                           "password").profile.household
+        retired.is_active = False
+        retired.save()
+        csv_name = self.write_csv(
+            'username,email,household,household_id\n'
+            'ann,ann@example.com,Smith,\n'
+            'bob,bob@example.com,,%s\n'
+            'cat,cat@example.com,,%s\n'
+            'dan,dan@example.com,Smith,%s\n' % (smiths.id, retired.id,
+                                                 retired.id + 100))
+        errors_name = self.write_csv('')
+
+        call_command('provision_users', csv_name, errors=errors_name,
+                     verbosity=0)
+        # Only users explicitly given its id join the existing household
+        ann = User.objects.get(username="ann")
+        self.assertNotEqual(ann.profile.household, smiths)
+        self.assertEqual(ann.profile.household.name, "Smith")
+        self.assertEqual(ann.profile.household.admin, ann)
+        self.assertEqual(User.objects.get(username="bob").profile.household,
+                         smiths)
+        self.assertFalse(User.objects.filter(username__in=["cat", "dan"]).exists())
+        errors = list(csv.reader(open(errors_name)))
+        self.assertEqual([row[0] for row in errors[1:]], ['4', '5'])
+        self.assertTrue(errors[1][1].startswith('household_id:'))
+
+        # A new user of the household named in the file joins the one created
+        # for it, with ann (in the file) as its admin
+        with open(csv_name, 'a') as csv_file:
+            csv_file.write('eve,eve@example.com,Smith,\n')
+        call_command('provision_users', csv_name, batch_size=1, verbosity=0)
+        self.assertEqual(User.objects.get(username="eve").profile.household,
+                         ann.profile.household)
+        self.assertEqual(smiths.user_profiles.count(), 2)
+
+    def test_provision_users_in_bulk(self):
+        """
+        Tests that the number of queries doesn't depend on the number of
+        users provisioned.
+        """
+        for size, prefix in ((2, 'small'), (50, 'large')):
+            csv_name = self.write_csv('username,email,household\n' + ''.join(
+                '%s%s,%s%s@example.com,%s%s\n' % (prefix, number, prefix, number,
+                                                  prefix, number % 2 and 'odd' or '')
+                for number in range(size)))
+            # (the existing users, inserting the users and looking up their
+            # ids, the existing households, inserting the new ones and looking
+            # up their ids, and inserting the profiles)
+            with self.assertNumQueries(7):
+                call_command('provision_users', csv_name, verbosity=0)
+            self.assertEqual(Profile.objects.filter(
+                                 user__username__startswith=prefix).count(), size)
+            self.assertEqual(Household.objects.get(name=prefix + 'odd').user_profiles.count(),
+                             size / 2)
@@ -1,6 +1,6 @@
 from django.conf.urls.defaults import *
 
-from accounts.views import ProfileDetailView, HouseholdDetailView
+from accounts.views import ProfileDetailView, HouseholdDetailView, household_merge
 
 from django.contrib import admin
 admin.autodiscover()
@@ -9,4 +9,5 @@ admin.autodiscover()
 urlpatterns = patterns('',
     url(r'^user/(?P<username>[\w@+.-]+)/profile/$', ProfileDetailView.as_view(), name="profile_detail"),
     url(r'^household/(?P<pk>\d+)/$', HouseholdDetailView.as_view(), name="household_detail"),
+    url(r'^household/(?P<pk>\d+)/merge/$', household_merge, name="household_merge"),
 )
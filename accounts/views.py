@@ -1,9 +1,15 @@
-from django.shortcuts import get_object_or_404
+from django import forms
+from django.http import Http404
+from django.shortcuts import get_object_or_404, redirect, render_to_response
+from django.template import RequestContext
 from django.views.generic import DetailView
 
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 
 from accounts.models import Profile, Household
+from food.dashboard import household_dashboard
+from food.households import merge_households
 
 
 class ProfileDetailView(DetailView):
@@ -11,17 +17,9 @@ class ProfileDetailView(DetailView):
     queryset = Profile.objects.select_related('user', 'household').all()
 
     def get_object(self):
-        user = get_object_or_404(User, username=self.kwargs['username'])
-
-        # Just use this instead of the following two lines?
-        # Looks simpler but actually makes more queries...
-
-        # object = user.profile
-
-        self.kwargs['pk'] = user.profile.id
-        object = super(ProfileDetailView, self).get_object()
-
-        return object
+        # The profile, its user and its household with one query
+        return get_object_or_404(self.get_queryset(),
+                                 user__username=self.kwargs['username'])
 
 
 class HouseholdDetailView(DetailView):
@@ -35,10 +33,52 @@ class HouseholdDetailView(DetailView):
         context = super(HouseholdDetailView, self).get_context_data(**kwargs)
 
         # Add in household members
-        members = User.objects.filter(profile__household__id=self.kwargs['pk'])
+        members = list(User.objects.filter(profile__household__id=self.kwargs['pk']))
 
         context.update({
             'members': members,
         })
+        # Only the household's own members see its dashboard
+        if self.request.household == self.object:
+            context['dashboard'] = household_dashboard(self.object, members)
         return context
 
+
+
+class HouseholdMergeForm(forms.Form):
+    # form for choosing the household to merge a household into
+    target = forms.ModelChoiceField(queryset=Household.objects.none(),
+                                    label="Merge into",
+                                    empty_label=None)
+
+    def __init__(self, *args, **kwargs):
+        household = kwargs.pop('household')
+        admin = kwargs.pop('admin')
+        super(HouseholdMergeForm, self).__init__(*args, **kwargs)
+        self.fields['target'].queryset = Household.objects.filter(
+            admin=admin, is_active=True).exclude(pk=household.pk).order_by('name')
+
+@login_required
+def household_merge(request, pk):
+    # Moves a household's dishes, meals and members into another household,
+    # and makes it inactive. Only the admin of both households can merge them,
+    # so that nobody can join a household (and see its food) without its
+    # admin, or give away a household which isn't theirs.
+    household = get_object_or_404(Household, pk=pk, is_active=True)
+    if household.admin_id != request.user.id:
+        raise Http404
+    if request.method == 'POST': # If the form has been submitted...
+        form = HouseholdMergeForm(request.POST, household=household,
+                                  admin=request.user)
+        if form.is_valid(): # All validation rules pass
+            target = form.cleaned_data['target']
+            merge_households(household, target)
+            return redirect('household_detail', target.id) # Redirect after POST
+    else:
+        form = HouseholdMergeForm(household=household, admin=request.user)
+
+    return render_to_response('accounts/household_merge.html', {
+        'form': form,
+        'household': household,},
+        context_instance=RequestContext(request) # needed for csrf token
+    )
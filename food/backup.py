@@ -0,0 +1,312 @@
+"""
+Backup and restore of everything belonging to one household, for moving
+households between databases.
+
+A backup is a gzipped stream of length-prefixed records: each record is a
+4-byte big-endian length followed by that many bytes of compact JSON. The
+first record is a header giving the format version and the field names of
+each record type, every other record is a [type, values] list, and the last
+record holds the totals which the restore is checked against.
+
+Restoring gives everything new ids (keeping a map from the old ones), reuses
+users and ingredients which already exist (matched by username and name),
+inserts everything without saving each object or sending signals (calories
+are copied from the backup rather than recalculated, and the ingredient
+index and household summaries are calculated once at the end), and checks
+the counts and calories totals of the restored household at the end, all in
+one transaction.
+"""
+import gzip
+import struct
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import simplejson
+
+from django.contrib.auth.models import User
+
+from accounts.models import Household, Profile
+
+from food.models import Ingredient, Dish, Amount, Meal, Portion, insert_without_signals, bulk_insert, update_dish_ingredients, update_meal_ingredients, update_household_summaries
+
+
+FORMAT_VERSION = 1
+
+# The fields stored for each type of record, in order
+FIELDS = {
+    'user': ['id', 'username', 'first_name', 'last_name', 'email', 'password',
+             'is_staff', 'is_active', 'is_superuser', 'last_login',
+             'date_joined'],
+    'ingredient': ['id', 'name', 'quantity', 'calories', 'unit'],
+    'household': ['id', 'name', 'admin', 'is_active'],
+    'profile': ['user', 'display_name'],
+    'dish': ['id', 'name', 'quantity', 'date_cooked', 'recipe_url',
+             'calories', 'unit'],
+    'cook': ['dish', 'user'],
+    'amount': ['containing_dish', 'contained_comestible', 'quantity',
+               'calories'],
+    'meal': ['id', 'name', 'date', 'time', 'user', 'calories'],
+    'portion': ['meal', 'comestible', 'quantity', 'calories'],
+    'totals': ['dishes', 'amounts', 'meals', 'portions', 'dish_calories',
+               'meal_calories'],
+}
+
+# Number of buffered amounts, portions etc. inserted at a time when restoring
+RESTORE_BATCH_SIZE = 1000
+
+_length = struct.Struct('>I')
+
+
+class BackupError(Exception):
+    pass
+
+
+def write_record(stream, record):
+    data = simplejson.dumps(record, cls=DjangoJSONEncoder,
+                            separators=(',', ':'))
+    stream.write(_length.pack(len(data)))
+    stream.write(data)
+
+def read_records(stream):
+    """
+    Yields each record from a (decompressed) backup stream.
+    """
+    while True:
+        try:
+            prefix = stream.read(_length.size)
+            if not prefix:
+                return
+            if len(prefix) < _length.size:
+                raise BackupError(u'The backup is truncated.')
+            length, = _length.unpack(prefix)
+            data = stream.read(length)
+            if len(data) < length:
+                raise BackupError(u'The backup is truncated.')
+            record = simplejson.loads(data)
+        except (IOError, EOFError, ValueError), e:
+            # gzip raises IOError or EOFError for corrupt or truncated data
+            raise BackupError(u'The backup is corrupt (%s).' % e)
+        yield record
+
+
+def _totals(household):
+    """
+    Returns the values of the totals record for a household.
+    """
+    dishes = Dish.objects.filter(household=household)
+    meals = Meal.objects.filter(household=household)
+    return [dishes.count(),
+            Amount.objects.filter(containing_dish__household=household).count(),
+            meals.count(),
+            Portion.objects.filter(meal__household=household).count(),
+            _rounded(dishes.aggregate(total=Sum('calories'))['total']),
+            _rounded(meals.aggregate(total=Sum('calories'))['total'])]
+
+def _rounded(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def backup_household(household, stream):
+    """
+    Writes a backup of a household to the file-like object stream, reading
+    each table with one query and without loading model instances.
+    """
+    out = gzip.GzipFile(fileobj=stream, mode='wb')
+    write_record(out, {'version': FORMAT_VERSION, 'fields': FIELDS})
+
+    amounts = Amount.objects.filter(containing_dish__household=household)
+    portions = Portion.objects.filter(meal__household=household)
+    users = User.objects.filter(
+        Q(pk=household.admin_id) |
+        Q(pk__in=Profile.objects.filter(household=household).values('user')) |
+        Q(pk__in=Meal.objects.filter(household=household).values('user')) |
+        Q(pk__in=Dish.cooks.through.objects.filter(
+            dish__household=household).values('user')))
+    ingredients = Ingredient.objects.filter(
+        Q(pk__in=amounts.values('contained_comestible')) |
+        Q(pk__in=portions.values('comestible')))
+
+    def write_all(record_type, queryset):
+        for values in queryset.values_list(*FIELDS[record_type]).iterator():
+            write_record(out, [record_type, values])
+
+    write_all('user', users.order_by('pk'))
+    write_all('ingredient', ingredients.order_by('pk'))
+    write_record(out, ['household', [household.id, household.name,
+                                     household.admin_id, household.is_active]])
+    write_all('profile', Profile.objects.filter(household=household))
+    write_all('dish', Dish.objects.filter(household=household).order_by('pk'))
+    write_all('cook', Dish.cooks.through.objects.filter(dish__household=household))
+    write_all('amount', amounts)
+    write_all('meal', Meal.objects.filter(household=household).order_by('pk'))
+    write_all('portion', portions)
+    write_record(out, ['totals', _totals(household)])
+    out.close()
+
+
+class _Restore(object):
+    """
+    Holds the maps from old to new ids, and the buffered rows waiting to be
+    inserted, while a backup is restored.
+    """
+    def __init__(self):
+        self.users = {}
+        self.comestibles = {}
+        self.dishes = {}
+        self.meals = {}
+        self.household = None
+        self.totals = None
+        self.skipped = 0
+        self.buffers = {}
+
+    def buffer(self, obj):
+        objs = self.buffers.setdefault(obj.__class__, [])
+        objs.append(obj)
+        if len(objs) >= RESTORE_BATCH_SIZE:
+            self.flush(obj.__class__)
+
+    def flush(self, model=None):
+        for buffered_model in self.buffers.keys():
+            if model is None or buffered_model == model:
+                bulk_insert(self.buffers.pop(buffered_model))
+
+    def restore_user(self, values):
+        values = dict(zip(FIELDS['user'], values))
+        old_id = values.pop('id')
+        try:
+            user = User.objects.get(username=values['username'])
+        except User.DoesNotExist:
+            # Inserted without signals, so that it doesn't get its own new
+            # household and profile
+            user = User(**values)
+            insert_without_signals(user)
+        self.users[old_id] = user.id
+
+    def restore_ingredient(self, values):
+        values = dict(zip(FIELDS['ingredient'], values))
+        old_id = values.pop('id')
+        try:
+            ingredient_id = Ingredient.objects.filter(
+                name=values['name']).values_list('pk', flat=True)[0]
+        except IndexError:
+            ingredient = Ingredient(is_dish=False, **values)
+            insert_without_signals(ingredient)
+            ingredient_id = ingredient.id
+        self.comestibles[old_id] = ingredient_id
+
+    def restore_household(self, values):
+        values = dict(zip(FIELDS['household'], values))
+        self.household = Household(name=values['name'],
+                                   admin_id=self.users[values['admin']],
+                                   is_active=values['is_active'])
+        insert_without_signals(self.household)
+
+    def restore_profile(self, values):
+        values = dict(zip(FIELDS['profile'], values))
+        user_id = self.users[values['user']]
+        # A user who already exists here keeps their current profile
+        if not Profile.objects.filter(user=user_id).exists():
+            self.buffer(Profile(user_id=user_id,
+                                household=self.household,
+                                display_name=values['display_name']))
+
+    def restore_dish(self, values):
+        values = dict(zip(FIELDS['dish'], values))
+        old_id = values.pop('id')
+        dish = Dish(household=self.household, is_dish=True, **values)
+        insert_without_signals(dish)
+        self.dishes[old_id] = self.comestibles[old_id] = dish.id
+
+    def restore_cook(self, values):
+        values = dict(zip(FIELDS['cook'], values))
+        self.buffer(Dish.cooks.through(dish_id=self.dishes[values['dish']],
+                                       user_id=self.users[values['user']]))
+
+    def restore_amount(self, values):
+        values = dict(zip(FIELDS['amount'], values))
+        if values['contained_comestible'] not in self.comestibles:
+            # a dish from another household, which isn't in the backup
+            self.skipped += 1
+            return
+        self.buffer(Amount(containing_dish_id=self.dishes[values['containing_dish']],
+                           contained_comestible_id=self.comestibles[values['contained_comestible']],
+                           quantity=values['quantity'],
+                           calories=values['calories']))
+
+    def restore_meal(self, values):
+        values = dict(zip(FIELDS['meal'], values))
+        old_id = values.pop('id')
+        meal = Meal(household=self.household,
+                    name=values['name'],
+                    date=values['date'],
+                    time=values['time'],
+                    user_id=self.users[values['user']],
+                    calories=values['calories'])
+        insert_without_signals(meal)
+        self.meals[old_id] = meal.id
+
+    def restore_portion(self, values):
+        values = dict(zip(FIELDS['portion'], values))
+        if values['comestible'] not in self.comestibles:
+            self.skipped += 1
+            return
+        self.buffer(Portion(meal_id=self.meals[values['meal']],
+                            comestible_id=self.comestibles[values['comestible']],
+                            quantity=values['quantity'],
+                            calories=values['calories']))
+
+    def restore_totals(self, values):
+        self.totals = values
+
+
+@transaction.commit_on_success
+def restore_household(stream):
+    """
+    Restores a household from a backup written by backup_household() as a new
+    household, and returns it. Raises BackupError (and restores nothing) if
+    the backup can't be read, or if the restored household's totals don't
+    match the backup's.
+    """
+    restore = _Restore()
+    records = read_records(gzip.GzipFile(fileobj=stream, mode='rb'))
+    try:
+        header = records.next()
+    except (StopIteration, BackupError):
+        raise BackupError(u'This is not a household backup.')
+    if not isinstance(header, dict) or header.get('version') != FORMAT_VERSION:
+        raise BackupError(u'This backup has an unknown format version.')
+    if header.get('fields') != FIELDS:
+        raise BackupError(u'This backup has different fields to this version of the site.')
+    for record_type, values in records:
+        # Everything a record refers to comes before it in the backup, but
+        # buffered rows need to be inserted before anything refers to them
+        if record_type in ('dish', 'meal', 'totals'):
+            restore.flush()
+        getattr(restore, 'restore_%s' % record_type)(values)
+    restore.flush()
+
+    if restore.household is None or restore.totals is None:
+        raise BackupError(u'The backup is incomplete.')
+    _check_totals(restore)
+    update_dish_ingredients(restore.dishes.values())
+    update_meal_ingredients(restore.meals.values())
+    update_household_summaries(restore.dishes.values(), restore.meals.values())
+    return restore.household
+
+def _check_totals(restore):
+    """
+    Raises BackupError if the restored household's totals don't match those
+    in the backup.
+    """
+    actual = _totals(restore.household)
+    expected = restore.totals[:4] + [_rounded(total) for total in restore.totals[4:]]
+    # Amounts and portions of dishes from other households (which aren't in
+    # the backup) were skipped, but the dishes' and meals' calories were
+    # copied from the backup so they should still match
+    if (actual[0] != expected[0] or actual[2] != expected[2] or
+            actual[1] + actual[3] + restore.skipped != expected[1] + expected[3] or
+            actual[4:] != expected[4:]):
+        raise BackupError(u'The restored household does not match the backup '
+                          u'(expected %s, restored %s).' % (expected, actual))
@@ -0,0 +1,289 @@
+"""
+Times the main operations of the food app against the data already in the
+database (e.g. made by generate_food_dataset), for the bench_food management
+command.
+
+Each operation is run a number of times through the test client, logged in
+as a member of the household being benchmarked, and reported with
+percentiles of its time and its query counts, as a dict which can be dumped
+as JSON and compared with earlier runs. Operations which change data undo
+their changes between runs, outside the timings.
+"""
+import datetime
+import time
+from decimal import Decimal
+
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+from django.core.urlresolvers import reverse
+from django.forms.models import inlineformset_factory
+from django.test.client import Client
+
+from django.contrib.auth.models import User
+
+from food.caching import invalidate_detail
+from food.models import Ingredient, Dish, DishForm, Amount, Meal, MealForm, Portion
+
+
+BENCHMARK_PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, percent):
+    """
+    Returns the value at the given percentile of a list of numbers (the
+    nearest one, rather than interpolating).
+    """
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def _form_data(form):
+    """
+    Returns the POST data which would submit form (a model form or a formset
+    form) unchanged.
+    """
+    data = {}
+    for name, field in form.fields.items():
+        value = form.initial.get(name, field.initial)
+        if callable(value):
+            value = value()
+        if value is None or value is False:
+            continue
+        if isinstance(value, (list, tuple)):
+            data[form.add_prefix(name)] = [unicode(item) for item in value]
+        elif isinstance(value, (datetime.date, datetime.time)):
+            data[form.add_prefix(name)] = value.isoformat()
+        else:
+            data[form.add_prefix(name)] = unicode(value)
+    return data
+
+
+def _formset_data(form, formset):
+    data = _form_data(form)
+    management_form = formset.management_form
+    for name in management_form.fields:
+        data[management_form.add_prefix(name)] = unicode(management_form.initial[name])
+    for subform in formset.forms:
+        data.update(_form_data(subform))
+    return data
+
+
+class Benchmark(object):
+    """
+    Runs the operations against one household, logged in as username.
+    """
+    def __init__(self, username, password, repeat=10):
+        self.repeat = repeat
+        self.client = Client()
+        if not self.client.login(username=username, password=password):
+            raise ValueError("can't log in as '%s'" % username)
+        self.user = User.objects.get(username=username)
+        self.household = self.user.profile.household
+
+    def measure(self, operation, setup=None, teardown=None):
+        """
+        Runs operation self.repeat times, calling setup and teardown (if
+        given) before and after each run, outside the timings, and returns a
+        dict of statistics of the runs' times (in milliseconds) and query
+        counts.
+        """
+        times = []
+        queries = []
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        # (otherwise each request made by the client clears the queries)
+        request_started.disconnect(reset_queries)
+        try:
+            for run in range(self.repeat):
+                state = setup and setup(run)
+                first_query = len(connection.queries)
+                started = time.time()
+                operation(run, state)
+                times.append((time.time() - started) * 1000)
+                queries.append(len(connection.queries) - first_query)
+                if teardown:
+                    teardown(run, state)
+                reset_queries()
+        finally:
+            request_started.connect(reset_queries)
+            connection.use_debug_cursor = use_debug_cursor
+        result = {
+            'runs': len(times),
+            'min_ms': round(min(times), 2),
+            'max_ms': round(max(times), 2),
+            'mean_ms': round(sum(times) / len(times), 2),
+            'min_queries': min(queries),
+            'max_queries': max(queries),
+        }
+        for percent in BENCHMARK_PERCENTILES:
+            result['p%s_ms' % percent] = round(percentile(times, percent), 2)
+        return result
+
+    def _get(self, url, data=None):
+        response = self.client.get(url, data or {})
+        if response.status_code != 200:
+            raise AssertionError('GET %s returned %s' % (url, response.status_code))
+        return response
+
+    def _post(self, url, data):
+        response = self.client.post(url, data)
+        if response.status_code != 302:
+            raise AssertionError('POST %s returned %s' % (url, response.status_code))
+        return response
+
+    def _new_id(self, response):
+        # The id at the end of the URL a duplicate view redirects to
+        return int(response['Location'].rstrip('/').split('/')[-1])
+
+    def ingredient_edit(self):
+        # Saving an ingredient recalculates everything containing it
+        ingredient = Ingredient.objects.get(pk=Amount.objects.filter(
+            containing_dish__household=self.household,
+            contained_comestible__is_dish=False).values_list(
+            'contained_comestible', flat=True)[0])
+        original = ingredient.calories
+
+        def operation(run, state):
+            ingredient.calories = original + (run % 2 == 0 and 1 or 0)
+            ingredient.save()
+
+        result = self.measure(operation)
+        ingredient.calories = original
+        ingredient.save()
+        return result
+
+    def _dish(self):
+        # The latest dish containing another dish
+        return Dish.objects.filter(household=self.household,
+                                   amount__contained_comestible__is_dish=True).latest('date_cooked')
+
+    def dish_formset_save(self):
+        dish = self._dish()
+        DishFormSet = inlineformset_factory(Dish, Amount, fk_name="containing_dish",
+                                            extra=0)
+        data = _formset_data(DishForm(instance=dish), DishFormSet(instance=dish))
+        quantity_key = 'amount_set-0-quantity'
+        original = data[quantity_key]
+        url = reverse('dish_edit', args=[dish.id])
+
+        def operation(run, state):
+            data[quantity_key] = run % 2 == 0 and unicode(float(original) + 1) or original
+            self._post(url, data)
+
+        result = self.measure(operation)
+        data[quantity_key] = original
+        self._post(url, data)
+        return result
+
+    def meal_formset_save(self):
+        portion = Portion.objects.filter(meal__household=self.household,
+                                         comestible__is_dish=False).latest('meal__date')
+        meal = portion.meal
+        MealFormSet = inlineformset_factory(Meal, Portion, extra=0)
+        formset = MealFormSet(instance=meal)
+        data = _formset_data(MealForm(instance=meal), formset)
+        position = [form.instance.id for form in formset.forms].index(portion.id)
+        quantity_key = 'portion_set-%s-quantity' % position
+        original = data[quantity_key]
+        url = reverse('meal_edit', args=[meal.id])
+
+        def operation(run, state):
+            data[quantity_key] = run % 2 == 0 and unicode(float(original) + 1) or original
+            self._post(url, data)
+
+        result = self.measure(operation)
+        data[quantity_key] = original
+        self._post(url, data)
+        return result
+
+    def _archive_date(self):
+        # A day in the middle of the household's meals
+        meals = Meal.objects.filter(household=self.household).order_by('date')
+        return meals[meals.count() // 2].date
+
+    def meal_archive_month(self):
+        date = self._archive_date()
+        url = reverse('meal_archive_month', args=[date.year, '%02d' % date.month])
+        return self.measure(lambda run, state: self._get(url))
+
+    def meal_archive_week(self):
+        date = self._archive_date()
+        # (weeks in the URL start on Monday and are numbered as by %W)
+        url = reverse('meal_archive_week', args=[date.year, int(date.strftime('%W'))])
+        return self.measure(lambda run, state: self._get(url))
+
+    def meal_archive_day(self):
+        date = self._archive_date()
+        url = reverse('meal_archive_day', args=[date.year, '%02d' % date.month,
+                                                '%02d' % date.day])
+        return self.measure(lambda run, state: self._get(url))
+
+    def dish_detail(self):
+        # Without the cached content, which dish_detail_cached uses
+        dish = self._dish()
+        url = reverse('dish_detail', args=[dish.id])
+        return self.measure(lambda run, state: self._get(url),
+                            setup=lambda run: invalidate_detail('dish', [dish.id]))
+
+    def dish_detail_cached(self):
+        dish = self._dish()
+        url = reverse('dish_detail', args=[dish.id])
+        self._get(url)
+        return self.measure(lambda run, state: self._get(url))
+
+    def dish_duplicate(self):
+        dish = self._dish()
+        url = reverse('dish_duplicate', args=[dish.id])
+        new_ids = []
+
+        def operation(run, state):
+            new_ids.append(self._new_id(self._post(url, {'date': dish.date_cooked.isoformat()})))
+
+        def teardown(run, state):
+            Dish.objects.get(pk=new_ids.pop()).delete()
+
+        return self.measure(operation, teardown=teardown)
+
+    def meal_duplicate(self):
+        meal = Meal.objects.filter(household=self.household).latest('date')
+        url = reverse('meal_duplicate', args=[meal.id])
+        new_ids = []
+
+        def operation(run, state):
+            new_ids.append(self._new_id(self._post(url, {'date': meal.date.isoformat()})))
+
+        def teardown(run, state):
+            Meal.objects.get(pk=new_ids.pop()).delete()
+
+        return self.measure(operation, teardown=teardown)
+
+    def dish_multiply(self):
+        # Doubles the dish and halves it again on alternate runs
+        dish = self._dish()
+        url = reverse('dish_multiply', args=[dish.id])
+
+        def operation(run, state):
+            self._post(url, {'operation': run % 2 == 0 and 'multiply' or 'divide',
+                             'factor': '2'})
+
+        result = self.measure(operation)
+        if self.repeat % 2:
+            Dish.objects.get(pk=dish.id).scale(Decimal('0.5'))
+        return result
+
+
+# Names of the Benchmark methods run by run_benchmarks, in order
+BENCHMARKS = ['ingredient_edit', 'dish_formset_save', 'meal_formset_save',
+              'meal_archive_month', 'meal_archive_week', 'meal_archive_day',
+              'dish_detail', 'dish_detail_cached', 'dish_duplicate',
+              'meal_duplicate', 'dish_multiply']
+
+
+def run_benchmarks(username, password, repeat=10, names=None):
+    """
+    Runs the benchmarks named in names (or all of them) as username, and
+    returns a dict of their results keyed by name.
+    """
+    benchmark = Benchmark(username, password, repeat)
+    return dict((name, getattr(benchmark, name)()) for name in names or BENCHMARKS)
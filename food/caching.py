@@ -0,0 +1,52 @@
+"""
+Versions for the cached content of the dish and meal detail pages.
+
+Each dish and meal has a version in the cache, which is part of the key of
+its page's cached content (see the {% cache %} tags in dish_detail.html and
+meal_detail.html). Whatever changes what one of those pages shows deletes the
+versions of the dishes and meals affected (the signal receivers in
+food.models for single saves and deletes, and the bulk operations there for
+everything else), so the next request gets a new version and renders the
+content again, and the old content is never used again and expires.
+
+A new version is random rather than the next number, so that a version which
+has been evicted from the cache can't come back with content left over from
+before.
+"""
+import uuid
+
+from django.core.cache import cache
+
+from food.metrics import DETAIL_CACHE_LOOKUPS
+
+
+# Seconds that versions and cached content are kept for
+DETAIL_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _version_key(kind, pk):
+    return 'food:%s:%s:version' % (kind, pk)
+
+def get_detail_version(kind, pk):
+    """
+    Returns the current version of the detail page of the dish or meal (kind
+    is 'dish' or 'meal') with the given id.
+    """
+    key = _version_key(kind, pk)
+    version = cache.get(key)
+    if version is None:
+        DETAIL_CACHE_LOOKUPS.inc(kind=kind, result='miss')
+        version = uuid.uuid4().hex
+        cache.set(key, version, DETAIL_CACHE_TIMEOUT)
+    else:
+        DETAIL_CACHE_LOOKUPS.inc(kind=kind, result='hit')
+    return version
+
+def invalidate_detail(kind, pks):
+    """
+    Makes the cached detail pages of the dishes or meals with the given ids
+    out of date.
+    """
+    keys = [_version_key(kind, pk) for pk in set(pks) if pk is not None]
+    if keys:
+        cache.delete_many(keys)
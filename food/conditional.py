@@ -0,0 +1,97 @@
+"""
+Conditional GET (ETag and Last-Modified) for the meal archive pages and the
+dish and meal detail pages, so that a browser re-checking a page which hasn't
+changed gets a 304 Not Modified without the page being rendered.
+
+The validators are worked out from a few aggregate queries (or, for the
+detail pages, from the versions of their cached content; see food.caching)
+instead of from the page itself. Every ETag also depends on the user (whose
+name is in each page's header) and on today's date (which naturalday
+depends on).
+"""
+import datetime
+import hashlib
+
+from django.db.models import Count, Max, Min
+from django.views.decorators.http import condition
+
+from food.caching import get_detail_version
+from food.households import request_household
+from food.models import Meal
+
+
+def _etag(request, *values):
+    return hashlib.md5(repr((request.user.id, datetime.date.today()) +
+                            values)).hexdigest()
+
+def _conditional(get_validators):
+    """
+    Returns a decorator like django's condition(), where get_validators is
+    called with the view's arguments and returns an (etag, last_modified)
+    tuple, and is only called once per request.
+    """
+    def validators(request, *args, **kwargs):
+        if not hasattr(request, '_food_validators'):
+            request._food_validators = get_validators(request, *args, **kwargs)
+        return request._food_validators
+    return condition(
+        etag_func=lambda *args, **kwargs: validators(*args, **kwargs)[0],
+        last_modified_func=lambda *args, **kwargs: validators(*args, **kwargs)[1])
+
+def meal_range_validators(request, date_range=None):
+    """
+    Returns an (etag, last_modified) tuple for a page showing the meals with
+    dates in date_range (a (first day, last day) tuple, or None for all
+    meals), and links to the nearest dates with meals either side of it.
+
+    The ETag includes the number of meals, so that it changes when one is
+    deleted, and the nearest dates. Saving a portion saves its meal, so the
+    meals' updated_at covers their portions too. Only the meals of the user's
+    household are counted, as only they are shown.
+    """
+    all_meals = meals = Meal.objects.for_household(request_household(request))
+    previous_date = next_date = None
+    if date_range is not None:
+        meals = meals.filter(date__range=date_range)
+        previous_date = all_meals.filter(date__lt=date_range[0]).aggregate(
+                            date=Max('date'))['date']
+        next_date = all_meals.filter(date__gt=date_range[1]).aggregate(
+                        date=Min('date'))['date']
+    totals = meals.aggregate(count=Count('id'), last_modified=Max('updated_at'))
+    return (_etag(request, totals['count'], totals['last_modified'],
+                  previous_date, next_date),
+            totals['last_modified'])
+
+def meal_range_condition(get_date_range):
+    """
+    Returns a decorator adding conditional GET to a meal archive view, where
+    get_date_range is called with the view's arguments and returns the range
+    of dates the page shows (or None for all meals). If it raises ValueError
+    (for dates in the URL which don't exist) the view is called as normal.
+    """
+    def get_validators(request, *args, **kwargs):
+        try:
+            date_range = get_date_range(*args, **kwargs)
+        except ValueError:
+            return None, None
+        return meal_range_validators(request, date_range)
+    return _conditional(get_validators)
+
+def detail_condition(kind):
+    """
+    Returns a decorator adding conditional GET to the detail view of a dish or
+    meal (kind is 'dish' or 'meal'), with its cached content's version as the
+    ETag.
+
+    Meals also get a Last-Modified (saving a portion saves its meal), but
+    dishes don't, since their pages also show things which don't change the
+    dish, like the meals their portions are in.
+    """
+    def get_validators(request, pk):
+        last_modified = None
+        if kind == 'meal':
+            last_modified = Meal.objects.for_household(
+                                request_household(request)).filter(pk=pk).aggregate(
+                                last_modified=Max('updated_at'))['last_modified']
+        return (_etag(request, get_detail_version(kind, pk)), last_modified)
+    return _conditional(get_validators)
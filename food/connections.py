@@ -0,0 +1,97 @@
+"""
+Persistent database connections, for PostgreSQL (or any database server).
+
+Django opens a new connection for each request and closes it at the end,
+which with a database server costs a connection (and for PostgreSQL a new
+server process) per request. With PersistentConnectionMiddleware each
+process keeps its connections for FOOD_DB_CONN_MAX_AGE seconds instead: at
+the end of each request any transaction left open is rolled back (so that
+the connection isn't left "idle in transaction", holding locks), and the
+connection is only closed if it's older than that, or broken (e.g. by the
+server restarting), so that the next request opens a new one.
+
+The same settings work with a connection pooler like PgBouncer between the
+processes and PostgreSQL (see DATABASES in settings.py); keeping the
+connections to the pooler as well saves opening one per request.
+
+SQLite connections are cheap to open (and an in-memory test database is
+lost when its connection is closed), so they're left to Django. So are
+connections in the middle of a managed transaction, like those of tests
+using the test client.
+"""
+import time
+
+from django.conf import settings
+from django.core import signals
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import close_connection, connections
+from django.db.backends.signals import connection_created
+
+
+# Seconds each connection is kept for; 0 to close it after every request (as
+# Django does) and None to keep it until it breaks
+DB_CONN_MAX_AGE = getattr(settings, 'FOOD_DB_CONN_MAX_AGE', 0)
+
+
+def _is_persistent(conn):
+    return 'sqlite3' not in conn.settings_dict['ENGINE']
+
+def _is_broken(conn):
+    # (psycopg2 connections know if they've been closed by the server)
+    return bool(getattr(conn.connection, 'closed', False))
+
+def finish_connection(conn, now=None, max_age=DB_CONN_MAX_AGE):
+    """
+    Ends the current transaction of conn (a connection from
+    django.db.connections) at the end of a request, and closes it if it's
+    broken, or more than max_age seconds old (unless max_age is None).
+    """
+    if conn.connection is None or conn.is_managed():
+        return
+    if now is None:
+        now = time.time()
+    # (connections opened before the middleware was loaded are counted from
+    # the end of their first request)
+    opened_at = getattr(conn, '_food_opened_at', None)
+    if opened_at is None:
+        opened_at = conn._food_opened_at = now
+    if _is_broken(conn) or (max_age is not None and now - opened_at >= max_age):
+        conn.close()
+        return
+    try:
+        conn._rollback()
+    except Exception:
+        # (the connection can't be used any more)
+        conn.close()
+
+def remember_opened_at(sender, connection, **kwargs):
+    connection._food_opened_at = time.time()
+
+def close_broken_connections(**kwargs):
+    for conn in connections.all():
+        if conn.connection is not None and _is_persistent(conn) and _is_broken(conn):
+            conn.close()
+
+def finish_connections(**kwargs):
+    for conn in connections.all():
+        if _is_persistent(conn):
+            finish_connection(conn)
+        else:
+            conn.close()
+
+
+class PersistentConnectionMiddleware(object):
+    """
+    Keeps each process's database connections between requests (see the
+    module docstring). This only does anything when the middleware is loaded,
+    once per process, replacing Django's closing of the connections at the
+    end of every request.
+    """
+    def __init__(self):
+        if DB_CONN_MAX_AGE == 0 or not any(_is_persistent(conn)
+                                           for conn in connections.all()):
+            raise MiddlewareNotUsed
+        connection_created.connect(remember_opened_at)
+        signals.request_started.connect(close_broken_connections)
+        signals.request_finished.disconnect(close_connection)
+        signals.request_finished.connect(finish_connections)
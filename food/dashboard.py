@@ -0,0 +1,65 @@
+"""
+The statistics on a household's dashboard (its page, for its members): each
+member's calories this week and number of dishes cooked, the household's
+leftovers, and the ingredients in most of its meals.
+
+They all come from the household summaries in food.models (MemberDay,
+MemberTotals, Leftover and HouseholdIngredient), which are kept up to date as
+meals, portions and dishes change, so the dashboard takes a fixed number of
+queries, each reading at most a week's (or a few days') worth of rows,
+however long the household's history is.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Sum
+
+from food.models import HouseholdIngredient, Leftover, MemberDay, MemberTotals
+
+
+# Leftovers of dishes cooked more than this many days ago aren't shown (since
+# they've probably been thrown away rather than eaten by now)
+LEFTOVER_DAYS = getattr(settings, 'FOOD_LEFTOVER_DAYS', 7)
+
+# Number of the household's most used ingredients shown
+TOP_INGREDIENTS = 10
+
+
+def household_dashboard(household, members, today=None):
+    """
+    Returns a dict of the statistics for household's dashboard:
+
+        week_start: the Monday of this week
+        members: a list of dicts, one for each user in members, with the user
+            and their calories this week and dishes cooked
+        leftovers: the Leftovers of the dishes cooked in the last
+            LEFTOVER_DAYS days, newest first, with their dishes
+        top_ingredients: the household's TOP_INGREDIENTS most used
+            HouseholdIngredients, with their ingredients
+    """
+    if today is None:
+        today = datetime.date.today()
+    week_start = today - datetime.timedelta(today.weekday())
+    week_calories = dict(MemberDay.objects.filter(
+        household=household,
+        date__range=(week_start, week_start + datetime.timedelta(days=6)))
+        .values_list('user').annotate(Sum('calories')))
+    dishes_cooked = dict(MemberTotals.objects.filter(household=household)
+                                             .values_list('user', 'dishes_cooked'))
+    member_stats = [{'user': member,
+                     'week_calories': week_calories.get(member.id) or 0,
+                     'dishes_cooked': dishes_cooked.get(member.id, 0)}
+                    for member in members]
+    leftovers = Leftover.objects.filter(
+        household=household,
+        date_cooked__gte=today - datetime.timedelta(days=LEFTOVER_DAYS)
+    ).select_related('dish').order_by('-date_cooked')
+    top_ingredients = HouseholdIngredient.objects.filter(
+        household=household, meals__gt=0).select_related('ingredient').order_by(
+        '-meals', 'ingredient__name')[:TOP_INGREDIENTS]
+    return {
+        'week_start': week_start,
+        'members': member_stats,
+        'leftovers': list(leftovers),
+        'top_ingredients': list(top_ingredients),
+    }
@@ -0,0 +1,257 @@
+"""
+Generates a large synthetic dataset of households, users, ingredients,
+nested dishes and meals, for benchmarking (see the generate_food_dataset and
+bench_food management commands).
+
+Everything is inserted with the bulk helpers in food.models rather than saved
+one object at a time, so the calories of the amounts, dishes, portions and
+meals are worked out here as they are generated (as their save() methods
+would), and the ingredient index and household summaries are rebuilt at the
+end. Each dish is only eaten, or used in another dish, up to its quantity,
+so the data passes the same validation as data entered through the forms.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+from django.db import transaction
+
+from django.contrib.auth.models import User
+
+from food.models import (Ingredient, Dish, Amount, Meal, Portion, bulk_insert,
+                         insert_without_signals, update_dish_ingredients,
+                         update_meal_ingredients, update_household_summaries)
+
+
+# Password of every generated user
+DATASET_PASSWORD = 'password'
+
+# Meal names and times, in the order meals are generated within a day
+DATASET_MEALS = [
+    ('breakfast', datetime.time(8, 0)),
+    ('lunch', datetime.time(13, 0)),
+    ('dinner', datetime.time(19, 0)),
+    ('snack', datetime.time(16, 0)),
+    ('elevenses', datetime.time(11, 0)),
+]
+
+_INGREDIENT_WORDS = ['apple', 'bean', 'butter', 'carrot', 'cheese', 'chicken',
+                     'flour', 'garlic', 'lentil', 'milk', 'mushroom', 'oat',
+                     'onion', 'pasta', 'pepper', 'potato', 'rice', 'spinach',
+                     'sugar', 'tomato']
+_INGREDIENT_KINDS = ['dried', 'fresh', 'frozen', 'organic', 'raw', 'smoked',
+                     'tinned', 'wholemeal']
+_DISH_WORDS = ['bake', 'curry', 'pie', 'risotto', 'salad', 'sauce', 'soup',
+               'stew', 'stir fry', 'stock']
+
+_CENT = Decimal('0.01')
+
+
+def _round(value):
+    return value.quantize(_CENT)
+
+
+def _quantity(rng, ingredient, low, high):
+    # A few items, or between low and high grams or ml
+    if ingredient.unit == 'items':
+        return Decimal(rng.randint(1, 4))
+    return Decimal(rng.randint(low, high))
+
+
+def _create_users(prefix, households, users_per_household):
+    """
+    Returns a list of (household, [users]) tuples. The first user of each
+    household is its admin, and the other users are moved into it from the
+    households created for them.
+    """
+    result = []
+    for household_number in range(households):
+        users = []
+        for user_number in range(users_per_household):
+            users.append(User.objects.create_user(
+                '%s%s_%s' % (prefix, household_number, user_number),
+                '%s%s_%s@example.com' % (prefix, household_number, user_number),
+                DATASET_PASSWORD))
+        household = users[0].profile.household
+        for user in users[1:]:
+            own_household = user.profile.household
+            profile = user.profile
+            profile.household = household
+            profile.save()
+            own_household.delete()
+        result.append((household, users))
+    return result
+
+
+def _create_ingredients(rng, prefix, count):
+    """
+    Returns a list of count new ingredients, with up to 9 calories per gram or
+    ml, or 300 per item.
+    """
+    ingredients = []
+    for number in range(count):
+        ingredient = Ingredient(
+            name=u'%s %s %s %s' % (rng.choice(_INGREDIENT_KINDS),
+                                   rng.choice(_INGREDIENT_WORDS), prefix, number),
+            quantity=Decimal(100),
+            unit=rng.choice(['g', 'g', 'g', 'ml', 'items']),
+            calories=Decimal(rng.randint(0, 900)),
+            is_dish=False)
+        if ingredient.unit == 'items':
+            ingredient.quantity = Decimal(1)
+            ingredient.calories = Decimal(rng.randint(0, 300))
+        insert_without_signals(ingredient)
+        ingredients.append(ingredient)
+    return ingredients
+
+
+def _create_dish(name, household, user, date_cooked, contents):
+    """
+    Inserts a dish cooked by user containing contents, a list of
+    (comestible, quantity) tuples, and returns it with its amounts.
+    """
+    amounts = []
+    for comestible, quantity in contents:
+        amounts.append(Amount(contained_comestible_id=comestible.id,
+                              quantity=quantity,
+                              calories=_round(quantity * comestible.calories /
+                                              comestible.quantity)))
+    dish = Dish(name=name,
+                quantity=sum(amount.quantity for amount in amounts),
+                date_cooked=date_cooked,
+                household=household,
+                unit='g',
+                calories=sum(amount.calories for amount in amounts),
+                is_dish=True)
+    insert_without_signals(dish)
+    dish.cooks.add(user)
+    for amount in amounts:
+        amount.containing_dish_id = dish.id
+    return dish, amounts
+
+
+def _create_dishes(rng, household, users, ingredients, count, depth, fanout,
+                   first_date, days):
+    """
+    Returns a list of count new dishes cooked by the household over days days
+    from first_date, each with fanout amounts. Each dish contains a dish
+    cooked on the same day (made from part of it), which contains another,
+    and so on, depth dishes deep; only the top dishes are returned, as the
+    others are used up by the dishes containing them.
+    """
+    top_dishes = []
+    amounts = []
+    for number in range(count):
+        date_cooked = first_date + datetime.timedelta(
+                          days=number * days // max(count, 1))
+        user = rng.choice(users)
+        word = rng.choice(_DISH_WORDS)
+        dish = None
+        for level in range(depth, -1, -1):
+            contents = [(ingredient, _quantity(rng, ingredient, 5, 300))
+                        for ingredient in rng.sample(ingredients,
+                                                     min(fanout, len(ingredients)))]
+            if dish is not None:
+                contents[-1] = (dish, _round(dish.quantity / 2))
+            name = u'%s %s %s' % (word, level and u'base %s' % level or u'', number)
+            dish, dish_amounts = _create_dish(u' '.join(name.split()),
+                                              household, user, date_cooked,
+                                              contents)
+            amounts.extend(dish_amounts)
+        top_dishes.append(dish)
+    bulk_insert(amounts)
+    return top_dishes
+
+
+def _create_meals(rng, household, users, ingredients, dishes, first_date,
+                  days, meals_per_day, portions_per_meal):
+    """
+    Creates meals_per_day meals for each user on each of days days from
+    first_date, each with portions_per_meal portions, and returns the new
+    meals. Dinners start with a portion of the latest dish cooked (if any is
+    left), shared between the household's users.
+    """
+    meal_times = DATASET_MEALS[:meals_per_day]
+    dishes = sorted(dishes, key=lambda dish: dish.date_cooked)
+    remaining = dict((dish.id, dish.quantity) for dish in dishes)
+    meals = []
+    portions = []
+    for day in range(days):
+        date = first_date + datetime.timedelta(days=day)
+        cooked = [dish for dish in dishes if dish.date_cooked <= date]
+        for user in users:
+            for name, time in meal_times:
+                contents = []
+                if name == 'dinner' and cooked:
+                    dish = cooked[-1]
+                    quantity = min(remaining[dish.id],
+                                   _round(dish.quantity / (2 * len(users))))
+                    if quantity > 0:
+                        remaining[dish.id] -= quantity
+                        contents.append((dish, quantity))
+                for ingredient in rng.sample(ingredients,
+                                             min(portions_per_meal - len(contents),
+                                                 len(ingredients))):
+                    contents.append((ingredient, _quantity(rng, ingredient, 10, 200)))
+                meal_portions = [Portion(comestible_id=comestible.id,
+                                         quantity=quantity,
+                                         calories=_round(quantity *
+                                                         comestible.calories /
+                                                         comestible.quantity))
+                                 for comestible, quantity in contents]
+                meal = Meal(name=name, date=date, time=time,
+                            household=household, user=user,
+                            calories=sum(portion.calories
+                                         for portion in meal_portions))
+                insert_without_signals(meal)
+                for portion in meal_portions:
+                    portion.meal_id = meal.id
+                meals.append(meal)
+                portions.extend(meal_portions)
+    bulk_insert(portions)
+    return meals
+
+
+@transaction.commit_on_success
+def generate_dataset(households=1, users_per_household=2, ingredients=500,
+                     dishes=100, depth=2, fanout=5, days=365, meals_per_day=3,
+                     portions_per_meal=3, prefix='bench', seed=0):
+    """
+    Generates a dataset and returns a dict of the numbers of objects created.
+
+    The ingredients are shared by all the households. Each household gets
+    dishes dishes (each containing depth more) and meals_per_day meals for
+    each of its users for the last days days, up to today. Usernames are
+    prefix followed by the household and user numbers, e.g. bench0_1, and
+    the same seed always generates the same data.
+    """
+    rng = random.Random(seed)
+    first_date = datetime.date.today() - datetime.timedelta(days=days - 1)
+    households_and_users = _create_users(prefix, households, users_per_household)
+    new_ingredients = _create_ingredients(rng, prefix, ingredients)
+    dish_ids = []
+    meal_ids = []
+    for household, users in households_and_users:
+        top_dishes = _create_dishes(rng, household, users, new_ingredients,
+                                    dishes, depth, fanout, first_date, days)
+        dish_ids.extend(Dish.objects.filter(household=household).values_list(
+                            'pk', flat=True))
+        meals = _create_meals(rng, household, users, new_ingredients,
+                              top_dishes, first_date, days, meals_per_day,
+                              portions_per_meal)
+        meal_ids.extend(meal.id for meal in meals)
+    update_dish_ingredients(dish_ids)
+    update_meal_ingredients(meal_ids)
+    update_household_summaries(dish_ids, meal_ids)
+    return {
+        'households': households,
+        'users': households * users_per_household,
+        'ingredients': ingredients,
+        'dishes': len(dish_ids),
+        'amounts': sum(Amount.objects.filter(
+                           containing_dish__household=household).count()
+                       for household, users in households_and_users),
+        'meals': len(meal_ids),
+        'portions': sum(Portion.objects.filter(meal__household=household).count()
+                        for household, users in households_and_users),
+    }
@@ -0,0 +1,100 @@
+"""
+Finding and merging duplicate ingredients, like "Apples" and "Apple, raw",
+which imports (see the import_ingredients command) tend to leave behind.
+
+Ingredients are compared by their normalised names (without case,
+punctuation, plurals, word order or words like "raw"), and then by the
+trigrams of those names, as in food.search. Only ingredients with the same
+unit are compared, since amounts and portions of an ingredient measured in
+grams can't be moved to one measured in millilitres.
+
+The duplicates found can then be merged with merge_duplicates().
+"""
+import re
+
+from food.models import Ingredient, merge_ingredients
+from food.search import search_index, trigrams
+
+
+# Words which don't make an ingredient a different one
+IGNORED_WORDS = frozenset(['raw', 'fresh', 'whole', 'plain'])
+
+# Lowest similarity (the Dice coefficient of two normalised names' trigrams)
+# at which two ingredients are reported as possible duplicates
+MIN_SIMILARITY = 0.7
+
+_non_word = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def _singular(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+def normalise_name(name):
+    """
+    Returns name in lower case, with its words singular and in alphabetical
+    order, and without punctuation or IGNORED_WORDS (unless it's only made of
+    those).
+    """
+    words = _non_word.sub(u' ', name.lower()).split()
+    words = [word for word in words if word not in IGNORED_WORDS] or words
+    return u' '.join(sorted(_singular(word) for word in words))
+
+def find_duplicate_ingredients(min_similarity=MIN_SIMILARITY):
+    """
+    Returns a list of (similarity, (id, name), (id, name)) tuples for the
+    pairs of ingredients (with the same unit) whose normalised names are at
+    least min_similarity alike, most alike first. Ingredients with the same
+    normalised name have a similarity of 1.
+
+    The whole catalogue is read with one query, and each normalised name is
+    only compared with those sharing at least one of its trigrams.
+    """
+    # (unit, normalised name) -> [(id, name)]
+    by_key = {}
+    for pk, name, unit in Ingredient.objects.order_by('pk').values_list(
+            'pk', 'name', 'unit').iterator():
+        by_key.setdefault((unit, normalise_name(name)), []).append((pk, name))
+    keys = sorted(by_key)
+    grams = [trigrams(key[1]) for key in keys]
+    # (unit, trigram) -> indexes in keys of the names containing it
+    postings = {}
+    for index, key in enumerate(keys):
+        for gram in grams[index]:
+            postings.setdefault((key[0], gram), []).append(index)
+
+    pairs = []
+    for index, key in enumerate(keys):
+        ingredients = by_key[key]
+        for position, first in enumerate(ingredients):
+            for second in ingredients[position + 1:]:
+                pairs.append((1.0, first, second))
+        # (only names later in keys, so that each pair is counted once)
+        shared = {}
+        for gram in grams[index]:
+            for other in postings[(key[0], gram)]:
+                if other > index:
+                    shared[other] = shared.get(other, 0) + 1
+        for other, count in shared.iteritems():
+            similarity = 2.0 * count / (len(grams[index]) + len(grams[other]))
+            if similarity >= min_similarity:
+                for first in ingredients:
+                    for second in by_key[keys[other]]:
+                        pairs.append((similarity, first, second))
+    pairs.sort(key=lambda pair: (-pair[0], pair[1][1].lower(), pair[2][1].lower()))
+    return pairs
+
+def merge_duplicates(ingredient, duplicate_ids):
+    """
+    Merges the ingredients with the given ids into ingredient (see
+    food.models.merge_ingredients()), and removes them from the search index,
+    as they're deleted without the signals which would.
+    """
+    merge_ingredients(ingredient, duplicate_ids)
+    for pk in set(duplicate_ids) - set([ingredient.pk]):
+        search_index.remove(pk)
@@ -0,0 +1,120 @@
+"""
+Streaming exports of meal history, shared by the meal_export view and the
+export_meals management command.
+
+Meals are read a chunk at a time (seeking from the last meal of the previous
+chunk, so every chunk costs the same), with one more query per chunk for the
+portions and the names of their comestibles, and each line is yielded as soon
+as it's ready, so memory use doesn't depend on the length of the history.
+"""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import simplejson
+
+from food.models import Portion
+
+
+# Number of meals read from the database at a time
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-json-stream',
+}
+
+CSV_HEADER = ['date', 'time', 'meal', 'user', 'meal calories', 'comestible',
+              'quantity', 'unit', 'calories']
+
+
+def iter_meals(meals, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields (meal, portions) tuples for every meal in the queryset meals, in
+    date and time order, where portions is a list of dicts with the name,
+    quantity, unit and calories of each portion in the meal.
+    """
+    meals = meals.select_related('user').order_by('date', 'time', 'id')
+    last = None
+    while True:
+        chunk = meals
+        if last is not None:
+            chunk = chunk.filter(Q(date__gt=last.date) |
+                                 Q(date=last.date, time__gt=last.time) |
+                                 Q(date=last.date, time=last.time, id__gt=last.id))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        portions = {}
+        for (meal_id, ingredient_name, dish_name, quantity, unit,
+             calories) in Portion.objects.filter(
+                 meal__in=[meal.id for meal in chunk]).order_by('id').values_list(
+                 'meal', 'comestible__ingredient__name', 'comestible__dish__name',
+                 'quantity', 'comestible__unit', 'calories'):
+            portions.setdefault(meal_id, []).append({
+                'comestible': ingredient_name or dish_name,
+                'quantity': quantity,
+                'unit': unit,
+                'calories': calories,
+            })
+        for meal in chunk:
+            yield meal, portions.get(meal.id, [])
+        last = chunk[-1]
+
+
+class _Echo(object):
+    """
+    A file-like object which returns what's written to it, so that
+    csv.writer.writerow() returns each line instead of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    return unicode(value).encode('utf-8')
+
+
+def export_csv(meals):
+    """
+    Yields a header line and then one CSV line per portion (or per meal, for
+    meals without any portions) of the meals in the queryset.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for meal, portions in iter_meals(meals):
+        meal_values = [meal.date, meal.time, meal.name, meal.user.username,
+                       meal.calories]
+        if not portions:
+            yield writer.writerow([_encode(value) for value in meal_values])
+        for portion in portions:
+            yield writer.writerow([_encode(value) for value in meal_values +
+                                   [portion['comestible'], portion['quantity'],
+                                    portion['unit'], portion['calories']]])
+
+
+def export_jsonl(meals):
+    """
+    Yields one line of JSON per meal in the queryset, including its portions.
+    """
+    for meal, portions in iter_meals(meals):
+        yield simplejson.dumps({
+            'date': meal.date,
+            'time': meal.time,
+            'meal': meal.name,
+            'user': meal.user.username,
+            'calories': meal.calories,
+            'portions': portions,
+        }, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_meals(meals, format):
+    """
+    Returns an iterator over the lines of an export of the meals in the
+    queryset, in the given format ('csv' or 'jsonl').
+    """
+    if format == 'csv':
+        return export_csv(meals)
+    return export_jsonl(meals)
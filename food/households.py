@@ -0,0 +1,108 @@
+"""
+Scoping the food views to the household of the user making the request.
+
+Every dish and meal belongs to a household, and each view only shows (or
+lets its forms choose) those of request_household(), through the
+for_household() managers in food.models, so what a page costs depends on the
+size of the user's household and not on how many households there are.
+Anonymous users don't have a household, so they see no dishes or meals.
+
+Two households can also be merged into one, with merge_households().
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+
+from accounts.models import Household, Profile, profile_cache_key
+from food.caching import invalidate_detail
+from food.models import (Dish, Meal, household_comestibles,
+                         rebuild_household_summaries)
+from food.search import search_index
+
+
+def request_household(request):
+    """
+    Returns the household of the request's user (or None for anonymous
+    users), as found (and usually cached) by ProfileMiddleware.
+    """
+    return request.household
+
+
+class HouseholdMixin(object):
+    """
+    Limits the queryset of a generic view (of Dish or Meal) to the objects of
+    the request's household.
+    """
+    def get_queryset(self):
+        return super(HouseholdMixin, self).get_queryset().for_household(
+                   request_household(self.request))
+
+
+def limit_to_household(form, household):
+    """
+    Limits the choices of the household, user and cooks fields of a dish or
+    meal form (those it has) to household and its members, and makes
+    household the initial choice. If household is None, there are no choices.
+    """
+    if household is None:
+        for name in ('household', 'user', 'cooks'):
+            if name in form.fields:
+                form.fields[name].queryset = form.fields[name].queryset.none()
+        return
+    if 'household' in form.fields:
+        form.fields['household'].queryset = \
+            form.fields['household'].queryset.filter(pk=household.pk)
+        if not form.initial.get('household'):
+            form.initial['household'] = household.pk
+    for name in ('user', 'cooks'):
+        if name in form.fields:
+            form.fields[name].queryset = form.fields[name].queryset.filter(
+                                             profile__household=household)
+
+
+def limit_comestibles(formset, field_name, household):
+    """
+    Limits the comestibles which can be chosen in field_name of each form in
+    an amount or portion formset to the ingredients and the dishes of
+    household.
+    """
+    comestibles = household_comestibles(household)
+    for form in formset.forms:
+        form.fields[field_name].queryset = comestibles
+
+
+@transaction.commit_on_success
+def merge_households(source, target):
+    """
+    Moves all the dishes, meals and members of the household source to
+    target, with one UPDATE for each (rather than saving each of them, which
+    would update the summaries and caches once per object), and makes source
+    inactive. Then the summaries of both households are rebuilt, and the
+    cached profiles, detail pages and search index entries of what moved are
+    updated, once.
+    """
+    if source.pk == target.pk:
+        raise ValueError("can't merge a household with itself")
+    dish_ids = list(Dish.objects.filter(household=source).order_by().values_list(
+                        'pk', flat=True))
+    meal_ids = list(Meal.objects.filter(household=source).order_by().values_list(
+                        'pk', flat=True))
+    user_ids = list(Profile.objects.filter(household=source).values_list(
+                        'user', flat=True))
+    # (updated_at is set as save() would, so that the meals' pages' Last-Modified
+    # changes)
+    now = datetime.datetime.now()
+    Dish.objects.filter(household=source).update(household=target, updated_at=now)
+    Meal.objects.filter(household=source).update(household=target, updated_at=now)
+    Profile.objects.filter(household=source).update(household=target)
+    # (the source's members and dishes have all moved, so there's nothing for
+    # the receivers of its save to update)
+    Household.objects.filter(pk=source.pk).update(is_active=False)
+    source.is_active = False
+    rebuild_household_summaries([source.pk, target.pk])
+
+    cache.delete_many([profile_cache_key(user_id) for user_id in user_ids])
+    invalidate_detail('dish', dish_ids)
+    invalidate_detail('meal', meal_ids)
+    search_index.move_dishes(dish_ids, target.pk)
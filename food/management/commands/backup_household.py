@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Household
+
+from food.backup import backup_household
+
+
+class Command(BaseCommand):
+    args = '<household id> <backup file>'
+    help = ("Writes a compressed backup of a household, with its members, "
+            "dishes, meals and the ingredients they use, to a file which can be "
+            "loaded with restore_household.")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("need exactly two arguments: a household id and a file name")
+        try:
+            household = Household.objects.get(pk=args[0])
+        except (Household.DoesNotExist, ValueError):
+            raise CommandError("household %s does not exist" % args[0])
+        backup_file = open(args[1], 'wb')
+        try:
+            backup_household(household, backup_file)
+        finally:
+            backup_file.close()
+        self.stdout.write("Backed up %s to %s\n" % (household, args[1]))
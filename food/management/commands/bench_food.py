@@ -0,0 +1,49 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+
+from food.benchmark import BENCHMARKS, run_benchmarks
+from food.dataset import DATASET_PASSWORD
+
+
+class Command(BaseCommand):
+    args = '[benchmark ...]'
+    help = ("Times the main operations of the food app (all of them, or the "
+            "ones named: %s) as a member of a household, and writes their "
+            "time percentiles and query counts as JSON. Operations which "
+            "change data undo their changes." % ', '.join(BENCHMARKS))
+
+    option_list = BaseCommand.option_list + (
+        make_option('--user', dest='user', default='bench0_0',
+                    help="Username to log in as (default 'bench0_0', the first "
+                         "user made by generate_food_dataset)"),
+        make_option('--password', dest='password', default=DATASET_PASSWORD,
+                    help='Password of the user (default the one given to '
+                         'users by generate_food_dataset)'),
+        make_option('--repeat', dest='repeat', type='int', default=10,
+                    help='Number of times to run each operation (default 10)'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to (default: standard output)'),
+    )
+
+    def handle(self, *args, **options):
+        for name in args:
+            if name not in BENCHMARKS:
+                raise CommandError("unknown benchmark '%s'" % name)
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+        try:
+            results = run_benchmarks(options['user'], options['password'],
+                                     options['repeat'], list(args))
+        except ValueError, e:
+            raise CommandError(e)
+        output = simplejson.dumps(results, sort_keys=True, indent=2) + '\n'
+        if options.get('output'):
+            output_file = open(options['output'], 'w')
+            try:
+                output_file.write(output)
+            finally:
+                output_file.close()
+        else:
+            self.stdout.write(output)
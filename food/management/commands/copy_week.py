@@ -0,0 +1,71 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django.contrib.auth.models import User
+
+from accounts.models import Household
+
+from food.models import Meal, copy_week
+
+
+def parse_week_start(value):
+    """
+    Returns the date of the Monday at the start of the week containing the
+    date given as YYYY-MM-DD.
+    """
+    try:
+        date = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError("'%s' is not a date in the format YYYY-MM-DD" % value)
+    return date - datetime.timedelta(date.weekday())
+
+
+class Command(BaseCommand):
+    args = '<date in source week> <date in target week>'
+    help = ("Copies all the meals (and their portions) in one week to the same "
+            "days and times in another week. Dates are given as YYYY-MM-DD.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--household', dest='household', type='int', default=None,
+                    help='Only copy the meals of the household with this id'),
+        make_option('--user', dest='user', default=None,
+                    help='Only copy the meals of the user with this username'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("need exactly two dates: one in the week to copy "
+                               "from, and one in the week to copy to")
+        from_week_start = parse_week_start(args[0])
+        to_week_start = parse_week_start(args[1])
+        if from_week_start == to_week_start:
+            raise CommandError("can't copy a week to itself")
+
+        user = None
+        if options['user'] is not None:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError("user '%s' does not exist" % options['user'])
+        if options['household'] is not None:
+            try:
+                households = [Household.objects.get(pk=options['household'])]
+            except Household.DoesNotExist:
+                raise CommandError("household %s does not exist" % options['household'])
+        else:
+            # (each household's meals are copied separately, so only those
+            # with meals in the week are needed)
+            households = Household.objects.filter(pk__in=Meal.objects.filter(
+                             date__range=(from_week_start,
+                                          from_week_start + datetime.timedelta(days=6))
+                             ).values('household'))
+
+        count = 0
+        for household in households:
+            count += len(copy_week(from_week_start, to_week_start, household,
+                                   user=user))
+        self.stdout.write("Copied %s meals from the week beginning %s to the "
+                          "week beginning %s\n" % (count, from_week_start,
+                                                    to_week_start))
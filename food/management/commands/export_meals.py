@@ -0,0 +1,58 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django.contrib.auth.models import User
+
+from accounts.models import Household
+
+from food.export import EXPORT_FORMATS, export_meals
+from food.models import Meal
+
+
+class Command(BaseCommand):
+    help = ("Writes the meals, portions and calories of a user or a household "
+            "as CSV or JSON Lines, reading them a chunk at a time.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--user', dest='user', default=None,
+                    help='Export the meals of the user with this username'),
+        make_option('--household', dest='household', type='int', default=None,
+                    help='Export the meals of the household with this id'),
+        make_option('--format', dest='format', default='csv',
+                    choices=sorted(EXPORT_FORMATS.keys()),
+                    help='csv (the default) or jsonl'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to (default: standard output)'),
+    )
+
+    def handle(self, *args, **options):
+        if (options.get('user') is None) == (options.get('household') is None):
+            raise CommandError("give either --user or --household")
+        format = options.get('format') or 'csv'
+        if format not in EXPORT_FORMATS:
+            raise CommandError("unknown format '%s'" % format)
+
+        if options.get('user') is not None:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError("user '%s' does not exist" % options['user'])
+            meals = Meal.objects.filter(user=user)
+        else:
+            try:
+                household = Household.objects.get(pk=options['household'])
+            except Household.DoesNotExist:
+                raise CommandError("household %s does not exist" % options['household'])
+            meals = Meal.objects.filter(household=household)
+
+        if options.get('output'):
+            output = open(options['output'], 'wb')
+        else:
+            output = self.stdout
+        try:
+            for line in export_meals(meals, format):
+                output.write(line)
+        finally:
+            if options.get('output'):
+                output.close()
@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from food.duplicates import MIN_SIMILARITY, find_duplicate_ingredients
+
+
+class Command(BaseCommand):
+    help = ("Lists the pairs of ingredients (with the same unit) whose names "
+            "are so alike that they're probably the same ingredient, with "
+            "their ids and how alike they are, most alike first. Merge them "
+            "with merge_ingredients.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--min-similarity', dest='min_similarity', type='float',
+                    default=MIN_SIMILARITY,
+                    help='Lowest similarity, from 0 to 1, of the pairs listed '
+                         '(default %s)' % MIN_SIMILARITY),
+    )
+
+    def handle(self, *args, **options):
+        min_similarity = options.get('min_similarity')
+        if not 0 < min_similarity <= 1:
+            raise CommandError("--min-similarity must be more than 0 and at most 1")
+        pairs = find_duplicate_ingredients(min_similarity)
+        for similarity, first, second in pairs:
+            self.stdout.write((u"%.2f  %s %s  |  %s %s\n" % (
+                                   (similarity,) + first + second)).encode('utf-8'))
+        self.stdout.write("%s possible duplicates\n" % len(pairs))
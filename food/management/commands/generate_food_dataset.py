@@ -0,0 +1,70 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django.contrib.auth.models import User
+
+from food.dataset import DATASET_MEALS, DATASET_PASSWORD, generate_dataset
+
+
+class Command(BaseCommand):
+    help = ("Fills the database with synthetic households, users, ingredients, "
+            "nested dishes and meals, for benchmarking with bench_food. Every "
+            "user's password is '%s'." % DATASET_PASSWORD)
+
+    option_list = BaseCommand.option_list + (
+        make_option('--households', dest='households', type='int', default=1,
+                    help='Number of households (default 1)'),
+        make_option('--users', dest='users', type='int', default=2,
+                    help='Number of users in each household (default 2)'),
+        make_option('--ingredients', dest='ingredients', type='int', default=500,
+                    help='Number of ingredients, shared by the households '
+                         '(default 500)'),
+        make_option('--dishes', dest='dishes', type='int', default=100,
+                    help='Number of dishes eaten by each household (default 100)'),
+        make_option('--depth', dest='depth', type='int', default=2,
+                    help='Number of dishes nested inside each dish (default 2)'),
+        make_option('--fanout', dest='fanout', type='int', default=5,
+                    help='Number of amounts in each dish (default 5)'),
+        make_option('--days', dest='days', type='int', default=365,
+                    help='Number of days of meals, up to today (default 365)'),
+        make_option('--meals', dest='meals', type='int', default=3,
+                    help='Number of meals each user eats each day (default 3)'),
+        make_option('--portions', dest='portions', type='int', default=3,
+                    help='Number of portions in each meal (default 3)'),
+        make_option('--prefix', dest='prefix', default='bench',
+                    help="Start of the usernames, and part of the ingredient "
+                         "names (default 'bench')"),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='Random seed (default 0)'),
+    )
+
+    def handle(self, *args, **options):
+        for name in ['households', 'users', 'ingredients', 'fanout', 'days',
+                     'meals', 'portions']:
+            if options[name] < 1:
+                raise CommandError("--%s must be at least 1" % name)
+        for name in ['dishes', 'depth']:
+            if options[name] < 0:
+                raise CommandError("--%s can't be negative" % name)
+        if options['meals'] > len(DATASET_MEALS):
+            raise CommandError("--meals can be at most %s" % len(DATASET_MEALS))
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError("there are already users whose names start with "
+                               "'%s'; use another --prefix" % options['prefix'])
+
+        counts = generate_dataset(households=options['households'],
+                                  users_per_household=options['users'],
+                                  ingredients=options['ingredients'],
+                                  dishes=options['dishes'],
+                                  depth=options['depth'],
+                                  fanout=options['fanout'],
+                                  days=options['days'],
+                                  meals_per_day=options['meals'],
+                                  portions_per_meal=options['portions'],
+                                  prefix=options['prefix'],
+                                  seed=options['seed'])
+        self.stdout.write("Created %(households)s households, %(users)s users, "
+                          "%(ingredients)s ingredients, %(dishes)s dishes with "
+                          "%(amounts)s amounts, and %(meals)s meals with "
+                          "%(portions)s portions\n" % counts)
@@ -0,0 +1,186 @@
+import csv
+from optparse import make_option
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+
+from food.models import (Comestible, Ingredient, bulk_insert_with_ids,
+                         bulk_update, recalculate_calories)
+
+
+# The columns needed in the CSV file's header row (in any order and case)
+COLUMNS = ('name', 'quantity', 'calories', 'unit')
+
+
+def clean_row(values):
+    """
+    Returns a dict of the cleaned name, quantity, calories and unit from a
+    dict of CSV values, using the Ingredient model's own fields (and so its
+    validators), or raises ValidationError.
+    """
+    cleaned = {}
+    errors = []
+    for column in COLUMNS:
+        field = Ingredient._meta.get_field(column)
+        try:
+            cleaned[column] = field.clean(values[column].strip(), None)
+        except ValidationError, e:
+            errors.extend(u'%s: %s' % (column, message) for message in e.messages)
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
+
+
+class Command(BaseCommand):
+    args = '<csv file>'
+    help = ("Creates or updates ingredients (matched by name) from a CSV file "
+            "with a header row naming the columns name, quantity, calories and "
+            "unit, then recalculates the calories of everything containing "
+            "ingredients which changed.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of rows to read and save at a time (default 500)'),
+        make_option('--dry-run', dest='dry_run', action='store_true',
+                    default=False,
+                    help="Check the file and report what would change, without saving anything"),
+        make_option('--errors', dest='errors', default=None,
+                    help='Write rows which could not be imported, with the reasons, to this CSV file'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("need exactly one argument for the csv file")
+        batch_size = options.get('batch_size') or 500
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        self.dry_run = options.get('dry_run', False)
+        self.verbosity = int(options.get('verbosity', 1))
+
+        try:
+            csv_file = open(args[0], 'rb')
+        except IOError, e:
+            raise CommandError("can't open %s: %s" % (args[0], e))
+        error_file = None
+        self.error_writer = None
+        if options.get('errors'):
+            error_file = open(options['errors'], 'wb')
+            self.error_writer = csv.writer(error_file)
+
+        self.created = self.updated = self.unchanged = self.failed = 0
+        self.changed_ids = set()
+        try:
+            reader = csv.reader(csv_file)
+            try:
+                header = [column.strip().lower() for column in reader.next()]
+            except StopIteration:
+                raise CommandError("%s is empty" % args[0])
+            missing = [column for column in COLUMNS if column not in header]
+            if missing:
+                raise CommandError("the header row is missing the column(s): %s" %
+                                   u', '.join(missing))
+            if self.error_writer:
+                self.error_writer.writerow(['line', 'errors'] + header)
+
+            # Rows are read lazily and only one batch at a time is held in
+            # memory, so the file can be any size
+            batch = {}
+            for row in reader:
+                if not any(row):
+                    continue # skip blank lines
+                self.add_row(batch, reader.line_num, header, row)
+                if len(batch) >= batch_size:
+                    self.save_batch(batch)
+                    batch = {}
+            self.save_batch(batch)
+        finally:
+            csv_file.close()
+            if error_file:
+                error_file.close()
+
+        # Recalculate everything containing the changed ingredients once, at
+        # the end, rather than once per ingredient saved
+        if self.changed_ids and not self.dry_run:
+            recalculate_calories(self.changed_ids)
+
+        self.stdout.write("%s%s created, %s updated, %s unchanged, %s rows with errors\n" % (
+            self.dry_run and "(dry run) " or "",
+            self.created, self.updated, self.unchanged, self.failed))
+
+    def add_row(self, batch, line_num, header, row):
+        """
+        Validates a row and adds it to the batch (keyed by name, so that a
+        later row with the same name replaces an earlier one)
+        """
+        values = dict((column, value.decode('utf-8'))
+                      for column, value in zip(header, row))
+        try:
+            if len(row) != len(header):
+                raise ValidationError(u'expected %s values but found %s' %
+                                      (len(header), len(row)))
+            cleaned = clean_row(values)
+        except ValidationError, e:
+            self.failed += 1
+            if self.error_writer:
+                self.error_writer.writerow([line_num,
+                                            u'; '.join(e.messages).encode('utf-8')] + row)
+            return
+        batch[cleaned['name']] = cleaned
+
+    @transaction.commit_on_success
+    def save_batch(self, batch):
+        """
+        Creates or updates the ingredients in a batch, comparing them with the
+        existing ingredients with one query and saving them without sending
+        any signals: one INSERT of the new comestibles and one of the new
+        ingredients, and one UPDATE of the changed ingredients (and one of
+        the comestibles whose units changed), each run with executemany()
+        """
+        if not batch:
+            return
+        existing = {}
+        names = batch.keys()
+        # (SQLite allows at most 999 parameters in a query)
+        for start in range(0, len(names), 500):
+            for values in Ingredient.objects.filter(
+                    name__in=names[start:start + 500]).values_list(
+                    'pk', 'name', 'quantity', 'calories', 'unit'):
+                existing[values[1]] = values
+        new_names = []
+        changed = []
+        for name, cleaned in batch.items():
+            if name not in existing:
+                new_names.append(name)
+                continue
+            pk, name, quantity, calories, unit = existing[name]
+            if (quantity, calories, unit) == (cleaned['quantity'],
+                                              cleaned['calories'],
+                                              cleaned['unit']):
+                self.unchanged += 1
+            else:
+                changed.append(Ingredient(pk=pk, is_dish=False, **cleaned))
+                changed[-1]._old_unit = unit
+        self.created += len(new_names)
+        self.updated += len(changed)
+        if not self.dry_run:
+            self.insert_ingredients([batch[name] for name in new_names])
+            bulk_update(changed, ['quantity', 'calories', 'updated_at'])
+            bulk_update([Comestible(pk=ingredient.pk, unit=ingredient.unit)
+                         for ingredient in changed
+                         if ingredient.unit != ingredient._old_unit], ['unit'])
+            self.changed_ids.update(ingredient.pk for ingredient in changed)
+        # (with DEBUG on, every query would otherwise be kept until the end)
+        if settings.DEBUG:
+            reset_queries()
+        if self.verbosity >= 1:
+            self.stdout.write("%s rows processed\n" % (self.created + self.updated +
+                                                      self.unchanged + self.failed))
+
+    def insert_ingredients(self, rows):
+        """
+        Inserts new ingredients from a list of cleaned rows, with a few queries
+        for all of them (see bulk_insert_with_ids()).
+        """
+        bulk_insert_with_ids([Ingredient(is_dish=False, **row) for row in rows])
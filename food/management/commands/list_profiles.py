@@ -0,0 +1,67 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django.contrib.auth.models import User
+
+from food.profiling import PROFILE_DIR, profile_token, recent_profiles
+
+
+class Command(BaseCommand):
+    args = '[profile name]'
+    help = ("Lists the most recent profiled requests, newest first, or "
+            "summarises the one named: its slowest functions, queries and "
+            "cascade of saves and deletes.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', dest='limit', type='int', default=20,
+                    help='Number of profiles to list (default 20)'),
+        make_option('--token', dest='token', default=None,
+                    help='Print the X-Food-Profile header value for the staff '
+                         'user with this username instead'),
+    )
+
+    def handle(self, *args, **options):
+        if options.get('token'):
+            try:
+                user = User.objects.get(username=options['token'])
+            except User.DoesNotExist:
+                raise CommandError("user '%s' does not exist" % options['token'])
+            if not user.is_staff:
+                raise CommandError("only staff users' requests can be profiled")
+            self.stdout.write("X-Food-Profile: %s\n" % profile_token(user.username))
+            return
+
+        if len(args) > 1:
+            raise CommandError("give at most one profile name")
+        if not args:
+            summaries = recent_profiles(options['limit'])
+            if not summaries:
+                self.stdout.write("No profiles in %s\n" % PROFILE_DIR)
+            for summary in summaries:
+                self.stdout.write("%(name)s  %(status)s %(method)s %(path)s  "
+                                  "%(duration).3fs, %(query_count)s queries "
+                                  "(%(db_time).3fs)\n" % summary)
+            return
+
+        for summary in recent_profiles():
+            if summary['name'] == args[0]:
+                break
+        else:
+            raise CommandError("no profile named '%s' in %s" % (args[0], PROFILE_DIR))
+        self.stdout.write("%(method)s %(path)s (%(view)s) by %(user)s at %(time)s: "
+                          "%(status)s in %(duration).3fs, %(query_count)s queries "
+                          "in %(db_time).3fs\n" % summary)
+        self.stdout.write("\nSlowest functions (cumulative seconds, calls):\n")
+        for function in summary['functions']:
+            self.stdout.write("  %(cumulative_time)10.4f %(calls)8s  %(function)s\n"
+                              % function)
+        self.stdout.write("\nSaves and deletes (%s):\n" % len(summary['signals']))
+        for signal in summary['signals']:
+            self.stdout.write("  %s%s %s %s\n" % ('  ' * signal['level'],
+                                                 signal['action'],
+                                                 signal['model'], signal['id']))
+        self.stdout.write("\nQueries:\n")
+        for query in summary['queries']:
+            self.stdout.write("  (%s) %s\n" % (query['time'], query['sql']))
+        self.stdout.write("\nProfile: %s/%s.prof\n" % (PROFILE_DIR, summary['name']))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Household
+from food.households import merge_households
+
+
+class Command(BaseCommand):
+    args = '<source household id> <target household id>'
+    help = ("Moves all the dishes, meals and members of the source household "
+            "to the target household, and makes the source household inactive.")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("need exactly two arguments, the ids of the "
+                               "source and target households")
+        households = []
+        for pk in args:
+            try:
+                households.append(Household.objects.get(pk=pk))
+            except (Household.DoesNotExist, ValueError):
+                raise CommandError("there's no household with the id %s" % pk)
+        source, target = households
+        if source.pk == target.pk:
+            raise CommandError("can't merge a household with itself")
+        for household in households:
+            if not household.is_active:
+                raise CommandError("%s (%s) isn't active" % (household, household.pk))
+        merge_households(source, target)
+        self.stdout.write("Merged %s into %s\n" % (source, target))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from food.duplicates import merge_duplicates
+from food.models import Ingredient
+
+
+class Command(BaseCommand):
+    args = '<id of ingredient to keep> <duplicate id> [<duplicate id> ...]'
+    help = ("Replaces the duplicate ingredients with the one kept in every "
+            "dish and meal, deletes them, and recalculates the calories of "
+            "everything which used them. See find_duplicate_ingredients.")
+
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError("need the id of the ingredient to keep and at "
+                               "least one duplicate id")
+        try:
+            ids = [int(arg) for arg in args]
+        except ValueError:
+            raise CommandError("ingredient ids must be numbers")
+        try:
+            ingredient = Ingredient.objects.get(pk=ids[0])
+        except Ingredient.DoesNotExist:
+            raise CommandError("there's no ingredient with the id %s" % ids[0])
+        try:
+            merge_duplicates(ingredient, ids[1:])
+        except ValueError, e:
+            raise CommandError(e)
+        self.stdout.write((u"Merged %s duplicates into %s\n" % (
+                               len(set(ids[1:]) - set([ids[0]])),
+                               ingredient)).encode('utf-8'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Household
+from food.models import (HouseholdIngredient, Leftover, MemberDay, MemberTotals,
+                         rebuild_household_summaries)
+
+
+class Command(BaseCommand):
+    help = ("Recalculates the household summaries (each member's calories per "
+            "day and dishes cooked, the dishes' leftovers, and the number of "
+            "each household's meals containing each ingredient) from scratch. "
+            "The ingredients are counted from the ingredient index, so run "
+            "rebuild_ingredient_index first if that's out of date.")
+
+    def handle(self, *args, **options):
+        for model in (MemberDay, MemberTotals, Leftover, HouseholdIngredient):
+            model.objects.all().delete()
+        household_ids = list(Household.objects.values_list('pk', flat=True))
+        rebuild_household_summaries(household_ids)
+        self.stdout.write("Summarised %s households\n" % len(household_ids))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from food.models import Dish, Meal, update_dish_ingredients, update_meal_ingredients
+
+
+class Command(BaseCommand):
+    help = ("Recalculates the ingredient index (the total quantity of each "
+            "ingredient in every dish and meal) from scratch.")
+
+    def handle(self, *args, **options):
+        # All the dishes first, since the meals' rows are calculated from them
+        dish_ids = list(Dish.objects.values_list('pk', flat=True))
+        update_dish_ingredients(dish_ids)
+        meal_ids = list(Meal.objects.values_list('pk', flat=True))
+        update_meal_ingredients(meal_ids)
+        self.stdout.write("Indexed the ingredients of %s dishes and %s meals\n" %
+                          (len(dish_ids), len(meal_ids)))
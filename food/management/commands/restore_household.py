@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from food.backup import BackupError, restore_household
+
+
+class Command(BaseCommand):
+    args = '<backup file>'
+    help = ("Restores a household from a file written by backup_household, as "
+            "a new household (existing users and ingredients with the same "
+            "usernames and names are reused).")
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("need exactly one argument for the backup file")
+        try:
+            backup_file = open(args[0], 'rb')
+        except IOError, e:
+            raise CommandError("can't open %s: %s" % (args[0], e))
+        try:
+            household = restore_household(backup_file)
+        except BackupError, e:
+            raise CommandError(unicode(e))
+        finally:
+            backup_file.close()
+        self.stdout.write("Restored %s as household %s\n" % (household,
+                                                            household.id))
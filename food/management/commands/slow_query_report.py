@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from food.slowlog import read_entries, summarise
+
+
+class Command(BaseCommand):
+    args = '[log file]'
+    help = ("Ranks the statements in the slow query log (by default "
+            "FOOD_SLOW_QUERY_LOG) by their total time, with the views and "
+            "lines of code which made them.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', dest='limit', type='int', default=20,
+                    help='Number of statements to list (default 20)'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError("give at most one log file")
+        path = args and args[0] or getattr(settings, 'FOOD_SLOW_QUERY_LOG', None)
+        if not path:
+            raise CommandError("give a log file, or set FOOD_SLOW_QUERY_LOG")
+        entries = read_entries(path)
+        if not entries:
+            self.stdout.write("No slow queries in %s\n" % path)
+            return
+        statements = summarise(entries)
+        self.stdout.write("%s slow queries, %s statements\n" % (len(entries),
+                                                                len(statements)))
+        for statement in statements[:options['limit']]:
+            self.stdout.write("\n%(total)9.3fs total  %(count)6s runs  "
+                              "%(mean).3fs mean  %(max).3fs max\n" % statement)
+            self.stdout.write("  %s\n" % statement['sql'])
+            for label, counts in (('view', statement['views']),
+                                  ('from', statement['origins'])):
+                for name, count in sorted(counts.items(),
+                                          key=lambda item: -item[1]):
+                    self.stdout.write("  %s %s (%s)\n" % (label, name, count))
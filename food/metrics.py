@@ -0,0 +1,337 @@
+"""
+A small registry of counters and histograms, exposed in the Prometheus text
+format by the metrics view.
+
+Each process keeps its own values. With settings.FOOD_METRICS_DIR set (for
+when the site runs in several processes on one machine), each process also
+writes its values to a file of its own in that directory at most every
+METRICS_WRITE_INTERVAL seconds, and the metrics view adds up the files of
+all the processes instead of only reporting its own. The files are named by
+each process's pid and a random token, so that a later process with the
+same pid doesn't replace an earlier one's file. The files of processes
+which have exited are added into EXITED_FILE (and deleted) by the metrics
+view, so that counters never go backwards and the directory doesn't keep
+growing.
+
+What's measured:
+    food_request_duration_seconds, food_request_queries and
+    food_request_cascade_saves: histograms of each request's time, number
+        of queries, and number of amounts, dishes, portions and meals saved
+        by the signal receivers in food.models, by view (recorded by
+        QueryBudgetMiddleware)
+    food_cascade_saves_total: the saves by those receivers, by model
+    food_detail_cache_lookups_total: lookups of the versions of the cached
+        dish and meal detail pages (see food.caching), by whether the version
+        was in the cache, which is when the cached content can be used
+"""
+import errno
+import fcntl
+import glob
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import simplejson
+
+
+METRICS_DIR = getattr(settings, 'FOOD_METRICS_DIR', None)
+
+# Seconds between each process writing its values to METRICS_DIR
+METRICS_WRITE_INTERVAL = 5
+
+# File in METRICS_DIR which the values of exited processes are added up in
+EXITED_FILE = 'metrics-exited.json'
+
+_process_file_name = re.compile(r'^metrics-(\d+)-\w+\.json$')
+
+_lock = threading.Lock()
+_request = threading.local()
+# (in lists, so that they can be changed without a global statement)
+_last_write = [0]
+# this process's pid and token (made again after a fork)
+_process_token = [None, None]
+
+
+class Metric(object):
+    """
+    A counter or histogram, with a value for each combination of the values
+    of its labels.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # tuple of label values -> value
+        self.values = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(unicode(labels[label]) for label in self.labels)
+
+    def load(self, values):
+        """
+        Returns a dict of values like self.values from the output of dump().
+        """
+        return dict((tuple(key), value) for key, value in values)
+
+    def dump(self):
+        # (JSON objects can't have lists as keys)
+        return self.values.items()
+
+    def _format_labels(self, key, extra=()):
+        pairs = zip(self.labels, key) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, unicode(value).replace('\\', r'\\')
+                                                           .replace('\n', r'\n')
+                                                           .replace('"', r'\"'))
+                                 for name, value in pairs)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def merge(self, values, other):
+        for key, value in other.items():
+            values[key] = values.get(key, 0) + value
+
+    def format(self, values):
+        return ['%s%s %s' % (self.name, self._format_labels(key), value)
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=()):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # a count for each bucket, then the sum and the count of values
+                counts = self.values[key] = [0] * len(self.buckets) + [0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def merge(self, values, other):
+        for key, counts in other.items():
+            if key in values:
+                values[key] = [a + b for a, b in zip(values[key], counts)]
+            else:
+                values[key] = list(counts)
+
+    def format(self, values):
+        lines = []
+        for key, counts in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append('%s_bucket%s %s' % (self.name,
+                                                 self._format_labels(key, [('le', bound)]),
+                                                 count))
+            lines.append('%s_bucket%s %s' % (self.name,
+                                             self._format_labels(key, [('le', '+Inf')]),
+                                             counts[-1]))
+            lines.append('%s_sum%s %s' % (self.name, self._format_labels(key), counts[-2]))
+            lines.append('%s_count%s %s' % (self.name, self._format_labels(key), counts[-1]))
+        return lines
+
+
+registry = []
+
+REQUEST_DURATION = Histogram(
+    'food_request_duration_seconds', 'Time taken by each request.', ['view'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram(
+    'food_request_queries', 'Number of database queries made by each request.',
+    ['view'], buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+REQUEST_CASCADE_SAVES = Histogram(
+    'food_request_cascade_saves',
+    'Number of amounts, dishes, portions and meals saved by signal receivers '
+    'during each request.',
+    ['view'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+CASCADE_SAVES = Counter(
+    'food_cascade_saves_total',
+    'Amounts, dishes, portions and meals saved by signal receivers.', ['model'])
+DETAIL_CACHE_LOOKUPS = Counter(
+    'food_detail_cache_lookups_total',
+    'Lookups of the versions of cached dish and meal detail pages.',
+    ['kind', 'result'])
+
+
+def start_request():
+    _request.cascade_saves = 0
+
+def count_cascade_save(model):
+    """
+    Counts a save by a signal receiver of an instance of the model with the
+    given name.
+    """
+    CASCADE_SAVES.inc(model=model)
+    if getattr(_request, 'cascade_saves', None) is not None:
+        _request.cascade_saves += 1
+
+def finish_request(view_name, duration, queries):
+    REQUEST_DURATION.observe(duration, view=view_name)
+    REQUEST_QUERIES.observe(queries, view=view_name)
+    REQUEST_CASCADE_SAVES.observe(getattr(_request, 'cascade_saves', None) or 0,
+                                  view=view_name)
+    _request.cascade_saves = None
+    if METRICS_DIR and time.time() - _last_write[0] > METRICS_WRITE_INTERVAL:
+        write_process_file()
+
+
+def _process_file():
+    pid = os.getpid()
+    if _process_token[0] != pid:
+        _process_token[:] = [pid, uuid.uuid4().hex[:12]]
+    return os.path.join(METRICS_DIR, 'metrics-%s-%s.json' % tuple(_process_token))
+
+def _process_files():
+    """
+    Returns a list of (path, pid) for each process's file in METRICS_DIR.
+    """
+    files = []
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        match = _process_file_name.match(os.path.basename(path))
+        if match:
+            files.append((path, int(match.group(1))))
+    return files
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        # (EPERM is a process of another user)
+        return e.errno != errno.ESRCH
+    return True
+
+def _read(path):
+    """
+    Returns the data in a JSON file, or None if it can't be read.
+    """
+    try:
+        data_file = open(path)
+        try:
+            return simplejson.load(data_file)
+        finally:
+            data_file.close()
+    except (IOError, ValueError):
+        return None
+
+def _write(path, data):
+    # (written to another file first, so that it's never read half written)
+    temporary_file = open(path + '.tmp', 'w')
+    try:
+        temporary_file.write(simplejson.dumps(data))
+    finally:
+        temporary_file.close()
+    os.rename(path + '.tmp', path)
+
+@contextmanager
+def _directory_lock():
+    # (so that only one process at a time adds up the exited processes' files)
+    lock_file = open(os.path.join(METRICS_DIR, 'metrics.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+    finally:
+        lock_file.close()
+
+def write_process_file():
+    """
+    Writes this process's values to its file in METRICS_DIR.
+    """
+    with _lock:
+        data = dict((metric.name, metric.dump()) for metric in registry)
+    if not os.path.isdir(METRICS_DIR):
+        os.makedirs(METRICS_DIR)
+    _write(_process_file(), data)
+    _last_write[0] = time.time()
+
+def fold_exited_files():
+    """
+    Adds the values in the files of the processes which have exited to
+    EXITED_FILE in METRICS_DIR, and deletes those files. The names of the
+    files added are kept in EXITED_FILE until they've been deleted, so that
+    none of them is added twice if this is interrupted. This must be called
+    with the directory locked.
+    """
+    exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    exited = _read(exited_path) or {'files': [], 'values': {}}
+    folded = set(exited['files'])
+    paths = [path for path, pid in _process_files() if not _is_running(pid)]
+    new_paths = [path for path in paths if os.path.basename(path) not in folded]
+    if new_paths:
+        values = dict((metric, metric.load(exited['values'].get(metric.name, [])))
+                      for metric in registry)
+        for path in new_paths:
+            data = _read(path)
+            if data is None:
+                continue
+            for metric in registry:
+                metric.merge(values[metric], metric.load(data.get(metric.name, [])))
+        # (only the names of the files which are still there are needed)
+        names = set(os.path.basename(path) for path in paths)
+        _write(exited_path, {'files': sorted(names),
+                             'values': dict((metric.name, values[metric].items())
+                                            for metric in registry)})
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def collect():
+    """
+    Returns a dict of {metric: values} for each metric in the registry, for
+    this process or (if METRICS_DIR is set) all of them.
+    """
+    with _lock:
+        result = dict((metric, dict((key, list(value) if isinstance(value, list)
+                                     else value)
+                                    for key, value in metric.values.items()))
+                      for metric in registry)
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        with _directory_lock():
+            fold_exited_files()
+            own_file = _process_file()
+            others = [_read(path) for path, pid in _process_files()
+                      if path != own_file]
+            exited = _read(os.path.join(METRICS_DIR, EXITED_FILE))
+        if exited is not None:
+            others.append(exited['values'])
+        for data in others:
+            if data is None:
+                continue
+            for metric in registry:
+                metric.merge(result[metric], metric.load(data.get(metric.name, [])))
+    return result
+
+
+def render_metrics():
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    lines = []
+    for metric, values in sorted(collect().items(), key=lambda item: item[0].name):
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        lines.extend(metric.format(values))
+    return '\n'.join(lines) + '\n'
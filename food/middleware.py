@@ -0,0 +1,181 @@
+"""
+Per-request SQL and timing instrumentation, with query budgets for views,
+and on-demand profiling (see food.profiling).
+
+QueryBudgetMiddleware records how many queries each request ran, how many of
+those were exact repeats of an earlier query in the same request (usually a
+sign of a query per row, where one query for all the rows would do), and the
+time spent in the database and in the whole request. It logs a warning,
+with the SQL, when a view goes over its budget in settings.QUERY_BUDGETS,
+e.g.:
+
+    QUERY_BUDGETS = {
+        'dish_detail': {'queries': 8, 'db_time': 0.05, 'time': 0.5},
+    }
+
+where views are named by their URL names and times are in seconds (any of
+the three limits can be left out). Rolling aggregates over the last
+QUERY_STATS_WINDOW requests for each view are kept in each process, and
+returned by view_stats() (and shown by the query_stats view), and the
+requests' times and query counts are also recorded in food.metrics. The
+debug cursor also lets food.slowlog log slow queries with their views.
+
+Queries are only recorded by Django when DEBUG is on, so this turns on the
+debug cursor for the duration of each request whatever DEBUG is.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import connections
+
+from food import metrics, slowlog
+from food.profiling import profile_view, wants_profile
+
+
+# Number of recent requests to each view kept for view_stats()
+QUERY_STATS_WINDOW = getattr(settings, 'QUERY_STATS_WINDOW', 100)
+
+# The most SQL statements included in a budget warning
+MAX_LOGGED_QUERIES = 50
+
+logger = logging.getLogger('food.query_budget')
+
+_stats_lock = threading.Lock()
+# view name -> list of the most recent RequestStats, oldest first
+_recent = {}
+# view name -> number of requests over budget since the process started
+_violations = {}
+
+
+class RequestStats(object):
+    def __init__(self, view_name, queries, time):
+        self.view_name = view_name
+        self.queries = len(queries)
+        seen = set()
+        self.duplicates = 0
+        for query in queries:
+            if query['sql'] in seen:
+                self.duplicates += 1
+            seen.add(query['sql'])
+        self.db_time = sum(float(query['time']) for query in queries)
+        self.time = time
+
+    def over_budget(self, budget):
+        """
+        Returns a list of descriptions of the limits in budget which this
+        request went over.
+        """
+        problems = []
+        if 'queries' in budget and self.queries > budget['queries']:
+            problems.append('%s queries (budget %s)' % (self.queries,
+                                                         budget['queries']))
+        if 'db_time' in budget and self.db_time > budget['db_time']:
+            problems.append('%.3fs in the database (budget %.3fs)' % (
+                                self.db_time, budget['db_time']))
+        if 'time' in budget and self.time > budget['time']:
+            problems.append('%.3fs in total (budget %.3fs)' % (self.time,
+                                                               budget['time']))
+        return problems
+
+
+def record(stats, over_budget=False):
+    with _stats_lock:
+        recent = _recent.setdefault(stats.view_name, [])
+        recent.append(stats)
+        del recent[:-QUERY_STATS_WINDOW]
+        if over_budget:
+            _violations[stats.view_name] = _violations.get(stats.view_name, 0) + 1
+
+def view_stats():
+    """
+    Returns a dict of aggregates over the recent requests to each view, keyed
+    by view name.
+    """
+    with _stats_lock:
+        recent = dict((name, list(stats)) for name, stats in _recent.items())
+        violations = dict(_violations)
+    result = {}
+    for name, stats in recent.items():
+        count = len(stats)
+        result[name] = {
+            'requests': count,
+            'mean_queries': sum(s.queries for s in stats) / float(count),
+            'max_queries': max(s.queries for s in stats),
+            'mean_duplicates': sum(s.duplicates for s in stats) / float(count),
+            'mean_db_time': sum(s.db_time for s in stats) / count,
+            'max_db_time': max(s.db_time for s in stats),
+            'mean_time': sum(s.time for s in stats) / count,
+            'max_time': max(s.time for s in stats),
+            'over_budget': violations.get(name, 0),
+        }
+    return result
+
+def reset_stats():
+    with _stats_lock:
+        _recent.clear()
+        _violations.clear()
+
+
+def _view_name(request):
+    try:
+        return resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+
+
+class QueryBudgetMiddleware(object):
+
+    def process_request(self, request):
+        view_name = _view_name(request)
+        request._query_budget = (time.time(), view_name, dict(
+            (alias, (connections[alias].use_debug_cursor,
+                     len(connections[alias].queries)))
+            for alias in connections))
+        for alias in connections:
+            connections[alias].use_debug_cursor = True
+        metrics.start_request()
+        slowlog.set_view(view_name)
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_query_budget'):
+            # (an earlier middleware returned a response)
+            return response
+        started, view_name, connection_states = request._query_budget
+        slowlog.set_view(None)
+        queries = []
+        for alias, (use_debug_cursor, first_query) in connection_states.items():
+            connections[alias].use_debug_cursor = use_debug_cursor
+            queries.extend(connections[alias].queries[first_query:])
+        if view_name is None:
+            return response
+
+        stats = RequestStats(view_name, queries, time.time() - started)
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+        problems = budget and stats.over_budget(budget)
+        record(stats, bool(problems))
+        metrics.finish_request(view_name, stats.time, stats.queries)
+        if problems:
+            logger.warning(
+                u'%s went over its budget with %s (%s repeated queries):\n%s' % (
+                    request.path, u', '.join(problems), stats.duplicates,
+                    u'\n'.join(u'(%s) %s' % (query['time'], query['sql'])
+                               for query in queries[:MAX_LOGGED_QUERIES])),
+                extra={'view_name': view_name, 'request': request})
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles the requests which ask for it (see food.profiling). This should
+    come last in MIDDLEWARE_CLASSES, since it calls the view itself, so the
+    process_view() of any middleware after it isn't called for those
+    requests.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not wants_profile(request):
+            return None
+        return profile_view(request, _view_name(request), view_func, view_args,
+                            view_kwargs)
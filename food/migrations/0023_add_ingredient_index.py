@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'DishIngredient'
+        db.create_table('food_dishingredient', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('dish', self.gf('django.db.models.fields.related.ForeignKey')(related_name='ingredient_totals', to=orm['food.Dish'])),
+            ('ingredient', self.gf('django.db.models.fields.related.ForeignKey')(related_name='dish_totals', to=orm['food.Ingredient'])),
+            ('quantity', self.gf('django.db.models.fields.DecimalField')(max_digits=12, decimal_places=2)),
+        ))
+        db.send_create_signal('food', ['DishIngredient'])
+
+        # Adding unique constraint on 'DishIngredient', fields ['ingredient', 'dish']
+        db.create_unique('food_dishingredient', ['ingredient_id', 'dish_id'])
+
+        # Adding model 'MealIngredient'
+        db.create_table('food_mealingredient', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('meal', self.gf('django.db.models.fields.related.ForeignKey')(related_name='ingredient_totals', to=orm['food.Meal'])),
+            ('ingredient', self.gf('django.db.models.fields.related.ForeignKey')(related_name='meal_totals', to=orm['food.Ingredient'])),
+            ('quantity', self.gf('django.db.models.fields.DecimalField')(max_digits=12, decimal_places=2)),
+        ))
+        db.send_create_signal('food', ['MealIngredient'])
+
+        # Adding unique constraint on 'MealIngredient', fields ['ingredient', 'meal']
+        db.create_unique('food_mealingredient', ['ingredient_id', 'meal_id'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'MealIngredient', fields ['ingredient', 'meal']
+        db.delete_unique('food_mealingredient', ['ingredient_id', 'meal_id'])
+
+        # Removing unique constraint on 'DishIngredient', fields ['ingredient', 'dish']
+        db.delete_unique('food_dishingredient', ['ingredient_id', 'dish_id'])
+
+        # Deleting model 'DishIngredient'
+        db.delete_table('food_dishingredient')
+
+        # Deleting model 'MealIngredient'
+        db.delete_table('food_mealingredient')
+
+
+    models = {
+        'accounts.household': {
+            'Meta': {'object_name': 'Household'},
+            'admin': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'admin_for_set'", 'to': "orm['auth.User']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'food.amount': {
+            'Meta': {'object_name': 'Amount'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'contained_comestible': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'containing_dishes_set'", 'to': "orm['food.Comestible']"}),
+            'containing_dish': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['food.Dish']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '0', 'null': 'True', 'max_digits': '8', 'decimal_places': '2', 'blank': 'True'})
+        },
+        'food.comestible': {
+            'Meta': {'object_name': 'Comestible'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_dish': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'unit': ('django.db.models.fields.CharField', [], {'default': "'g'", 'max_length': '5'})
+        },
+        'food.dish': {
+            'Meta': {'ordering': "['-date_cooked']", 'object_name': 'Dish', '_ormbases': ['food.Comestible']},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'comestible_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['food.Comestible']", 'unique': 'True', 'primary_key': 'True'}),
+            'cooks': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'cooked_dishes'", 'symmetrical': 'False', 'to': "orm['auth.User']"}),
+            'date_cooked': ('django.db.models.fields.DateField', [], {'default': 'datetime.date.today'}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'dishes'", 'to': "orm['accounts.Household']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '500', 'null': 'True', 'max_digits': '8', 'decimal_places': '2', 'blank': 'True'}),
+            'recipe_url': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'})
+        },
+        'food.dishingredient': {
+            'Meta': {'unique_together': "(('ingredient', 'dish'),)", 'object_name': 'DishIngredient'},
+            'dish': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'ingredient_totals'", 'to': "orm['food.Dish']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ingredient': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'dish_totals'", 'to': "orm['food.Ingredient']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'max_digits': '12', 'decimal_places': '2'})
+        },
+        'food.ingredient': {
+            'Meta': {'ordering': "['name']", 'object_name': 'Ingredient', '_ormbases': ['food.Comestible']},
+            'calories': ('django.db.models.fields.DecimalField', [], {'max_digits': '8', 'decimal_places': '2'}),
+            'comestible_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['food.Comestible']", 'unique': 'True', 'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '200'}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '100', 'max_digits': '8', 'decimal_places': '2'})
+        },
+        'food.meal': {
+            'Meta': {'ordering': "['date', 'time']", 'object_name': 'Meal'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'comestibles': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['food.Comestible']", 'through': "orm['food.Portion']", 'symmetrical': 'False'}),
+            'date': ('django.db.models.fields.DateField', [], {'default': 'datetime.date.today'}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'meals'", 'to': "orm['accounts.Household']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'time': ('django.db.models.fields.TimeField', [], {}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'meals'", 'to': "orm['auth.User']"})
+        },
+        'food.mealingredient': {
+            'Meta': {'unique_together': "(('ingredient', 'meal'),)", 'object_name': 'MealIngredient'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ingredient': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'meal_totals'", 'to': "orm['food.Ingredient']"}),
+            'meal': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'ingredient_totals'", 'to': "orm['food.Meal']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'max_digits': '12', 'decimal_places': '2'})
+        },
+        'food.portion': {
+            'Meta': {'object_name': 'Portion'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'comestible': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['food.Comestible']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'meal': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['food.Meal']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '0', 'null': 'True', 'max_digits': '8', 'decimal_places': '2', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['food']
\ No newline at end of file
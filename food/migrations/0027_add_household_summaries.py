@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'MemberTotals'
+        db.create_table('food_membertotals', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('household', self.gf('django.db.models.fields.related.ForeignKey')(related_name='member_totals', to=orm['accounts.Household'])),
+            ('user', self.gf('django.db.models.fields.related.ForeignKey')(related_name='member_totals', to=orm['auth.User'])),
+            ('dishes_cooked', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('food', ['MemberTotals'])
+
+        # Adding unique constraint on 'MemberTotals', fields ['household', 'user']
+        db.create_unique('food_membertotals', ['household_id', 'user_id'])
+
+        # Adding model 'MemberDay'
+        db.create_table('food_memberday', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('household', self.gf('django.db.models.fields.related.ForeignKey')(related_name='member_days', to=orm['accounts.Household'])),
+            ('user', self.gf('django.db.models.fields.related.ForeignKey')(related_name='member_days', to=orm['auth.User'])),
+            ('date', self.gf('django.db.models.fields.DateField')()),
+            ('calories', self.gf('django.db.models.fields.DecimalField')(default=0, max_digits=10, decimal_places=2)),
+        ))
+        db.send_create_signal('food', ['MemberDay'])
+
+        # Adding unique constraint on 'MemberDay', fields ['household', 'date', 'user']
+        db.create_unique('food_memberday', ['household_id', 'date', 'user_id'])
+
+        # Adding model 'Leftover'
+        db.create_table('food_leftover', (
+            ('dish', self.gf('django.db.models.fields.related.OneToOneField')(related_name='leftover', unique=True, primary_key=True, to=orm['food.Dish'])),
+            ('household', self.gf('django.db.models.fields.related.ForeignKey')(related_name='leftovers', to=orm['accounts.Household'])),
+            ('date_cooked', self.gf('django.db.models.fields.DateField')()),
+            ('quantity', self.gf('django.db.models.fields.DecimalField')(max_digits=8, decimal_places=2)),
+        ))
+        db.send_create_signal('food', ['Leftover'])
+
+        # Adding model 'HouseholdIngredient'
+        db.create_table('food_householdingredient', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('household', self.gf('django.db.models.fields.related.ForeignKey')(related_name='ingredient_counts', to=orm['accounts.Household'])),
+            ('ingredient', self.gf('django.db.models.fields.related.ForeignKey')(related_name='household_counts', to=orm['food.Ingredient'])),
+            ('meals', self.gf('django.db.models.fields.IntegerField')(default=0)),
+        ))
+        db.send_create_signal('food', ['HouseholdIngredient'])
+
+        # Adding unique constraint on 'HouseholdIngredient', fields ['household', 'ingredient']
+        db.create_unique('food_householdingredient', ['household_id', 'ingredient_id'])
+
+        # Indexes for the household dashboard (see food/dashboard.py): its
+        # recent leftovers, and its most used ingredients
+        db.create_index('food_leftover', ['household_id', 'date_cooked'])
+        db.create_index('food_householdingredient', ['household_id', 'meals'])
+
+        # The new tables are filled in by the rebuild_household_summaries
+        # management command
+
+
+    def backwards(self, orm):
+        db.delete_index('food_householdingredient', ['household_id', 'meals'])
+        db.delete_index('food_leftover', ['household_id', 'date_cooked'])
+
+        # Removing unique constraint on 'HouseholdIngredient', fields ['household', 'ingredient']
+        db.delete_unique('food_householdingredient', ['household_id', 'ingredient_id'])
+
+        # Removing unique constraint on 'MemberDay', fields ['household', 'date', 'user']
+        db.delete_unique('food_memberday', ['household_id', 'date', 'user_id'])
+
+        # Removing unique constraint on 'MemberTotals', fields ['household', 'user']
+        db.delete_unique('food_membertotals', ['household_id', 'user_id'])
+
+        # Deleting model 'MemberTotals'
+        db.delete_table('food_membertotals')
+
+        # Deleting model 'MemberDay'
+        db.delete_table('food_memberday')
+
+        # Deleting model 'Leftover'
+        db.delete_table('food_leftover')
+
+        # Deleting model 'HouseholdIngredient'
+        db.delete_table('food_householdingredient')
+
+
+    models = {
+        'accounts.household': {
+            'Meta': {'object_name': 'Household'},
+            'admin': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'admin_for_set'", 'to': "orm['auth.User']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'food.amount': {
+            'Meta': {'object_name': 'Amount'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'contained_comestible': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'containing_dishes_set'", 'to': "orm['food.Comestible']"}),
+            'containing_dish': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['food.Dish']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '0', 'null': 'True', 'max_digits': '8', 'decimal_places': '2', 'blank': 'True'})
+        },
+        'food.comestible': {
+            'Meta': {'object_name': 'Comestible'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_dish': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'unit': ('django.db.models.fields.CharField', [], {'default': "'g'", 'max_length': '5'})
+        },
+        'food.dish': {
+            'Meta': {'ordering': "['-date_cooked']", 'object_name': 'Dish', '_ormbases': ['food.Comestible']},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'comestible_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['food.Comestible']", 'unique': 'True', 'primary_key': 'True'}),
+            'cooks': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'cooked_dishes'", 'symmetrical': 'False', 'to': "orm['auth.User']"}),
+            'date_cooked': ('django.db.models.fields.DateField', [], {'default': 'datetime.date.today'}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'dishes'", 'to': "orm['accounts.Household']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '500', 'null': 'True', 'max_digits': '8', 'decimal_places': '2', 'blank': 'True'}),
+            'recipe_url': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        'food.dishingredient': {
+            'Meta': {'unique_together': "(('ingredient', 'dish'),)", 'object_name': 'DishIngredient'},
+            'dish': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'ingredient_totals'", 'to': "orm['food.Dish']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ingredient': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'dish_totals'", 'to': "orm['food.Ingredient']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'max_digits': '12', 'decimal_places': '2'})
+        },
+        'food.householdingredient': {
+            'Meta': {'unique_together': "(('household', 'ingredient'),)", 'object_name': 'HouseholdIngredient'},
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'ingredient_counts'", 'to': "orm['accounts.Household']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ingredient': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'household_counts'", 'to': "orm['food.Ingredient']"}),
+            'meals': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'food.ingredient': {
+            'Meta': {'ordering': "['name']", 'object_name': 'Ingredient', '_ormbases': ['food.Comestible']},
+            'calories': ('django.db.models.fields.DecimalField', [], {'max_digits': '8', 'decimal_places': '2'}),
+            'comestible_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['food.Comestible']", 'unique': 'True', 'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '200'}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '100', 'max_digits': '8', 'decimal_places': '2'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        'food.leftover': {
+            'Meta': {'object_name': 'Leftover'},
+            'date_cooked': ('django.db.models.fields.DateField', [], {}),
+            'dish': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'leftover'", 'unique': 'True', 'primary_key': 'True', 'to': "orm['food.Dish']"}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'leftovers'", 'to': "orm['accounts.Household']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'max_digits': '8', 'decimal_places': '2'})
+        },
+        'food.meal': {
+            'Meta': {'ordering': "['date', 'time']", 'object_name': 'Meal'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'comestibles': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['food.Comestible']", 'through': "orm['food.Portion']", 'symmetrical': 'False'}),
+            'date': ('django.db.models.fields.DateField', [], {'default': 'datetime.date.today'}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'meals'", 'to': "orm['accounts.Household']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'time': ('django.db.models.fields.TimeField', [], {}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'meals'", 'to': "orm['auth.User']"})
+        },
+        'food.mealingredient': {
+            'Meta': {'unique_together': "(('ingredient', 'meal'),)", 'object_name': 'MealIngredient'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ingredient': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'meal_totals'", 'to': "orm['food.Ingredient']"}),
+            'meal': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'ingredient_totals'", 'to': "orm['food.Meal']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'max_digits': '12', 'decimal_places': '2'})
+        },
+        'food.memberday': {
+            'Meta': {'unique_together': "(('household', 'date', 'user'),)", 'object_name': 'MemberDay'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'default': '0', 'max_digits': '10', 'decimal_places': '2'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'member_days'", 'to': "orm['accounts.Household']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'member_days'", 'to': "orm['auth.User']"})
+        },
+        'food.membertotals': {
+            'Meta': {'unique_together': "(('household', 'user'),)", 'object_name': 'MemberTotals'},
+            'dishes_cooked': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'household': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'member_totals'", 'to': "orm['accounts.Household']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'member_totals'", 'to': "orm['auth.User']"})
+        },
+        'food.portion': {
+            'Meta': {'object_name': 'Portion'},
+            'calories': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '2'}),
+            'comestible': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['food.Comestible']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'meal': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['food.Meal']"}),
+            'quantity': ('django.db.models.fields.DecimalField', [], {'default': '0', 'null': 'True', 'max_digits': '8', 'decimal_places': '2', 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['food']
\ No newline at end of file
@@ -1,9 +1,13 @@
 import datetime
 import sys
-
-from django.db import models
-from django.db.models import Sum
-from django.db.models.signals import post_save, post_delete
+from decimal import Decimal
+from itertools import chain
+
+from django.db import DatabaseError, IntegrityError, connection, models, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.query import QuerySet
+from django.db.models.signals import (post_init, post_save, pre_delete,
+                                      post_delete, m2m_changed)
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from django.forms import ModelForm
@@ -13,6 +17,10 @@ from django.contrib.auth.models import User
 
 from registration.signals import user_activated
 
+from accounts.models import Household
+from food.caching import invalidate_detail
+from food.metrics import count_cascade_save
+
 # Quantities for Ingredient and Dish must be greater than 0, to avoid
 # dividing by 0 in calories calculations for Amount and Portion. (They
 # both have positive default values, but those are only used as initial
@@ -39,6 +47,41 @@ UNIT_CHOICES = (
     )
 
 
+# Dishes and meals belong to a household, and the views only ever show those
+# of the user's own household, so they're looked up through these (with the
+# indexes starting with household in migration 0026), e.g.
+# Dish.objects.for_household(household).filter(date_cooked=date)
+
+class HouseholdQuerySet(QuerySet):
+    def for_household(self, household):
+        """
+        Returns the objects belonging to household (a Household or its id),
+        or none of them if household is None (e.g. for anonymous users).
+        """
+        if household is None:
+            return self.none()
+        return self.filter(household=household)
+
+
+class HouseholdManager(models.Manager):
+    def get_query_set(self):
+        return HouseholdQuerySet(self.model, using=self._db)
+
+    def for_household(self, household):
+        return self.get_query_set().for_household(household)
+
+
+def household_comestibles(household):
+    """
+    Returns the comestibles which household can use in its dishes and meals:
+    all the ingredients, and its own dishes.
+    """
+    if household is None:
+        return Comestible.objects.filter(is_dish=False)
+    return Comestible.objects.filter(Q(is_dish=False) |
+                                     Q(dish__household=household))
+
+
 class Comestible(models.Model):
     is_dish = models.BooleanField(default=True, editable=False)
     unit = models.CharField(max_length=5, choices=UNIT_CHOICES, default="g")
@@ -61,6 +104,7 @@ class Ingredient(Comestible):
                                    validators=[validate_positive])
     calories = models.DecimalField(max_digits=8, decimal_places=2,
                                    validators=[validate_positive_or_zero])
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __unicode__(self):
         return self.name
@@ -97,6 +141,9 @@ class Dish(Comestible):
                                  null=True)
     calories = models.DecimalField(max_digits=8, decimal_places=2, null=True,
                                    editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = HouseholdManager()
 
     def __unicode__(self):
         return self.name+u" ("+unicode(self.date_cooked)+u")"
@@ -142,6 +189,73 @@ class Dish(Comestible):
         result.unit = self.unit
         return result
 
+    @transaction.commit_on_success
+    def scale(self, factor):
+        """
+        Multiplies the quantity of this dish, and the quantities and calories
+        of all its amounts, by factor.
+
+        This uses one UPDATE for the amounts and one for the dish instead of
+        saving each amount (which would save the dish, and everything
+        containing it, once per amount), then recalculates the calories of
+        the dish and everything which depends on it once.
+        """
+        _update_rounded(Amount, [('quantity', factor), ('calories', factor)],
+                        'containing_dish_id', self.id)
+        _update_rounded(Dish, [('quantity', factor)],
+                        'comestible_ptr_id', self.id)
+        # The dish's proportions don't change, so neither do the index rows
+        # of anything containing it
+        _update_rounded(DishIngredient, [('quantity', factor)],
+                        'dish_id', self.id)
+        # The pages of the dishes this contains show the scaled amounts (and
+        # more or less of those dishes is left)
+        contained_dish_ids = list(Amount.objects.filter(
+            containing_dish=self, contained_comestible__is_dish=True).values_list(
+            'contained_comestible', flat=True))
+        invalidate_detail('dish', contained_dish_ids)
+        update_leftovers([self.id] + contained_dish_ids)
+        recalculate_dishes([self.id])
+        # Bring this instance up to date with the database
+        self.quantity, self.calories = Dish.objects.filter(pk=self.id).values_list(
+                                           'quantity', 'calories')[0]
+
+    @transaction.commit_on_success
+    def duplicate(self, dates):
+        """
+        Creates a copy of this dish, with the same amounts, cooked on each of
+        the given dates, and returns the new dishes.
+
+        The copies are identical to this dish, so their calories (and their
+        amounts' calories) are copied rather than recalculated, and the new
+        dishes and amounts are inserted in bulk, a few queries for all of
+        them, without saving each one (so without sending any signals).
+        """
+        amounts = list(self.amount_set.select_related('containing_dish',
+                                                      'contained_comestible'))
+        new_dishes = []
+        for date in dates:
+            new_dish = self.clone()
+            new_dish.date_cooked = date
+            new_dish.calories = self.calories
+            new_dishes.append(new_dish)
+        bulk_insert_with_ids(new_dishes)
+        new_amounts = []
+        for new_dish in new_dishes:
+            for amount in amounts:
+                new_amount = amount.clone()
+                new_amount.containing_dish = new_dish
+                new_amounts.append(new_amount)
+        bulk_insert(new_amounts)
+        _copy_index_rows(DishIngredient, 'dish',
+                         {self.id: [dish.id for dish in new_dishes]})
+        # The pages of the dishes this contains list the new dishes (and
+        # the new dishes use more of them)
+        contained_ids = [amount.contained_comestible_id for amount in amounts]
+        invalidate_detail('dish', contained_ids)
+        update_leftovers([dish.id for dish in new_dishes] + contained_ids)
+        return new_dishes
+
 # perhaps Dish also needs to update is_dish when saving, since defaults seem to
 # be broken with South...
 
@@ -232,6 +346,9 @@ class Meal(models.Model):
                                          editable=False)
     calories = models.DecimalField(max_digits=8, decimal_places=2, null=True,
                                    editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = HouseholdManager()
 
     def __unicode__(self):
         return self.name+u" on "+unicode(self.date)
@@ -252,6 +369,37 @@ class Meal(models.Model):
         result.calories = self.calories
         return result
 
+    @transaction.commit_on_success
+    def duplicate(self, dates):
+        """
+        Creates a copy of this meal, with the same portions, eaten on each of
+        the given dates, and returns the new meals.
+
+        As for Dish.duplicate(), calories are copied rather than recalculated,
+        and the new meals and portions are inserted without sending signals.
+        """
+        portions = list(self.portion_set.select_related('meal', 'comestible'))
+        new_meals = []
+        for date in dates:
+            new_meal = self.clone()
+            new_meal.date = date
+            new_meals.append(new_meal)
+        bulk_insert_with_ids(new_meals)
+        new_portions = []
+        for new_meal in new_meals:
+            for portion in portions:
+                new_portion = portion.clone()
+                new_portion.meal = new_meal
+                new_portions.append(new_portion)
+        bulk_insert(new_portions)
+        _copy_index_rows(MealIngredient, 'meal',
+                         {self.id: [meal.id for meal in new_meals]})
+        _update_summaries_for_new_meals(new_meals, new_portions)
+        # The pages of the dishes in this meal list the new portions
+        invalidate_detail('dish', [portion.comestible_id
+                                   for portion in portions])
+        return new_meals
+
     def save(self, *args, **kwargs):
         # Calculate calories for the meal if it already has portions
         # New meal needs to be saved again after portions are created to
@@ -271,6 +419,71 @@ class MealForm(ModelForm):
         model = Meal
 
 
+@transaction.commit_on_success
+def copy_week(from_week_start, to_week_start, household, user=None):
+    """
+    Copies all the meals of household (a Household or its id; none if it's
+    None, as for for_household()), optionally only those of a user, in the
+    week beginning on from_week_start, with their portions, to the same days
+    and times in the week beginning on to_week_start, and returns the new
+    meals.
+
+    The source meals and portions are read with one query each, the copies
+    are inserted with one query per table (see bulk_insert_with_ids()), and
+    (as for Meal.duplicate()) they keep their calories, so the daily totals
+    of the new week are right straight away without recalculating anything.
+    Raises ValueError if the two weeks are the same.
+    """
+    if to_week_start == from_week_start:
+        raise ValueError("can't copy a week to itself")
+    offset = to_week_start - from_week_start
+    week_end = from_week_start + datetime.timedelta(days=6)
+    meals = Meal.objects.for_household(household).filter(
+                date__range=(from_week_start, week_end))
+    if user is not None:
+        meals = meals.filter(user=user)
+    meals = list(meals.select_related('household', 'user'))
+    portions_by_meal = {}
+    for chunk in _chunks([meal.id for meal in meals]):
+        for portion in Portion.objects.filter(
+                meal__in=chunk).select_related('comestible'):
+            portions_by_meal.setdefault(portion.meal_id, []).append(portion)
+    new_meals = []
+    for meal in meals:
+        new_meal = meal.clone()
+        new_meal.date = meal.date + offset
+        new_meals.append(new_meal)
+    bulk_insert_with_ids(new_meals)
+    new_portions = []
+    new_meal_ids = {}
+    for meal, new_meal in zip(meals, new_meals):
+        new_meal_ids[meal.id] = [new_meal.id]
+        for portion in portions_by_meal.get(meal.id, []):
+            # (portion.meal is the same as meal, so don't look it up again)
+            portion.meal = meal
+            new_portion = portion.clone()
+            new_portion.meal = new_meal
+            new_portions.append(new_portion)
+    bulk_insert(new_portions)
+    _copy_index_rows(MealIngredient, 'meal', new_meal_ids)
+    _update_summaries_for_new_meals(new_meals, new_portions)
+    invalidate_detail('dish', [portion.comestible_id
+                               for portion in new_portions])
+    return new_meals
+
+
+def _update_summaries_for_new_meals(meals, portions):
+    """
+    Adds meals inserted without signals, and their portions, to the household
+    summaries.
+    """
+    update_member_days((meal.household_id, meal.user_id, meal.date)
+                       for meal in meals)
+    count_meal_ingredients([meal.id for meal in meals])
+    update_leftovers(set(portion.comestible_id for portion in portions
+                         if portion.comestible.is_dish))
+
+
 #class Eating(models.Model):
 #    comestible = models.ForeignKey(Comestible)
 #    meal = models.ForeignKey(Meal)
@@ -304,6 +517,7 @@ class Portion(models.Model):
                                    validators=[validate_positive_or_zero])
     calories = models.DecimalField(max_digits=8, decimal_places=2, null=True,
                                    editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __unicode__(self):
         return unicode(self.comestible)
@@ -327,7 +541,8 @@ class Portion(models.Model):
         than the available quantity of the dish (the dish's remaining quantity
         plus the portion's saved quantity, if it exists).
         """
-        if self.comestible.is_dish:
+        # (comestible isn't set if the one chosen wasn't valid)
+        if self.comestible_id is not None and self.comestible.is_dish:
             remaining_quantity = self.comestible.dish.get_remaining_quantity()
             # Check if this portion is already saved, and get the saved
             # quantity if so.
@@ -354,8 +569,859 @@ class Portion(models.Model):
 #        order_with_respect_to = 'meal'
 
 
+# The ingredient index: the total quantity of each ingredient in each dish and
+# meal, including the ingredients of the dishes they contain (and of the
+# dishes those contain, and so on), for finding everything an ingredient is
+# in without following amounts and portions down one level at a time. It's
+# kept up to date by the signal receivers and bulk operations below, and can
+# be rebuilt with the rebuild_ingredient_index management command.
+
+class DishIngredient(models.Model):
+    dish = models.ForeignKey(Dish, related_name='ingredient_totals')
+    ingredient = models.ForeignKey(Ingredient, related_name='dish_totals')
+    # in the ingredient's unit
+    quantity = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __unicode__(self):
+        return u'%s %s in %s' % (self.quantity, self.ingredient, self.dish)
+
+    class Meta:
+        unique_together = ('ingredient', 'dish')
+
+
+class MealIngredient(models.Model):
+    meal = models.ForeignKey(Meal, related_name='ingredient_totals')
+    ingredient = models.ForeignKey(Ingredient, related_name='meal_totals')
+    # in the ingredient's unit
+    quantity = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __unicode__(self):
+        return u'%s %s in %s' % (self.quantity, self.ingredient, self.meal)
+
+    class Meta:
+        unique_together = ('ingredient', 'meal')
+
+
+# The household summaries: running totals for each household and its members,
+# which the household dashboard (see food.dashboard) shows without adding up
+# their meals and dishes, so that it takes the same time however long the
+# household's history is. Like the ingredient index, they're kept up to date
+# by the signal receivers and bulk operations below, and can be rebuilt with
+# the rebuild_household_summaries management command.
+
+class MemberDay(models.Model):
+    """
+    The total calories of the meals of a member of a household on one day.
+    """
+    household = models.ForeignKey('accounts.Household', related_name='member_days')
+    user = models.ForeignKey(User, related_name='member_days')
+    date = models.DateField()
+    calories = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    def __unicode__(self):
+        return u'%s calories for %s on %s' % (self.calories, self.user, self.date)
+
+    class Meta:
+        # (household and date first, for the days of a week)
+        unique_together = ('household', 'date', 'user')
+
+
+class MemberTotals(models.Model):
+    """
+    All-time totals for a member of a household.
+    """
+    household = models.ForeignKey('accounts.Household', related_name='member_totals')
+    user = models.ForeignKey(User, related_name='member_totals')
+    dishes_cooked = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s in %s' % (self.user, self.household)
+
+    class Meta:
+        unique_together = ('household', 'user')
+
+
+class Leftover(models.Model):
+    """
+    The quantity of a dish not yet eaten or used in other dishes (only for
+    dishes with some left).
+    """
+    dish = models.OneToOneField(Dish, primary_key=True, related_name='leftover')
+    # (copied from the dish, for finding a household's recent leftovers)
+    household = models.ForeignKey('accounts.Household', related_name='leftovers')
+    date_cooked = models.DateField()
+    # in the dish's unit
+    quantity = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __unicode__(self):
+        return u'%s %s of %s' % (self.quantity, self.dish.unit, self.dish)
+
+
+class HouseholdIngredient(models.Model):
+    """
+    The number of a household's meals containing an ingredient (directly or
+    in their dishes), from the ingredient index.
+    """
+    household = models.ForeignKey('accounts.Household',
+                                  related_name='ingredient_counts')
+    ingredient = models.ForeignKey(Ingredient, related_name='household_counts')
+    meals = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s in %s meals of %s' % (self.ingredient, self.meals,
+                                          self.household)
+
+    class Meta:
+        unique_together = ('household', 'ingredient')
+
+
+# Bulk inserts and set-based calories recalculation, for operations which
+# create or update many objects at once instead of saving them one at a time
+# (and so don't fire the signal receivers below)
+
+# Dishes can't contain themselves, but this stops recalculate_calories going
+# round forever if a dish somehow contains itself through other dishes
+MAX_DISH_NESTING = 50
+
+def _update_rounded(model, assignments, where_column, where_value):
+    """
+    Runs one UPDATE on the table of model, without calling save() or sending
+    any signals. assignments is a list of (column, factor) tuples, and each
+    column is set to column * factor, rounded to 2 decimal places like the
+    DecimalFields are when saved, for the rows where where_column is
+    where_value.
+
+    The factor can instead be a (source_column, factor) tuple, to set column
+    to source_column * factor.
+
+    If the model has an updated_at field, it's set to now, as save() would.
+    """
+    qn = connection.ops.quote_name
+    set_clauses = []
+    params = []
+    for column, factor in assignments:
+        if isinstance(factor, tuple):
+            source_column, factor = factor
+        else:
+            source_column = column
+        set_clauses.append(u'%s = ROUND(%s * %%s, 2)' % (qn(column),
+                                                         qn(source_column)))
+        # (PostgreSQL only rounds numerics to a number of places, not floats)
+        if isinstance(factor, float):
+            factor = Decimal(repr(factor))
+        params.append(factor)
+    if 'updated_at' in model._meta.get_all_field_names():
+        set_clauses.append(u'%s = %%s' % qn('updated_at'))
+        params.append(connection.ops.value_to_db_datetime(datetime.datetime.now()))
+    params.append(where_value)
+    cursor = connection.cursor()
+    cursor.execute(u'UPDATE %s SET %s WHERE %s = %%s' % (
+                       qn(model._meta.db_table),
+                       u', '.join(set_clauses),
+                       qn(where_column)),
+                   params)
+    transaction.commit_unless_managed()
+
+def insert_without_signals(obj, cls=None):
+    """
+    Inserts a new row for the unsaved instance obj (and rows for its parent
+    models first, e.g. a Comestible for a Dish), setting its primary key,
+    without calling save() or sending any signals.
+    """
+    if cls is None:
+        cls = obj.__class__
+    meta = cls._meta
+    for parent, field in meta.parents.items():
+        insert_without_signals(obj, parent)
+        setattr(obj, field.attname, obj._get_pk_val(parent._meta))
+    values = [(f, f.get_db_prep_save(f.pre_save(obj, True),
+                                     connection=connection))
+              for f in meta.local_fields if not isinstance(f, models.AutoField)]
+    pk = cls._base_manager._insert(values, return_id=meta.has_auto_field,
+                                    using=connection.alias)
+    if meta.has_auto_field:
+        setattr(obj, meta.pk.attname, pk)
+    obj._state.adding = False
+    obj._state.db = connection.alias
+    transaction.commit_unless_managed()
+
+def bulk_insert(objs, cls=None):
+    """
+    Inserts new rows for a list of unsaved instances of one model with a
+    single executemany(), without calling save() or sending any signals. The
+    instances' primary keys aren't set afterwards (see bulk_insert_with_ids()).
+    Only the table of cls (by default the instances' model) is inserted into,
+    so for a model with a parent model (e.g. Ingredient) the parent rows must
+    have been inserted already, and their ids set.
+    """
+    if not objs:
+        return
+    if cls is None:
+        cls = objs[0].__class__
+    meta = cls._meta
+    fields = [f for f in meta.local_fields if not isinstance(f, models.AutoField)]
+    qn = connection.ops.quote_name
+    sql = u'INSERT INTO %s (%s) VALUES (%s)' % (
+              qn(meta.db_table),
+              u', '.join(qn(f.column) for f in fields),
+              u', '.join([u'%s'] * len(fields)))
+    cursor = connection.cursor()
+    cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True),
+                                                 connection=connection)
+                              for f in fields]
+                             for obj in objs])
+    transaction.commit_unless_managed()
+
+def bulk_insert_with_ids(objs, cls=None):
+    """
+    Inserts new rows for a list of unsaved instances of one model (and rows for
+    its parent models first, as insert_without_signals() does) with one
+    executemany() per table, and sets their primary keys, without calling
+    save() or sending any signals.
+
+    The new ids are read back as those above the table's highest id before
+    the insert, in order, so if anything else inserts into the same table at
+    the same time, this raises DatabaseError rather than getting them wrong.
+    """
+    if not objs:
+        return
+    if cls is None:
+        cls = objs[0].__class__
+    meta = cls._meta
+    for parent, field in meta.parents.items():
+        bulk_insert_with_ids(objs, parent)
+        for obj in objs:
+            setattr(obj, field.attname, obj._get_pk_val(parent._meta))
+    if meta.has_auto_field:
+        max_id = cls._base_manager.aggregate(max_id=Max('pk'))['max_id'] or 0
+    bulk_insert(objs, cls)
+    if meta.has_auto_field:
+        ids = list(cls._base_manager.filter(pk__gt=max_id).order_by(
+                       'pk').values_list('pk', flat=True))
+        if len(ids) != len(objs):
+            raise DatabaseError("%s rows were inserted into %s instead of %s" % (
+                                    len(ids), meta.db_table, len(objs)))
+        for obj, pk in zip(objs, ids):
+            setattr(obj, meta.pk.attname, pk)
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = connection.alias
+
+def bulk_update(objs, field_names):
+    """
+    Updates the given fields of a list of saved instances of one model with a
+    single executemany() of an UPDATE by primary key, without calling save()
+    or sending any signals. The fields must be in the model's own table (not
+    a parent model's), and any auto_now field among them is set to now.
+    """
+    if not objs:
+        return
+    meta = objs[0]._meta
+    fields = [meta.get_field(name) for name in field_names]
+    qn = connection.ops.quote_name
+    sql = u'UPDATE %s SET %s WHERE %s = %%s' % (
+              qn(meta.db_table),
+              u', '.join(u'%s = %%s' % qn(f.column) for f in fields),
+              qn(meta.pk.column))
+    cursor = connection.cursor()
+    cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, False),
+                                                 connection=connection)
+                              for f in fields] + [obj.pk]
+                             for obj in objs])
+    transaction.commit_unless_managed()
+
+def _recalculate_dish_totals(dish_ids):
+    """
+    Sets the calories of each of the given dishes to the total calories of its
+    amounts, and returns the ids of the dishes whose calories changed.
+    """
+    changed_ids = set()
+    for chunk in _chunks(dish_ids):
+        totals = dict(Amount.objects.filter(containing_dish__in=chunk)
+                                    .values_list('containing_dish')
+                                    .annotate(Sum('calories')))
+        for dish_id, calories in Dish.objects.filter(pk__in=chunk).values_list(
+                                     'pk', 'calories'):
+            # a dish without any amounts has 0 calories, as in Dish.save()
+            total = totals.get(dish_id) or 0
+            if calories is None or calories != total:
+                Dish.objects.filter(pk=dish_id).update(calories=total,
+                                                       updated_at=datetime.datetime.now())
+                changed_ids.add(dish_id)
+    return changed_ids
+
+def _recalculate_meal_totals(meal_ids):
+    """
+    Sets the calories of each of the given meals to the total calories of its
+    portions (and updates the members' days of those which changed).
+    """
+    changed_days = set()
+    for chunk in _chunks(meal_ids):
+        totals = dict(Portion.objects.filter(meal__in=chunk)
+                                     .values_list('meal')
+                                     .annotate(Sum('calories')))
+        for meal_id, calories, household_id, user_id, date in Meal.objects.filter(
+                pk__in=chunk).values_list('pk', 'calories', 'household', 'user',
+                                          'date'):
+            total = totals.get(meal_id) or 0
+            if calories is None or calories != total:
+                Meal.objects.filter(pk=meal_id).update(calories=total,
+                                                       updated_at=datetime.datetime.now())
+                changed_days.add((household_id, user_id, date))
+    update_member_days(changed_days)
+
+@transaction.commit_on_success
+def recalculate_calories(comestible_ids):
+    """
+    Recalculates the calories of every amount and portion of the given
+    comestibles (ingredients or dishes), then of the dishes and meals
+    containing them, and so on up through any dishes containing those dishes.
+
+    This does the same job as the signal receivers below, but with one UPDATE
+    per changed comestible, dish or meal instead of a save() (and another
+    round of signals) per object.
+    """
+    comestible_ids = set(comestible_ids)
+    meal_ids = set()
+    for depth in range(MAX_DISH_NESTING):
+        if not comestible_ids:
+            break
+        calories_per_unit = {}
+        dish_ids = set()
+        # (only the comestibles which are in any amounts or portions need
+        # updating, which after an import is usually few of them)
+        in_amounts = set()
+        in_portions = set()
+        # (in chunks, as an import can change any number of ingredients)
+        for chunk in _chunks(comestible_ids):
+            for model in (Ingredient, Dish):
+                for pk, calories, quantity in model.objects.filter(
+                        pk__in=chunk).values_list('pk', 'calories', 'quantity'):
+                    # (a dish can have no quantity, but then its amounts and
+                    # portions can't have calories either)
+                    if quantity:
+                        calories_per_unit[pk] = (calories or 0) / quantity
+            for comestible_id, dish_id in Amount.objects.filter(
+                    contained_comestible__in=chunk).values_list(
+                    'contained_comestible', 'containing_dish'):
+                in_amounts.add(comestible_id)
+                dish_ids.add(dish_id)
+            for comestible_id, meal_id in Portion.objects.filter(
+                    comestible__in=chunk).values_list('comestible', 'meal'):
+                in_portions.add(comestible_id)
+                meal_ids.add(meal_id)
+        for comestible_id, factor in calories_per_unit.items():
+            if comestible_id in in_amounts:
+                _update_rounded(Amount, [('calories', ('quantity', factor))],
+                                'contained_comestible_id', comestible_id)
+            if comestible_id in in_portions:
+                _update_rounded(Portion, [('calories', ('quantity', factor))],
+                                'comestible_id', comestible_id)
+        # Both the pages of the dishes whose amounts and portions changed,
+        # and of the dishes containing them, show those amounts' calories
+        invalidate_detail('dish', comestible_ids | dish_ids)
+        # Only dishes whose calories have changed need to be passed on up
+        comestible_ids = _recalculate_dish_totals(dish_ids)
+    _recalculate_meal_totals(meal_ids)
+    invalidate_detail('meal', meal_ids)
+
+@transaction.commit_on_success
+def recalculate_dishes(dish_ids):
+    """
+    Recalculates the calories of the given dishes from their amounts, and then
+    of everything which contains them (even if their calories haven't changed,
+    since their quantities might have).
+    """
+    _recalculate_dish_totals(dish_ids)
+    recalculate_calories(dish_ids)
+
+
+# Maximum number of ids in one "IN (...)" query (SQLite allows at most 999
+# parameters in a query)
+MAX_IN_IDS = 500
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), MAX_IN_IDS):
+        yield ids[start:start + MAX_IN_IDS]
+
+def _delete_in(model, column, ids):
+    """
+    Deletes the rows of model's table where column is one of ids, without
+    loading them or sending any signals (so only for models which nothing
+    else refers to).
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for chunk in _chunks(ids):
+        cursor.execute(u'DELETE FROM %s WHERE %s IN (%s)' % (
+                           qn(model._meta.db_table), qn(column),
+                           u', '.join([u'%s'] * len(chunk))),
+                       chunk)
+    transaction.commit_unless_managed()
+
+def _dish_ingredients(dish_ids):
+    """
+    Returns a dict of {dish id: {ingredient id: quantity}} for the given
+    dishes, from the ingredient index.
+    """
+    totals = {}
+    for chunk in _chunks(dish_ids):
+        for dish_id, ingredient_id, quantity in DishIngredient.objects.filter(
+                dish__in=chunk).values_list('dish', 'ingredient', 'quantity'):
+            totals.setdefault(dish_id, {})[ingredient_id] = quantity
+    return totals
+
+def _add_ingredients(totals, comestible_id, is_dish, quantity, dish_quantity,
+                     dish_totals):
+    """
+    Adds the ingredients in quantity of a comestible to the dict totals, where
+    dish_totals is the dict of ingredient quantities in the whole dish if the
+    comestible is a dish.
+    """
+    if not quantity:
+        return
+    if not is_dish:
+        totals[comestible_id] = totals.get(comestible_id, 0) + quantity
+    elif dish_quantity:
+        for ingredient_id, ingredient_quantity in dish_totals.iteritems():
+            totals[ingredient_id] = (totals.get(ingredient_id, 0) +
+                                     ingredient_quantity * quantity / dish_quantity)
+
+def _replace_index_rows(model, owner_field, totals):
+    """
+    Replaces the ingredient index rows (of DishIngredient or MealIngredient)
+    of each dish or meal in the dict totals of {id: {ingredient id: quantity}}.
+    """
+    _delete_in(model, owner_field + '_id', totals.keys())
+    bulk_insert([model(**{owner_field + '_id': owner_id,
+                          'ingredient_id': ingredient_id,
+                          'quantity': quantity.quantize(Decimal('0.01'))})
+                 for owner_id, ingredients in totals.iteritems()
+                 for ingredient_id, quantity in ingredients.iteritems()
+                 if quantity])
+
+def _copy_index_rows(model, owner_field, new_ids_by_old_id):
+    """
+    Copies the ingredient index rows of each dish or meal in the dict
+    new_ids_by_old_id to each of the ids it maps to (for copies of dishes or
+    meals, which contain the same ingredients).
+    """
+    rows = []
+    for chunk in _chunks(new_ids_by_old_id.keys()):
+        for old_id, ingredient_id, quantity in model.objects.filter(**{
+                '%s__in' % owner_field: chunk}).values_list(
+                owner_field, 'ingredient', 'quantity'):
+            for new_id in new_ids_by_old_id[old_id]:
+                rows.append(model(**{owner_field + '_id': new_id,
+                                     'ingredient_id': ingredient_id,
+                                     'quantity': quantity}))
+    bulk_insert(rows)
+
+@transaction.commit_on_success
+def update_dish_ingredients(dish_ids):
+    """
+    Recalculates the ingredient index rows of the given dishes from their
+    amounts, using the index rows of any other dishes they contain.
+
+    Dishes in dish_ids which contain each other are calculated in the right
+    order, so this can rebuild the index for any set of dishes at once, but
+    the dishes containing the given dishes aren't updated (the signal
+    receivers do that by saving them).
+    """
+    dish_ids = set(dish_ids)
+    amounts = {}
+    contained_dish_ids = set()
+    for chunk in _chunks(dish_ids):
+        for values in Amount.objects.filter(containing_dish__in=chunk).values_list(
+                'containing_dish', 'contained_comestible',
+                'contained_comestible__is_dish', 'quantity',
+                'contained_comestible__dish__quantity'):
+            amounts.setdefault(values[0], []).append(values[1:])
+            if values[2]:
+                contained_dish_ids.add(values[1])
+    totals = _dish_ingredients(contained_dish_ids - dish_ids)
+
+    def calculate(dish_id):
+        if dish_id not in totals:
+            # (added before its amounts, so that a dish which somehow
+            # contains itself doesn't recurse forever)
+            dish_totals = totals[dish_id] = {}
+            for comestible_id, is_dish, quantity, dish_quantity in amounts.get(dish_id, []):
+                _add_ingredients(dish_totals, comestible_id, is_dish, quantity,
+                                 dish_quantity, is_dish and calculate(comestible_id))
+        return totals[dish_id]
+
+    _replace_index_rows(DishIngredient, 'dish',
+                        dict((dish_id, calculate(dish_id)) for dish_id in dish_ids))
+
+@transaction.commit_on_success
+def update_meal_ingredients(meal_ids):
+    """
+    Recalculates the ingredient index rows of the given meals from their
+    portions, using the index rows of the dishes they contain.
+    """
+    portions = []
+    for chunk in _chunks(meal_ids):
+        portions.extend(Portion.objects.filter(meal__in=chunk).values_list(
+                            'meal', 'comestible', 'comestible__is_dish',
+                            'quantity', 'comestible__dish__quantity'))
+    dish_totals = _dish_ingredients(set(comestible_id for meal_id, comestible_id,
+                                        is_dish, quantity, dish_quantity in portions
+                                        if is_dish))
+    totals = dict((meal_id, {}) for meal_id in meal_ids)
+    for meal_id, comestible_id, is_dish, quantity, dish_quantity in portions:
+        _add_ingredients(totals[meal_id], comestible_id, is_dish, quantity,
+                         dish_quantity, dish_totals.get(comestible_id, {}))
+    # The households' ingredient counts lose the meals' old rows and gain
+    # their new ones
+    old_counts = _meal_ingredient_counts(meal_ids, -1)
+    _replace_index_rows(MealIngredient, 'meal', totals)
+    _add_household_ingredients(old_counts, _meal_ingredient_counts(meal_ids))
+
+
+def _on_conflict(write, retry):
+    """
+    Calls write(), and if that breaks a unique constraint, undoes it and calls
+    retry() instead. With PostgreSQL another process can create the same
+    summary row at the same time (SQLite only lets one process write at a
+    time), so that write() finds it there and retry() can update it.
+    """
+    sid = transaction.savepoint()
+    try:
+        write()
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        retry()
+    else:
+        transaction.savepoint_commit(sid)
+
+def _key_set(keys):
+    # (keys of objects not saved yet, or without a household, are left out)
+    return set(key for key in keys if key is not None and None not in key)
+
+@transaction.commit_on_success
+def update_member_days(days):
+    """
+    Recalculates the MemberDay rows for each (household id, user id, date)
+    in days from the meals on that day.
+    """
+    days = _key_set(days)
+    if not days:
+        return
+    household_ids = set(day[0] for day in days)
+    user_ids = set(day[1] for day in days)
+    totals = {}
+    for chunk in _chunks(set(day[2] for day in days)):
+        # (order_by() so that the default ordering isn't grouped by as well)
+        for household_id, user_id, date, calories in Meal.objects.filter(
+                household__in=household_ids, user__in=user_ids,
+                date__in=chunk).order_by().values_list(
+                'household', 'user', 'date').annotate(Sum('calories')):
+            totals[(household_id, user_id, date)] = calories or 0
+    for day in days:
+        household_id, user_id, date = day
+        rows = MemberDay.objects.filter(household=household_id, user=user_id,
+                                        date=date)
+        if day not in totals:
+            rows.delete()
+        elif not rows.update(calories=totals[day]):
+            _on_conflict(lambda: MemberDay.objects.create(
+                             household_id=household_id, user_id=user_id,
+                             date=date, calories=totals[day]),
+                         lambda: rows.update(calories=totals[day]))
+
+@transaction.commit_on_success
+def update_member_totals(members):
+    """
+    Recounts the dishes cooked by each (household id, user id) in members.
+    """
+    for household_id, user_id in _key_set(members):
+        count = Dish.cooks.through.objects.filter(
+                    user=user_id, dish__household=household_id).count()
+        rows = MemberTotals.objects.filter(household=household_id, user=user_id)
+        if not rows.update(dishes_cooked=count):
+            _on_conflict(lambda: MemberTotals.objects.create(
+                             household_id=household_id, user_id=user_id,
+                             dishes_cooked=count),
+                         lambda: rows.update(dishes_cooked=count))
+
+@transaction.commit_on_success
+def update_leftovers(dish_ids):
+    """
+    Recalculates the Leftover rows of the given dishes (any ids which aren't
+    of dishes are ignored) from their portions and the amounts of them in
+    other dishes.
+    """
+    dishes = []
+    for chunk in _chunks(set(dish_ids) - set([None])):
+        dishes.extend(Dish.objects.filter(pk__in=chunk).order_by().values_list(
+                          'pk', 'household', 'date_cooked', 'quantity'))
+    if not dishes:
+        return
+    used = {}
+    for chunk in _chunks([dish[0] for dish in dishes]):
+        for comestible_id, quantity in chain(
+                Portion.objects.filter(comestible__in=chunk).values_list(
+                    'comestible').annotate(Sum('quantity')),
+                Amount.objects.filter(contained_comestible__in=chunk).values_list(
+                    'contained_comestible').annotate(Sum('quantity'))):
+            used[comestible_id] = used.get(comestible_id, 0) + (quantity or 0)
+    leftovers = []
+    for dish_id, household_id, date_cooked, quantity in dishes:
+        remaining = (quantity or 0) - used.get(dish_id, 0)
+        if remaining > 0:
+            leftovers.append(Leftover(dish_id=dish_id, household_id=household_id,
+                                      date_cooked=date_cooked, quantity=remaining))
+    def replace():
+        _delete_in(Leftover, 'dish_id', [dish[0] for dish in dishes])
+        bulk_insert(leftovers)
+    # (if another process inserted some of the rows after they were deleted
+    # here, they're deleted again)
+    _on_conflict(replace, replace)
+
+def _meal_ingredient_counts(meal_ids, sign=1):
+    """
+    Returns a dict of {(household id, ingredient id): number of meals} for
+    the ingredient index rows of the given meals, with the numbers negated
+    if sign is -1.
+    """
+    counts = {}
+    for chunk in _chunks(meal_ids):
+        for key in MealIngredient.objects.filter(meal__in=chunk).values_list(
+                'meal__household', 'ingredient'):
+            counts[key] = counts.get(key, 0) + sign
+    return counts
+
+def _add_household_ingredients(*counts):
+    """
+    Adds the numbers of meals in each dict returned by
+    _meal_ingredient_counts() to the HouseholdIngredient rows.
+    """
+    totals = {}
+    for meal_counts in counts:
+        for key, count in meal_counts.iteritems():
+            totals[key] = totals.get(key, 0) + count
+    by_household = {}
+    for (household_id, ingredient_id), count in totals.iteritems():
+        if count:
+            by_household.setdefault(household_id, {})[ingredient_id] = count
+    # (one UPDATE for all the ingredients of a household whose counts change
+    # by the same number, which is usually all of them, and one INSERT for
+    # those without rows yet)
+    for household_id, counts in by_household.iteritems():
+        rows = HouseholdIngredient.objects.filter(household=household_id)
+        existing_ids = set()
+        for chunk in _chunks(counts.keys()):
+            existing_ids.update(rows.filter(ingredient__in=chunk).values_list(
+                                    'ingredient', flat=True))
+        ids_by_count = {}
+        for ingredient_id in existing_ids:
+            ids_by_count.setdefault(counts[ingredient_id], []).append(ingredient_id)
+        for count, ingredient_ids in ids_by_count.iteritems():
+            for chunk in _chunks(ingredient_ids):
+                rows.filter(ingredient__in=chunk).update(meals=F('meals') + count)
+        new_rows = [HouseholdIngredient(household_id=household_id,
+                                        ingredient_id=ingredient_id, meals=count)
+                    for ingredient_id, count in counts.iteritems()
+                    if ingredient_id not in existing_ids and count > 0]
+
+        def add_each():
+            # (some were inserted by another process meanwhile)
+            for row in new_rows:
+                if not rows.filter(ingredient=row.ingredient_id).update(
+                        meals=F('meals') + row.meals):
+                    row.save()
+        _on_conflict(lambda: bulk_insert(new_rows), add_each)
+
+@transaction.commit_on_success
+def update_household_summaries(dish_ids, meal_ids):
+    """
+    Updates the members' days and totals and the leftovers for dishes and
+    meals inserted without signals. (Their ingredients are counted by
+    update_meal_ingredients(), when they're added to the ingredient index.)
+    """
+    days = set()
+    members = set()
+    for chunk in _chunks(meal_ids):
+        days.update(Meal.objects.filter(pk__in=chunk).order_by().values_list(
+                        'household', 'user', 'date'))
+    for chunk in _chunks(dish_ids):
+        members.update(Dish.cooks.through.objects.filter(dish__in=chunk).values_list(
+                           'dish__household', 'user'))
+    update_member_days(days)
+    update_member_totals(members)
+    update_leftovers(dish_ids)
+
+@transaction.commit_on_success
+def count_meal_ingredients(meal_ids):
+    """
+    Adds the ingredients of the given meals (which mustn't have been counted
+    already, e.g. new copies of meals) to the HouseholdIngredient rows.
+    """
+    _add_household_ingredients(_meal_ingredient_counts(meal_ids))
+
+@transaction.commit_on_success
+def rebuild_household_summaries(household_ids):
+    """
+    Recalculates all the summaries of the given households from scratch,
+    with one grouped query and one INSERT for each kind of summary (rather
+    than recalculating each member's day or total on its own), however many
+    meals and dishes they have.
+    """
+    household_ids = list(household_ids)
+    for model in (MemberDay, MemberTotals, Leftover, HouseholdIngredient):
+        _delete_in(model, 'household_id', household_ids)
+    days = []
+    totals = []
+    ingredients = []
+    dish_ids = []
+    for chunk in _chunks(household_ids):
+        # (order_by() so that the default ordering isn't grouped by as well)
+        days.extend(MemberDay(household_id=household_id, user_id=user_id,
+                              date=date, calories=calories or 0)
+                    for household_id, user_id, date, calories in
+                    Meal.objects.filter(household__in=chunk).order_by().values_list(
+                        'household', 'user', 'date').annotate(Sum('calories')))
+        totals.extend(MemberTotals(household_id=household_id, user_id=user_id,
+                                   dishes_cooked=count)
+                      for household_id, user_id, count in
+                      Dish.cooks.through.objects.filter(
+                          dish__household__in=chunk).values_list(
+                          'dish__household', 'user').annotate(Count('id')))
+        ingredients.extend(HouseholdIngredient(household_id=household_id,
+                                               ingredient_id=ingredient_id,
+                                               meals=count)
+                           for household_id, ingredient_id, count in
+                           MealIngredient.objects.filter(
+                               meal__household__in=chunk).values_list(
+                               'meal__household', 'ingredient').annotate(Count('id')))
+        dish_ids.extend(Dish.objects.filter(household__in=chunk).values_list(
+                            'pk', flat=True))
+    bulk_insert(days)
+    bulk_insert(totals)
+    bulk_insert(ingredients)
+    update_leftovers(dish_ids)
+
+@transaction.commit_on_success
+def merge_ingredients(ingredient, duplicate_ids):
+    """
+    Replaces the ingredients with the given ids (e.g. duplicates found by
+    food.duplicates) with ingredient in every amount and portion, and deletes
+    them. Raises ValueError if any of them isn't an ingredient or has a
+    different unit from ingredient.
+
+    This moves the amounts and portions with one UPDATE each, and deletes the
+    duplicates without loading them (so without the signal receivers, which
+    would save every dish and meal using them), then recalculates the
+    ingredient index and calories of everything which used them once, and
+    marks it all as updated.
+    """
+    duplicate_ids = set(duplicate_ids) - set([ingredient.pk])
+    if not duplicate_ids:
+        return
+    units = {}
+    for chunk in _chunks(duplicate_ids):
+        units.update(Ingredient.objects.filter(pk__in=chunk).values_list(
+                         'pk', 'unit'))
+    missing = duplicate_ids - set(units)
+    if missing:
+        raise ValueError("no ingredients with the ids %s" %
+                         u', '.join(str(pk) for pk in sorted(missing)))
+    other_units = sorted(pk for pk, unit in units.items() if unit != ingredient.unit)
+    if other_units:
+        raise ValueError("ingredients %s aren't measured in %s" % (
+                             u', '.join(str(pk) for pk in other_units),
+                             ingredient.unit))
+
+    # The ingredient index says which dishes and meals contain the duplicates,
+    # including through other dishes
+    dish_ids = set()
+    meal_ids = set()
+    for chunk in _chunks(duplicate_ids):
+        dish_ids.update(DishIngredient.objects.filter(
+                            ingredient__in=chunk).values_list('dish', flat=True))
+        meal_ids.update(MealIngredient.objects.filter(
+                            ingredient__in=chunk).values_list('meal', flat=True))
+        Amount.objects.filter(contained_comestible__in=chunk).update(
+            contained_comestible=ingredient.pk)
+        Portion.objects.filter(comestible__in=chunk).update(comestible=ingredient.pk)
+    update_dish_ingredients(dish_ids)
+    update_meal_ingredients(meal_ids)
+    # (the duplicates' households' counts are 0 now, and nothing else refers
+    # to them)
+    _delete_in(HouseholdIngredient, 'ingredient_id', duplicate_ids)
+    _delete_in(Ingredient, 'comestible_ptr_id', duplicate_ids)
+    _delete_in(Comestible, 'id', duplicate_ids)
+    recalculate_calories([ingredient.pk])
+    # The dishes and meals show the ingredient's name even when their calories
+    # haven't changed, so updated_at is set as save() would (for the meal
+    # archive's Last-Modified) and their cached detail pages are replaced
+    now = datetime.datetime.now()
+    for chunk in _chunks(dish_ids):
+        Dish.objects.filter(pk__in=chunk).update(updated_at=now)
+    for chunk in _chunks(meal_ids):
+        Meal.objects.filter(pk__in=chunk).update(updated_at=now)
+    invalidate_detail('dish', dish_ids)
+    invalidate_detail('meal', meal_ids)
+
+
 # Signal receivers update related objects in order to recalculate their
-# calories when something changes
+# calories when something changes (and count those saves in food.metrics)
+
+# The household summaries are keyed by some of the fields of meals, dishes,
+# portions and amounts, so the values each instance had when it was loaded are
+# kept (None for new instances), for updating the summaries of the old values
+# too when they change, and not updating them at all when they don't
+
+@receiver(post_init, sender=Meal)
+def remember_meal_day(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._saved_day = instance._saved_calories = None
+    else:
+        instance._saved_day = (instance.household_id, instance.user_id,
+                               instance.date)
+        instance._saved_calories = instance.calories
+
+@receiver(post_init, sender=Dish)
+def remember_dish_leftover(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._saved_leftover = None
+    else:
+        instance._saved_leftover = (instance.household_id, instance.date_cooked,
+                                    instance.quantity)
+
+@receiver(post_init, sender=Portion)
+def remember_portion_use(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._saved_use = None
+    else:
+        instance._saved_use = (instance.comestible_id, instance.quantity)
+
+@receiver(post_init, sender=Amount)
+def remember_amount_use(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._saved_use = None
+    else:
+        instance._saved_use = (instance.contained_comestible_id,
+                               instance.quantity)
+
+def _used_dish_ids(instance, comestible):
+    """
+    Returns the ids of the dishes whose leftovers change when a portion or
+    amount (of comestible) is saved: none if neither its comestible nor its
+    quantity has changed (e.g. when only its calories have).
+    """
+    use = (comestible.id, instance.quantity)
+    if use == instance._saved_use:
+        return set()
+    dish_ids = set()
+    if instance._saved_use is not None:
+        dish_ids.add(instance._saved_use[0])
+    if comestible.is_dish:
+        dish_ids.add(comestible.id)
+    instance._saved_use = use
+    return dish_ids
 
 @receiver(post_save, sender=Ingredient)
 def update_on_ingredient_save(sender, **kwargs):
@@ -363,9 +1429,11 @@ def update_on_ingredient_save(sender, **kwargs):
     print >> sys.stderr, "Instance: ingredient", ingredient
     for amount in Amount.objects.filter(contained_comestible__id=ingredient.id):
         print >> sys.stderr, "Updating amount", amount, "in", amount.containing_dish, amount.calories, "calories"
+        count_cascade_save('amount')
         amount.save()
     for portion in Portion.objects.filter(comestible__id=ingredient.id):
         print >> sys.stderr, "Updating portion", portion, "in", portion.meal, portion.calories
+        count_cascade_save('portion')
         portion.save()
 
 # This is triggered for each amount when saving the formset
@@ -375,17 +1443,41 @@ def update_on_amount_save(sender, **kwargs):
     amount = kwargs['instance']
     dish = amount.containing_dish
     print >> sys.stderr, "Instance: amount", amount, amount.id, amount.calories, "calories; updating dish", dish, dish.calories, "calories"
+    # (a contained dish's page lists the dishes containing it)
+    invalidate_detail('dish', [amount.contained_comestible_id])
+    update_leftovers(_used_dish_ids(amount, amount.contained_comestible))
+    count_cascade_save('dish')
     dish.save()
 
 @receiver(post_save, sender=Dish)
 def update_on_dish_save(sender, **kwargs):
     dish = kwargs['instance']
     print >> sys.stderr, "Instance: dish", dish
+    # (before saving the amounts of this dish in other dishes, since those
+    # use its index rows)
+    update_dish_ingredients([dish.id])
+    leftover = (dish.household_id, dish.date_cooked, dish.quantity)
+    if leftover != dish._saved_leftover:
+        update_leftovers([dish.id])
+        # (a new dish doesn't have any cooks yet)
+        if (dish._saved_leftover is not None and
+                dish._saved_leftover[0] != dish.household_id):
+            cook_ids = dish.cooks.values_list('pk', flat=True)
+            update_member_totals([(household_id, cook_id) for cook_id in cook_ids
+                                  for household_id in (dish._saved_leftover[0],
+                                                       dish.household_id)])
+        dish._saved_leftover = leftover
+    # The pages of the dishes it contains show its name and date too
+    invalidate_detail('dish', [dish.id] + list(Amount.objects.filter(
+        containing_dish=dish, contained_comestible__is_dish=True).values_list(
+        'contained_comestible', flat=True)))
     for amount in Amount.objects.filter(contained_comestible__id=dish.id):
         print >> sys.stderr, "Updating amount", amount, "in", amount.containing_dish, amount.calories, "calories"
+        count_cascade_save('amount')
         amount.save()
     for portion in Portion.objects.filter(comestible__id=dish.id):
         print >> sys.stderr, "Updating portion", portion, "in", portion.meal, portion.calories
+        count_cascade_save('portion')
         portion.save()
 
 # This is triggered for each portion when saving the formset
@@ -395,8 +1487,62 @@ def update_on_portion_save(sender, **kwargs):
     portion = kwargs['instance']
     meal = portion.meal
     print >> sys.stderr, "Instance: portion", portion, "; updating meal", meal, meal.calories, "calories"
+    invalidate_detail('dish', [portion.comestible_id])
+    update_leftovers(_used_dish_ids(portion, portion.comestible))
+    count_cascade_save('meal')
     meal.save()
 
+@receiver(post_save, sender=Meal)
+def update_on_meal_save(sender, **kwargs):
+    meal = kwargs['instance']
+    update_meal_ingredients([meal.id])
+    day = (meal.household_id, meal.user_id, meal.date)
+    if day != meal._saved_day or meal.calories != meal._saved_calories:
+        update_member_days([meal._saved_day, day])
+        meal._saved_day = day
+        meal._saved_calories = meal.calories
+    # The pages of the dishes in the meal show its name and date too
+    invalidate_detail('meal', [meal.id])
+    invalidate_detail('dish', Portion.objects.filter(
+        meal=meal, comestible__is_dish=True).values_list('comestible', flat=True))
+
+@receiver(m2m_changed, sender=Dish.cooks.through)
+def update_on_dish_cooks_change(sender, **kwargs):
+    instance = kwargs['instance']
+    if kwargs['reverse']: # (the cooked dishes of a user were changed)
+        invalidate_detail('dish', kwargs['pk_set'] or [])
+    else:
+        invalidate_detail('dish', [instance.id])
+    # The cooks' numbers of dishes cooked (clear() doesn't say which
+    # dishes or cooks it removed, so they're found before it does)
+    action = kwargs['action']
+    if action == 'pre_clear':
+        if kwargs['reverse']:
+            instance._cleared_members = set(
+                (household_id, instance.id) for household_id in
+                Dish.objects.filter(cooks=instance).values_list('household',
+                                                                flat=True))
+        else:
+            instance._cleared_members = set(
+                (instance.household_id, cook_id) for cook_id in
+                instance.cooks.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        update_member_totals(instance._cleared_members)
+    elif action in ('post_add', 'post_remove'):
+        if kwargs['reverse']:
+            update_member_totals((household_id, instance.id) for household_id in
+                                 Dish.objects.filter(pk__in=kwargs['pk_set'])
+                                             .values_list('household', flat=True))
+        else:
+            update_member_totals((instance.household_id, user_id)
+                                 for user_id in kwargs['pk_set'])
+
+@receiver(post_save, sender=Household)
+def update_on_household_save(sender, **kwargs):
+    # Dishes' pages show their household's name
+    invalidate_detail('dish', Dish.objects.filter(
+        household=kwargs['instance']).values_list('pk', flat=True))
+
 # All ForeignKey and OneToOne fields have on_delete=CASCADE by default, so:
 #     ingredient deleted --> comestible deleted --> amounts deleted (via contained_comestible FK)
 #     dish deleted       --> comestible deleted --> amounts deleted (via contained_comestible FK or containing_dish FK)
@@ -405,15 +1551,42 @@ def update_on_portion_save(sender, **kwargs):
 # ... so we only need to deal here with amounts and portions being deleted (both
 # directly from the big formsets and after cascading).
 
+@receiver(pre_delete, sender=Dish)
+def remember_deleted_dish_cooks(sender, **kwargs):
+    dish = kwargs['instance']
+    dish._deleted_cook_ids = list(dish.cooks.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Dish)
+def update_on_dish_delete(sender, **kwargs):
+    dish = kwargs['instance']
+    # (so that its page's ETag doesn't match any more either)
+    invalidate_detail('dish', [dish.id])
+    update_member_totals((dish.household_id, cook_id)
+                         for cook_id in getattr(dish, '_deleted_cook_ids', []))
+
+@receiver(pre_delete, sender=Meal)
+def uncount_deleted_meal_ingredients(sender, **kwargs):
+    # (before its ingredient index rows are deleted along with it)
+    _add_household_ingredients(_meal_ingredient_counts([kwargs['instance'].id], -1))
+
+@receiver(post_delete, sender=Meal)
+def update_on_meal_delete(sender, **kwargs):
+    meal = kwargs['instance']
+    invalidate_detail('meal', [meal.id])
+    update_member_days([(meal.household_id, meal.user_id, meal.date)])
+
 @receiver(post_delete, sender=Amount)
 def update_on_amount_delete(sender, **kwargs):
     amount = kwargs['instance']
     # amounts can be deleted as a cascading result of their containing
     # dish having been deleted, so a deleted amount won't always have a
     # containing dish to update
+    invalidate_detail('dish', [amount.contained_comestible_id])
+    update_leftovers([amount.contained_comestible_id])
     try:
         dish = amount.containing_dish
         print >> sys.stderr, "Instance deleted: amount (can't get name); updating containing_dish", dish, dish.calories, "calories"
+        count_cascade_save('dish')
         dish.save()
     except Dish.DoesNotExist:
         print >> sys.stderr, "Instance deleted: amount (can't get name); containing dish has already been deleted"
@@ -423,9 +1596,12 @@ def update_on_portion_delete(sender, **kwargs):
     portion = kwargs['instance']
     # portions can be deleted as a cascading result of their meal having been
     # deleted, so a deleted portion won't always have a meal to update
+    invalidate_detail('dish', [portion.comestible_id])
+    update_leftovers([portion.comestible_id])
     try:
         meal = portion.meal
         print >> sys.stderr, "Instance deleted: portion (can't get name); updating meal", meal, meal.calories, "calories"
+        count_cascade_save('meal')
         meal.save()
     except Meal.DoesNotExist:
         print >> sys.stderr, "Instance deleted: portion (can't get name); meal has already been deleted"
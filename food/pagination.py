@@ -0,0 +1,125 @@
+"""
+Keyset (or "seek") pagination for the dish, ingredient and meal lists.
+
+Instead of counting and skipping rows with OFFSET, each page is found by
+filtering on the ordering fields' values of the last (or first) object on
+the page before it, which are passed along as an opaque cursor in ?after= (or
+?before=). With an index on the ordering fields every page costs the same
+as the first one, and pages don't shift when objects are added or deleted.
+"""
+import base64
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+from django.utils import simplejson
+
+
+# Number of objects on each page of the lists, unless a view sets paginate_by
+LIST_PAGE_SIZE = getattr(settings, 'FOOD_LIST_PAGE_SIZE', 50)
+
+
+def encode_cursor(values):
+    data = simplejson.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def decode_cursor(cursor, length):
+    """
+    Returns the list of values in a cursor, or raises ValueError if it isn't
+    a valid cursor with length values.
+    """
+    try:
+        data = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        values = simplejson.loads(data)
+    except (TypeError, UnicodeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('invalid cursor')
+    return values
+
+def _seek(ordering, values, backwards=False):
+    """
+    Returns a Q object for the objects after those with the given values of
+    the ordering fields (or before them, if backwards is True).
+    """
+    condition = None
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        if field.startswith('-') != backwards:
+            lookup = '%s__lt' % name
+        else:
+            lookup = '%s__gt' % name
+        equal = dict((other.lstrip('-'), value) for other, value in
+                     zip(ordering[:position], values[:position]))
+        equal[lookup] = values[position]
+        if condition is None:
+            condition = Q(**equal)
+        else:
+            condition = condition | Q(**equal)
+    return condition
+
+def _reversed(ordering):
+    return [field[1:] if field.startswith('-') else '-' + field
+            for field in ordering]
+
+
+class KeysetPage(object):
+    """
+    One page of a queryset, ordered by the fields in ordering (which must
+    identify each object uniquely, e.g. by ending with 'pk'), starting after
+    the cursor after or ending before the cursor before.
+    """
+    def __init__(self, queryset, ordering, page_size, after=None, before=None):
+        self.ordering = list(ordering)
+        if before:
+            queryset = queryset.filter(_seek(self.ordering,
+                                             decode_cursor(before, len(self.ordering)),
+                                             backwards=True))
+            objects = list(queryset.order_by(*_reversed(self.ordering))[:page_size + 1])
+            self.has_previous = len(objects) > page_size
+            self.has_next = True
+            objects = objects[:page_size]
+            objects.reverse()
+        else:
+            if after:
+                queryset = queryset.filter(_seek(self.ordering,
+                                                 decode_cursor(after, len(self.ordering))))
+            objects = list(queryset.order_by(*self.ordering)[:page_size + 1])
+            self.has_previous = bool(after)
+            self.has_next = len(objects) > page_size
+            objects = objects[:page_size]
+        self.object_list = objects
+
+    def _cursor(self, obj):
+        return encode_cursor([getattr(obj, field.lstrip('-'))
+                              for field in self.ordering])
+
+    def has_other_pages(self):
+        return self.has_previous or self.has_next
+
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1])
+
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor(self.object_list[0])
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates a ListView (or date-based list view) by keyset_ordering, with
+    the page in the context as page_obj.
+    """
+    keyset_ordering = None
+    paginate_by = LIST_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = KeysetPage(queryset, self.keyset_ordering, page_size,
+                              after=self.request.GET.get('after'),
+                              before=self.request.GET.get('before'))
+        except ValueError:
+            raise Http404
+        return (None, page, page.object_list, page.has_other_pages())
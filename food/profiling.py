@@ -0,0 +1,207 @@
+"""
+On-demand profiling of single requests, for finding out why a page is slow
+on the live site without reproducing it locally.
+
+When settings.FOOD_PROFILING is on, ProfilingMiddleware (in food.middleware)
+profiles the requests of staff users which ask for it, either with
+?profile=1 or with an X-Food-Profile header containing profile_token() of
+their username (for tools which can't change the URL). The view, and the
+rendering of its template, run under cProfile, and the SQL queries and the
+saves and deletes of models (the signal cascade, e.g. an amount saving its
+dish saving its portions saving their meals) are recorded too.
+
+Each profiled request writes a .prof file (which can be loaded with pstats or
+a viewer such as snakeviz) and a .json summary to FOOD_PROFILE_DIR, and only
+the FOOD_PROFILE_KEEP most recent requests' files are kept. The
+list_profiles management command lists and summarises them.
+"""
+import cProfile
+import datetime
+import glob
+import os
+import pstats
+import threading
+import time
+import traceback
+from StringIO import StringIO
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import pre_save, post_delete
+from django.dispatch import receiver
+from django.utils import simplejson
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+
+PROFILE_DIR = getattr(settings, 'FOOD_PROFILE_DIR', '/var/tmp/everydayeating_profiles')
+
+# Number of profiled requests whose files are kept
+PROFILE_KEEP = getattr(settings, 'FOOD_PROFILE_KEEP', 50)
+
+# Number of functions (by cumulative time) listed in each summary
+PROFILE_TOP_FUNCTIONS = 30
+
+PROFILE_HEADER = 'HTTP_X_FOOD_PROFILE'
+
+_trace = threading.local()
+
+
+def profile_token(username):
+    """
+    Returns the value of the X-Food-Profile header which asks for the
+    requests of the user with the given username to be profiled.
+    """
+    return salted_hmac('food.profiling', username).hexdigest()
+
+
+def wants_profile(request):
+    """
+    Returns whether request should be profiled.
+    """
+    if not getattr(settings, 'FOOD_PROFILING', False):
+        return False
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return False
+    if request.GET.get('profile') == '1':
+        return True
+    token = request.META.get(PROFILE_HEADER)
+    return bool(token) and constant_time_compare(token, profile_token(user.username))
+
+
+# The signal cascade is recorded by these receivers, which do nothing unless
+# this thread is profiling a request. The level of each save or delete is the
+# number of the ones before it which it's nested inside (through their
+# receivers), found from how deep in the stack each one is.
+
+def _record_signal(action, sender, instance):
+    if getattr(_trace, 'signals', None) is None:
+        return
+    depth = len(traceback.extract_stack())
+    while _trace.depths and _trace.depths[-1] >= depth:
+        _trace.depths.pop()
+    _trace.signals.append({
+        'action': action,
+        'model': sender.__name__,
+        'id': instance.pk,
+        'level': len(_trace.depths),
+    })
+    _trace.depths.append(depth)
+
+@receiver(pre_save)
+def _trace_save(sender, instance, **kwargs):
+    _record_signal('save', sender, instance)
+
+@receiver(post_delete)
+def _trace_delete(sender, instance, **kwargs):
+    _record_signal('delete', sender, instance)
+
+
+def _summarise_stats(profiler):
+    stats = pstats.Stats(profiler, stream=StringIO())
+    functions = []
+    for (filename, line, name), (calls, primitive_calls, total_time,
+                                 cumulative_time, callers) in stats.stats.items():
+        functions.append({
+            'function': '%s:%s(%s)' % (filename, line, name),
+            'calls': calls,
+            'total_time': round(total_time, 6),
+            'cumulative_time': round(cumulative_time, 6),
+        })
+    functions.sort(key=lambda function: -function['cumulative_time'])
+    return functions[:PROFILE_TOP_FUNCTIONS]
+
+
+def profile_view(request, view_name, view_func, view_args, view_kwargs):
+    """
+    Calls the view (and renders its response, if it's a TemplateResponse)
+    under the profiler, writes the profile and its summary to PROFILE_DIR,
+    and returns the response.
+    """
+    profiler = cProfile.Profile()
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    first_query = len(connection.queries)
+    _trace.signals = []
+    _trace.depths = []
+    started = time.time()
+    try:
+        def run():
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            return response
+        response = profiler.runcall(run)
+    finally:
+        duration = time.time() - started
+        signals = _trace.signals
+        _trace.signals = None
+        queries = connection.queries[first_query:]
+        connection.use_debug_cursor = use_debug_cursor
+
+    now = datetime.datetime.now()
+    name = '%s-%s-%s' % (now.strftime('%Y%m%d-%H%M%S-%f'), view_name or 'unknown',
+                         os.getpid())
+    if not os.path.isdir(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name + '.prof'))
+    summary = {
+        'name': name,
+        'time': now.isoformat(),
+        'path': request.get_full_path(),
+        'method': request.method,
+        'view': view_name,
+        'user': request.user.username,
+        'status': response.status_code,
+        'duration': round(duration, 6),
+        'query_count': len(queries),
+        'db_time': round(sum(float(query['time']) for query in queries), 6),
+        'queries': queries,
+        'signals': signals,
+        'functions': _summarise_stats(profiler),
+    }
+    summary_file = open(os.path.join(PROFILE_DIR, name + '.json'), 'w')
+    try:
+        simplejson.dump(summary, summary_file, indent=1)
+    finally:
+        summary_file.close()
+    rotate_profiles()
+    return response
+
+
+def rotate_profiles(keep=None):
+    """
+    Deletes the files of all but the keep (or PROFILE_KEEP) most recent
+    profiled requests.
+    """
+    if keep is None:
+        keep = PROFILE_KEEP
+    # (the names start with the time, so sort in order)
+    summaries = sorted(glob.glob(os.path.join(PROFILE_DIR, '*.json')))
+    for summary_path in summaries[:max(len(summaries) - keep, 0)]:
+        for path in (summary_path, summary_path[:-len('.json')] + '.prof'):
+            try:
+                os.remove(path)
+            except OSError:
+                # (another process got there first)
+                pass
+
+
+def recent_profiles(limit=None):
+    """
+    Returns a list of the summaries of the most recent profiled requests,
+    newest first.
+    """
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, '*.json')),
+                       reverse=True)[:limit]:
+        try:
+            summary_file = open(path)
+            try:
+                summaries.append(simplejson.load(summary_file))
+            finally:
+                summary_file.close()
+        except (IOError, ValueError):
+            # (deleted by rotation, or still being written)
+            continue
+    return summaries
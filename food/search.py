@@ -0,0 +1,189 @@
+"""
+Typo-tolerant search over ingredient and dish names, using an in-memory
+trigram index.
+
+Each name is split into words, and each word (padded with spaces, so that the
+start and end of words count for more) into its three-letter sequences. A
+name matches a query if it shares enough of the query's trigrams, so
+"brocoli" still finds "Broccoli", and matches are ranked by how much of the
+query they contain and then by how similar the whole name is. Ingredients
+are shared, but dishes are only found by their own household's searches.
+
+The index lives in each process and is built with one query per model the
+first time it's searched. After that it's kept up to date by the save and
+delete signals of this process, picks up comestibles inserted without
+signals (or by other processes) with one query per search, and is rebuilt
+from scratch once it's older than SEARCH_INDEX_MAX_AGE, to catch renames and
+deletions made by other processes.
+"""
+import re
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from food.models import Comestible, Ingredient, Dish
+
+
+# Seconds before the index is rebuilt from the database
+SEARCH_INDEX_MAX_AGE = 10 * 60
+
+# Fraction of the query's trigrams a name needs to contain to match
+SEARCH_MIN_SCORE = 0.5
+
+SEARCH_LIMIT = 20
+
+_non_word = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams in the words of text, ignoring case and
+    punctuation.
+    """
+    grams = set()
+    for word in _non_word.sub(u' ', text.lower()).split():
+        word = u'  %s ' % word
+        for start in range(len(word) - 2):
+            grams.add(word[start:start + 3])
+    return grams
+
+
+class SearchIndex(object):
+    """
+    An inverted index from trigrams to the ids of the comestibles whose names
+    contain them.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.built_at = None
+            self.max_id = 0
+            # comestible id -> (name, is_dish, household id (None for
+            # ingredients), number of trigrams)
+            self.entries = {}
+            # trigram -> set of comestible ids
+            self.postings = {}
+
+    def build(self):
+        """
+        Rebuilds the whole index from the database.
+        """
+        with self.lock:
+            self.clear()
+            for pk, name in Ingredient.objects.values_list('pk', 'name').iterator():
+                self.add(pk, name, False)
+            for pk, name, household_id in Dish.objects.values_list(
+                    'pk', 'name', 'household').iterator():
+                self.add(pk, name, True, household_id)
+            self.built_at = time.time()
+
+    def add(self, pk, name, is_dish, household_id=None):
+        with self.lock:
+            if pk in self.entries:
+                self.remove(pk)
+            grams = trigrams(name)
+            self.entries[pk] = (name, is_dish, household_id, len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, set()).add(pk)
+            self.max_id = max(self.max_id, pk)
+
+    def remove(self, pk):
+        with self.lock:
+            if pk not in self.entries:
+                return
+            name, is_dish, household_id, count = self.entries.pop(pk)
+            for gram in trigrams(name):
+                ids = self.postings.get(gram)
+                if ids is not None:
+                    ids.discard(pk)
+                    if not ids:
+                        del self.postings[gram]
+
+    def move_dishes(self, pks, household_id):
+        """
+        Makes the dishes with the given ids belong to another household.
+        """
+        with self.lock:
+            for pk in pks:
+                if pk in self.entries:
+                    name, is_dish, old_household_id, count = self.entries[pk]
+                    self.entries[pk] = (name, is_dish, household_id, count)
+
+    def refresh(self):
+        """
+        Builds the index if it hasn't been built or is too old, and otherwise
+        adds any comestibles created since it was last updated.
+        """
+        with self.lock:
+            if (self.built_at is None or
+                    time.time() - self.built_at > SEARCH_INDEX_MAX_AGE):
+                self.build()
+                return
+            for pk, is_dish, ingredient_name, dish_name, household_id in \
+                    Comestible.objects.filter(pk__gt=self.max_id).values_list(
+                        'pk', 'is_dish', 'ingredient__name', 'dish__name',
+                        'dish__household').iterator():
+                self.add(pk, is_dish and dish_name or ingredient_name, is_dish,
+                         household_id)
+
+    def search(self, query, limit=SEARCH_LIMIT, is_dish=None, household=None):
+        """
+        Returns a list of up to limit (id, name, is_dish, score) tuples for
+        the comestibles whose names best match query, best first. is_dish can
+        be True or False to only search dishes or ingredients, and only the
+        dishes of household (a Household or its id) are included, or none if
+        it's None.
+        """
+        household_id = getattr(household, 'pk', household)
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        self.refresh()
+        with self.lock:
+            shared = {}
+            for gram in query_grams:
+                for pk in self.postings.get(gram, ()):
+                    shared[pk] = shared.get(pk, 0) + 1
+            results = []
+            for pk, count in shared.iteritems():
+                name, entry_is_dish, entry_household_id, entry_count = self.entries[pk]
+                if is_dish is not None and entry_is_dish != is_dish:
+                    continue
+                if entry_is_dish and (household_id is None or
+                                      entry_household_id != household_id):
+                    continue
+                score = float(count) / len(query_grams)
+                if score < SEARCH_MIN_SCORE:
+                    continue
+                # Ties (e.g. "carrot" for "Carrot" and "Carrot cake") go to
+                # the name with the fewest other trigrams
+                similarity = 2.0 * count / (len(query_grams) + entry_count)
+                results.append((pk, name, entry_is_dish, score, similarity))
+        # Newer dishes (with higher ids) come before older ones of the same name
+        results.sort(key=lambda result: (-result[3], -result[4],
+                                         result[1].lower(), -result[0]))
+        return [result[:4] for result in results[:limit]]
+
+
+search_index = SearchIndex()
+
+
+# Only saves and deletes in this process are seen here; see the module
+# docstring for how everything else is picked up
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Dish)
+def update_search_index_on_save(sender, instance, **kwargs):
+    if search_index.built_at is not None:
+        search_index.add(instance.id, instance.name, sender is Dish,
+                         getattr(instance, 'household_id', None))
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Dish)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    search_index.remove(instance.id)
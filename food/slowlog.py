@@ -0,0 +1,180 @@
+"""
+A log of slow SQL queries, with the view and the lines of code which made
+them, for finding the queries most worth indexing for or rewriting.
+
+Django's debug cursor logs every query to the django.db.backends logger with
+how long it took, and QueryBudgetMiddleware turns that cursor on for every
+request (as DEBUG does for everything else). SlowQueryHandler is a logging
+handler for that logger which writes a JSON line to a rotating file for each
+query slower than its threshold, e.g. in the LOGGING setting:
+
+    'handlers': {
+        'slow_queries': {
+            'level': 'DEBUG',
+            'class': 'food.slowlog.SlowQueryHandler',
+            'filename': '/var/tmp/everydayeating_slow_queries.log',
+            'threshold': 0.1,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+        },
+    },
+    'loggers': {
+        'django.db.backends': {
+            'handlers': ['slow_queries'],
+            'level': 'DEBUG',
+            'propagate': False,
+        },
+    },
+
+The slow_query_report management command ranks the logged statements by
+their total time.
+
+(This module is imported when logging is configured, so it mustn't import
+anything which needs the settings, like models.)
+"""
+import datetime
+import glob
+import logging.handlers
+import os
+import re
+import threading
+import traceback
+
+from django.utils import simplejson
+
+
+# The directory containing the apps, which the stack's file names are
+# relative to
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Apps whose code is included in the stacks (except this module and the
+# middleware, which are in every stack)
+STACK_APPS = ('food', 'accounts')
+_SKIPPED_FILES = ('food/slowlog.py', 'food/middleware.py')
+
+# Number of frames kept from each stack, innermost last
+STACK_DEPTH = 5
+
+_context = threading.local()
+
+
+def set_view(view_name):
+    """
+    Sets the URL name of the view the current thread's queries are for (or
+    None outside requests).
+    """
+    _context.view_name = view_name
+
+
+def get_stack():
+    """
+    Returns a list of "file:line function" strings for the innermost
+    frames of the current stack in the apps' code.
+    """
+    frames = []
+    for filename, line, function, text in traceback.extract_stack():
+        path = os.path.relpath(os.path.abspath(filename), PROJECT_DIR)
+        if path.split(os.sep)[0] in STACK_APPS and path not in _SKIPPED_FILES:
+            frames.append('%s:%s %s' % (path, line, function))
+    return frames[-STACK_DEPTH:]
+
+
+class SlowQueryHandler(logging.handlers.RotatingFileHandler):
+    """
+    Writes the records of django.db.backends for queries which took longer
+    than threshold seconds to a rotating file, as JSON lines.
+    """
+    def __init__(self, filename, threshold=0.1, maxBytes=10 * 1024 * 1024,
+                 backupCount=5):
+        # (the file isn't opened until the first slow query)
+        logging.handlers.RotatingFileHandler.__init__(
+            self, filename, maxBytes=maxBytes, backupCount=backupCount,
+            delay=True)
+        self.threshold = threshold
+
+    def filter(self, record):
+        return (getattr(record, 'duration', None) is not None and
+                record.duration >= self.threshold and
+                logging.handlers.RotatingFileHandler.filter(self, record))
+
+    def format(self, record):
+        params = record.params
+        if params and isinstance(params, (list, tuple)) and \
+                isinstance(params[0], (list, tuple)):
+            # (executemany())
+            params = '%s sets of parameters' % len(params)
+        return simplejson.dumps({
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(),
+            'duration': round(record.duration, 6),
+            'sql': record.sql,
+            'params': params,
+            'view': getattr(_context, 'view_name', None),
+            'stack': get_stack(),
+        }, default=repr)
+
+
+def read_entries(path):
+    """
+    Returns a list of the entries in the slow query log at path and its
+    rotated files, oldest first.
+    """
+    entries = []
+    rotated = [name for name in glob.glob(path + '.*')
+               if name[len(path) + 1:].isdigit()]
+    rotated.sort(key=lambda name: -int(name[len(path) + 1:]))
+    for name in rotated + [path]:
+        try:
+            log_file = open(name)
+        except IOError:
+            continue
+        try:
+            for line in log_file:
+                try:
+                    entries.append(simplejson.loads(line))
+                except ValueError:
+                    # (a line cut short)
+                    continue
+        finally:
+            log_file.close()
+    return entries
+
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+_in_list = re.compile(r'IN \((?:\?, )*\?\)')
+
+def normalise_sql(sql):
+    """
+    Returns sql with its literal values replaced by ?, so that the same
+    statement with different values can be grouped together.
+    """
+    sql = _number.sub('?', _string_literal.sub('?', sql))
+    return _in_list.sub('IN (...)', sql)
+
+
+def summarise(entries):
+    """
+    Returns a list of dicts describing each statement in entries (grouped by
+    normalise_sql()), ranked by their total time, slowest first.
+    """
+    statements = {}
+    for entry in entries:
+        sql = normalise_sql(entry['sql'])
+        statement = statements.get(sql)
+        if statement is None:
+            statement = statements[sql] = {
+                'sql': sql, 'count': 0, 'total': 0, 'max': 0,
+                'views': {}, 'origins': {},
+            }
+        statement['count'] += 1
+        statement['total'] += entry['duration']
+        statement['max'] = max(statement['max'], entry['duration'])
+        view = entry.get('view') or '(no view)'
+        statement['views'][view] = statement['views'].get(view, 0) + 1
+        origin = entry['stack'] and entry['stack'][-1] or '(unknown)'
+        statement['origins'][origin] = statement['origins'].get(origin, 0) + 1
+    result = statements.values()
+    for statement in result:
+        statement['mean'] = statement['total'] / statement['count']
+    result.sort(key=lambda statement: -statement['total'])
+    return result
@@ -1,15 +1,49 @@
+import csv
 import datetime
-
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import urllib
+import urlparse
+from StringIO import StringIO
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed, ValidationError, ObjectDoesNotExist
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError, connection
 from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
 from django.forms.models import ModelForm, BaseInlineFormSet, BaseModelFormSet
-from django.test import TestCase
-
-from accounts.models import Household, Profile
-
-from food.models import validate_positive, validate_positive_or_zero, Comestible, Ingredient, Dish, Amount, Meal, Portion
-from food.views import BaseMealInlineFormSet, DishMultiplyForm, DishDuplicateForm, MealDuplicateForm, get_sum_day_calories, get_avg_week_calories, get_week_starts_in_month
+from django.test import TestCase, TransactionTestCase
+from django.test.client import Client
+from django.utils import simplejson
+
+from accounts import urls as accounts_urls
+from accounts.middleware import get_profile
+from accounts.models import Household, Profile, profile_cache_key
+
+from food import metrics, profiling, urls as food_urls
+from food.backup import BackupError, backup_household, restore_household
+from food.benchmark import BENCHMARKS, percentile
+from food.dataset import generate_dataset
+from food.caching import get_detail_version
+from food.connections import PersistentConnectionMiddleware, finish_connection
+from food.export import iter_meals
+from food.households import limit_to_household, merge_households
+from food.middleware import RequestStats, reset_stats, view_stats
+from food.pagination import KeysetPage, encode_cursor
+from food.search import search_index
+from food.slowlog import SlowQueryHandler, normalise_sql, read_entries, summarise
+from food.dashboard import LEFTOVER_DAYS, household_dashboard
+from food.duplicates import find_duplicate_ingredients, merge_duplicates, normalise_name
+from food.models import validate_positive, validate_positive_or_zero, Comestible, Ingredient, Dish, Amount, Meal, MealForm, Portion, DishIngredient, MealIngredient, MemberDay, MemberTotals, Leftover, HouseholdIngredient, copy_week, insert_without_signals, merge_ingredients, recalculate_calories, _on_conflict
+from food.views import INGREDIENT_MANAGE_PAGINATE_BY, DishListView, MealListView, BaseMealInlineFormSet, DishMultiplyForm, DishDuplicateForm, MealDuplicateForm, MealWeekCopyForm, get_sum_day_calories, get_avg_week_calories, get_week_starts_in_month
 
 
 fake_pk = 9999999999
@@ -73,8 +107,397 @@ class FoodModelsTestCase(TestCase):
         self.assertEqual(dish.pretty_cooks(),
                          u'testuser1, testuser2, testuser3 and testuser4')
 
+    def inserts(self, function, *args):
+        """
+        Returns the number of INSERT queries into each table made by calling
+        function with args, and what it returned.
+        """
+        connection.use_debug_cursor = True
+        try:
+            first_query = len(connection.queries)
+            result = function(*args)
+            counts = {}
+            for query in connection.queries[first_query:]:
+                # (executemany() queries are logged as "<n> times: <sql>")
+                match = re.match(r'(\d+ times: )?INSERT INTO "?(\w+)', query['sql'])
+                if match:
+                    counts[match.group(2)] = counts.get(match.group(2), 0) + 1
+            return counts, result
+        finally:
+            connection.use_debug_cursor = False
+
+    def test_duplicate_in_bulk(self):
+        test_user = User.objects.create_user('testuser', 'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        dish = Dish.objects.create(name = 'Test dish', quantity = 100,
+                                   unit = 'g', household = test_household,
+                                   date_cooked = datetime.date(2012, 01, 02))
+        dish.amount_set.create(contained_comestible = ingredient, quantity = 100)
+        meal = Meal.objects.create(name = 'lunch',
+                                   date = datetime.date(2012, 01, 02),
+                                   time = datetime.time(13, 0),
+                                   household = test_household,
+                                   user = test_user)
+        meal.portion_set.create(comestible = dish, quantity = 50)
+        week_dates = lambda week: [datetime.date(2012, 01, 2) +
+                                   datetime.timedelta(weeks=week, days=day)
+                                   for day in range(5)]
+
+        # The copies (and their amounts or portions) are inserted with one
+        # query per table, however many there are
+        inserts, new_dishes = self.inserts(dish.duplicate,
+                                           week_dates(1) + week_dates(2))
+        for table in ('food_comestible', 'food_dish', 'food_amount'):
+            self.assertEqual(inserts[table], 1)
+        self.assertEqual(len(set(new_dish.id for new_dish in new_dishes)), 10)
+        inserts, new_meals = self.inserts(meal.duplicate,
+                                          week_dates(1) + week_dates(2))
+        for table in ('food_meal', 'food_portion'):
+            self.assertEqual(inserts[table], 1)
+        self.assertEqual(len(set(new_meal.id for new_meal in new_meals)), 10)
+
+        for new_dish in new_dishes:
+            new_dish = Dish.objects.get(pk=new_dish.id)
+            self.assertEqual(new_dish.name, 'Test dish')
+            self.assertEqual(new_dish.calories, 75)
+            self.assertEqual(new_dish.amount_set.get().contained_comestible_id,
+                             ingredient.id)
+        self.assertEqual([new_dish.date_cooked for new_dish in new_dishes],
+                         week_dates(1) + week_dates(2))
+        for new_meal in new_meals:
+            self.assertEqual(Meal.objects.get(pk=new_meal.id).calories,
+                             Decimal('37.5'))
+            self.assertEqual(Portion.objects.get(meal=new_meal).comestible_id,
+                             dish.id)
+        self.assertEqual(sorted(Meal.objects.values_list('date', flat=True)),
+                         [datetime.date(2012, 01, 02)] + week_dates(1) +
+                         week_dates(2))
+
+    def test_copy_week_in_bulk(self):
+        test_user = User.objects.create_user('testuser', 'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        for day in range(2, 9):
+            for time in (datetime.time(8, 0), datetime.time(13, 0)):
+                meal = Meal.objects.create(name = 'meal',
+                                           date = datetime.date(2012, 01, day),
+                                           time = time,
+                                           household = test_household,
+                                           user = test_user)
+                meal.portion_set.create(comestible = ingredient, quantity = day)
+
+        # The copies (and their portions) are inserted with one query per
+        # table, however many there are
+        inserts, new_meals = self.inserts(copy_week, datetime.date(2012, 01, 02),
+                                          datetime.date(2012, 01, 9),
+                                          test_household)
+        self.assertEqual(inserts['food_meal'], 1)
+        self.assertEqual(inserts['food_portion'], 1)
+        self.assertEqual(len(new_meals), 14)
+        for new_meal in new_meals:
+            new_meal = Meal.objects.get(pk=new_meal.id)
+            portion = new_meal.portion_set.get()
+            self.assertEqual(new_meal.date.day, 7 + portion.quantity)
+            self.assertEqual(new_meal.calories, portion.calories)
+
+
+
+class HouseholdSummariesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'test@example.com',
+                                             'testpassword')
+        self.household = self.user.profile.household
+        self.other_user = User.objects.create_user('otheruser',
+                                                   'test@example.com',
+                                                   'testpassword')
+        Profile.objects.filter(user=self.other_user).update(household=self.household)
+        self.ingredient = Ingredient.objects.create(name='Test ingredient',
+                                                    quantity=100, calories=200,
+                                                    unit='g')
+        self.today = datetime.date.today()
+
+    def summaries(self):
+        """
+        Returns the contents of the household summary tables (without rows
+        of zeroes, which are left when the last of something is deleted).
+        """
+        return {
+            'days': set(MemberDay.objects.filter(calories__gt=0).values_list(
+                            'household', 'user', 'date', 'calories')),
+            'totals': set(MemberTotals.objects.filter(dishes_cooked__gt=0).values_list(
+                              'household', 'user', 'dishes_cooked')),
+            'leftovers': set(Leftover.objects.values_list(
+                                 'dish', 'household', 'date_cooked', 'quantity')),
+            'ingredients': set(HouseholdIngredient.objects.filter(meals__gt=0).values_list(
+                                   'household', 'ingredient', 'meals')),
+        }
+
+    def assertSummariesRebuilt(self):
+        """
+        Asserts that the summary tables are the same as they would be if they
+        were rebuilt from scratch.
+        """
+        summaries = self.summaries()
+        call_command('rebuild_household_summaries', verbosity=0)
+        self.assertEqual(summaries, self.summaries())
+
+    def day_calories(self, date, user=None):
+        return MemberDay.objects.get(household=self.household,
+                                     user=user or self.user, date=date).calories
+
+    def test_summaries(self):
+        """
+        Tests that the household summaries follow the changes to dishes, meals
+        and their amounts and portions.
+        """
+        dish = Dish.objects.create(name='Test dish', quantity=500,
+                                   date_cooked=self.today,
+                                   household=self.household, unit='g')
+        dish.cooks.add(self.user)
+        Amount.objects.create(containing_dish=dish,
+                              contained_comestible=self.ingredient, quantity=250)
+        self.assertEqual(MemberTotals.objects.get(user=self.user).dishes_cooked, 1)
+        self.assertEqual(Leftover.objects.get(dish=dish).quantity, 500)
+        self.assertSummariesRebuilt()
+
+        # Eating some of the dish (500 calories in 500g)
+        meal = Meal.objects.create(name='lunch', date=self.today,
+                                   time=datetime.time(12, 0),
+                                   household=self.household, user=self.user)
+        portion = Portion.objects.create(meal=meal, comestible=dish.comestible,
+                                         quantity=100)
+        self.assertEqual(self.day_calories(self.today), 100)
+        self.assertEqual(Leftover.objects.get(dish=dish).quantity, 400)
+        self.assertEqual(HouseholdIngredient.objects.get(
+                             ingredient=self.ingredient).meals, 1)
+        self.assertSummariesRebuilt()
+
+        portion = Portion.objects.get(pk=portion.id)
+        portion.quantity = 200
+        portion.save()
+        self.assertEqual(self.day_calories(self.today), 200)
+        self.assertEqual(Leftover.objects.get(dish=dish).quantity, 300)
+
+        # Moving the meal to yesterday
+        yesterday = self.today - datetime.timedelta(days=1)
+        meal = Meal.objects.get(pk=meal.id)
+        meal.date = yesterday
+        meal.save()
+        self.assertEqual(self.day_calories(yesterday), 200)
+        self.assertFalse(MemberDay.objects.filter(date=self.today).exists())
+        self.assertSummariesRebuilt()
+
+        # Changing the ingredient's calories, one save at a time and in bulk
+        self.ingredient.calories = 400
+        self.ingredient.save()
+        self.assertEqual(self.day_calories(yesterday), 400)
+        Ingredient.objects.filter(pk=self.ingredient.id).update(calories=100)
+        recalculate_calories([self.ingredient.id])
+        self.assertEqual(self.day_calories(yesterday), 100)
+
+        # Copies of the meal, then deleting one
+        meal = Meal.objects.get(pk=meal.id)
+        new_meal, = meal.duplicate([self.today])
+        self.assertEqual(self.day_calories(self.today), 100)
+        self.assertEqual(Leftover.objects.get(dish=dish).quantity, 100)
+        self.assertEqual(HouseholdIngredient.objects.get(
+                             ingredient=self.ingredient).meals, 2)
+        week_start = yesterday - datetime.timedelta(yesterday.weekday())
+        copy_week(week_start, week_start + datetime.timedelta(weeks=1),
+                  household=self.household)
+        self.assertEqual(self.day_calories(yesterday + datetime.timedelta(weeks=1)),
+                         100)
+        self.assertSummariesRebuilt()
+        new_meal.delete()
+        self.assertFalse(MemberDay.objects.filter(date=self.today).exists())
+        self.assertSummariesRebuilt()
+
+        # A copy of the dish, used in another dish
+        new_dish, = dish.duplicate([self.today])
+        self.assertEqual(Leftover.objects.get(dish=new_dish).quantity, 500)
+        other_dish = Dish.objects.create(name='Other dish', quantity=100,
+                                         date_cooked=self.today,
+                                         household=self.household, unit='g')
+        Amount.objects.create(containing_dish=other_dish,
+                              contained_comestible=new_dish.comestible,
+                              quantity=100)
+        self.assertEqual(Leftover.objects.get(dish=new_dish).quantity, 400)
+        other_dish.scale(2)
+        self.assertEqual(Leftover.objects.get(dish=new_dish).quantity, 300)
+        self.assertEqual(Leftover.objects.get(dish=other_dish).quantity, 200)
+        self.assertSummariesRebuilt()
+
+        # Changing the cooks
+        dish.cooks = [self.user, self.other_user]
+        self.assertEqual(MemberTotals.objects.get(user=self.other_user).dishes_cooked, 1)
+        self.other_user.cooked_dishes.add(new_dish)
+        self.assertEqual(MemberTotals.objects.get(user=self.other_user).dishes_cooked, 2)
+        self.other_user.cooked_dishes.clear()
+        self.assertEqual(MemberTotals.objects.get(user=self.other_user).dishes_cooked, 0)
+        self.assertEqual(MemberTotals.objects.get(user=self.user).dishes_cooked, 1)
+        self.assertSummariesRebuilt()
+
+        # Deleting the dish deletes the portions of it, so the meals it was
+        # in don't have any calories or ingredients any more
+        dish.delete()
+        self.assertEqual(MemberTotals.objects.get(user=self.user).dishes_cooked, 0)
+        self.assertFalse(Leftover.objects.filter(dish=dish.id).exists())
+        self.assertEqual(self.day_calories(yesterday), 0)
+        self.assertEqual(HouseholdIngredient.objects.get(
+                             ingredient=self.ingredient).meals, 0)
+        self.assertSummariesRebuilt()
+
+    def test_dashboard(self):
+        """
+        Tests the statistics of the household dashboard.
+        """
+        dish = Dish.objects.create(name='Test dish', quantity=500,
+                                   date_cooked=self.today,
+                                   household=self.household, unit='g')
+        dish.cooks.add(self.other_user)
+        Amount.objects.create(containing_dish=dish,
+                              contained_comestible=self.ingredient, quantity=250)
+        old_dish = Dish.objects.create(name='Old dish', quantity=500,
+                                       date_cooked=self.today - datetime.timedelta(
+                                           days=LEFTOVER_DAYS + 1),
+                                       household=self.household, unit='g')
+        # (last week's meals don't count)
+        for date, quantity in ((self.today, 100),
+                               (self.today - datetime.timedelta(weeks=1), 50)):
+            meal = Meal.objects.create(name='lunch', date=date,
+                                       time=datetime.time(12, 0),
+                                       household=self.household, user=self.user)
+            Portion.objects.create(meal=meal, comestible=dish.comestible,
+                                   quantity=quantity)
+
+        members = [self.user, self.other_user]
+        dashboard = household_dashboard(self.household, members)
+        self.assertEqual(dashboard['week_start'].weekday(), 0)
+        self.assertEqual([(member['user'], member['week_calories'],
+                           member['dishes_cooked'])
+                          for member in dashboard['members']],
+                         [(self.user, 100, 0), (self.other_user, 0, 1)])
+        self.assertEqual([(leftover.dish, leftover.quantity)
+                          for leftover in dashboard['leftovers']],
+                         [(dish, 350)])
+        self.assertEqual([(count.ingredient, count.meals)
+                          for count in dashboard['top_ingredients']],
+                         [(self.ingredient, 2)])
+        # Other households' dashboards are empty
+        other_household = Household.objects.create(name='Other household',
+                                                   admin=self.user)
+        dashboard = household_dashboard(other_household, [])
+        self.assertEqual((dashboard['members'], dashboard['leftovers'],
+                          dashboard['top_ingredients']), ([], [], []))
+
+    def test_concurrent_summary_rows(self):
+        """
+        Tests that a summary row created by another process at the same time
+        (which PostgreSQL allows) is updated instead.
+        """
+        MemberTotals.objects.create(household=self.household, user=self.user,
+                                    dishes_cooked=1)
+        retried = []
+        _on_conflict(lambda: MemberTotals.objects.create(
+                         household=self.household, user=self.user,
+                         dishes_cooked=2),
+                     lambda: retried.append(True))
+        self.assertEqual(retried, [True])
+        self.assertEqual(MemberTotals.objects.get(user=self.user).dishes_cooked, 1)
+        # (any other error isn't caught)
+        self.assertRaises(ZeroDivisionError, _on_conflict, lambda: 1 / 0,
+                          lambda: retried.append(True))
+        self.assertEqual(retried, [True])
+
+    def test_merge_households(self):
+        """
+        Tests that merging households moves the dishes, meals and members of
+        one to the other, with a number of queries which doesn't depend on how
+        many there are, and rebuilds the summaries.
+        """
+        third_user = User.objects.create_user('thirduser', 'test@example.com',
+                                              'testpassword')
+        other_household = third_user.profile.household
+        for household, user in ((self.household, self.user),
+                                (other_household, third_user)):
+            dish = Dish.objects.create(name='Test dish', quantity=500,
+                                       date_cooked=self.today,
+                                       household=household, unit='g')
+            dish.cooks.add(user)
+            Amount.objects.create(containing_dish=dish,
+                                  contained_comestible=self.ingredient,
+                                  quantity=250)
+            meal = Meal.objects.create(name='lunch', date=self.today,
+                                       time=datetime.time(12, 0),
+                                       household=household, user=user)
+            Portion.objects.create(meal=meal, comestible=dish.comestible,
+                                   quantity=100)
+        other_dish = Dish.objects.get(household=other_household)
+        search_index.build()
+        self.assertEqual(len(search_index.search('test dish', is_dish=True,
+                                                 household=self.household)), 1)
+        version = get_detail_version('dish', other_dish.id)
+        get_profile(third_user)
+        # (the ids of the dishes, meals and members; four UPDATEs; and
+        # rebuilding the summaries)
+        with self.assertNumQueries(23):
+            merge_households(other_household, self.household)
+
+        self.assertFalse(Household.objects.get(pk=other_household.id).is_active)
+        self.assertEqual(Dish.objects.filter(household=self.household).count(), 2)
+        self.assertEqual(Meal.objects.filter(household=self.household).count(), 2)
+        self.assertEqual(get_profile(third_user).household, self.household)
+        self.assertNotEqual(get_detail_version('dish', other_dish.id), version)
+        self.assertEqual(len(search_index.search('test dish', is_dish=True,
+                                                 household=self.household)), 2)
+        self.assertEqual(search_index.search('test dish', is_dish=True,
+                                             household=other_household), [])
+        search_index.clear()
+        self.assertEqual(MemberTotals.objects.get(user=third_user).household,
+                         self.household)
+        self.assertEqual(Leftover.objects.get(dish=other_dish).household,
+                         self.household)
+        self.assertEqual(HouseholdIngredient.objects.get(
+                             ingredient=self.ingredient).meals, 2)
+        self.assertEqual(self.day_calories(self.today, third_user), 100)
+        self.assertFalse(MemberDay.objects.filter(household=other_household).exists())
+        self.assertSummariesRebuilt()
+
+        # Merging with more dishes and meals takes the same queries
+        for number in range(5):
+            Dish.objects.create(name='Another dish', quantity=500,
+                                date_cooked=self.today, household=self.household,
+                                unit='g').cooks.add(self.user)
+            Meal.objects.create(name='lunch', date=self.today,
+                                time=datetime.time(12, 0),
+                                household=self.household, user=self.other_user)
+        with self.assertNumQueries(23):
+            merge_households(self.household, other_household)
+        self.assertEqual(Dish.objects.filter(household=other_household).count(), 7)
+        self.assertSummariesRebuilt()
+
+        self.assertRaises(ValueError, merge_households, other_household,
+                          other_household)
+        # (an inactive household can't be merged again; call_command reports
+        # CommandErrors and exits)
+        self.assertRaises(SystemExit, call_command, 'merge_households',
+                          str(self.household.id), str(other_household.id))
+
 
 class FoodViewsTestCase(TestCase):
+    def setUp(self):
+        # Cached detail pages from earlier tests could have the same ids
+        cache.clear()
+
     def test_food_index(self):
         response = self.client.get(reverse('food_index'))
         self.assertEqual(response.status_code, 200)
@@ -253,7 +676,8 @@ class FoodViewsTestCase(TestCase):
                                                quantity = 100,
                                                unit = 'g',
                                                calories = 75)
-        with self.assertNumQueries(3):
+        # (anonymous users have no dishes or meals to list the ingredient in)
+        with self.assertNumQueries(1):
             response = self.client.get(reverse('ingredient_detail',
                                                kwargs={'pk': ingredient.id}))
         self.assertEqual(response.status_code, 200)
@@ -270,6 +694,128 @@ class FoodViewsTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, '404.html')
 
+    def test_ingredient_uses(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        peanuts = Ingredient.objects.create(name = 'Peanuts',
+                                            quantity = 100,
+                                            unit = 'g',
+                                            calories = 600)
+        noodles = Ingredient.objects.create(name = 'Noodles',
+                                            quantity = 100,
+                                            unit = 'g',
+                                            calories = 150)
+        sauce = Dish.objects.create(name = 'Satay sauce',
+                                    quantity = 500,
+                                    date_cooked = datetime.date(2012, 01, 10),
+                                    household = test_household,
+                                    unit = 'g')
+        sauce.amount_set.create(contained_comestible = peanuts, quantity = 100)
+        stir_fry = Dish.objects.create(name = 'Stir fry',
+                                       quantity = 1000,
+                                       date_cooked = datetime.date(2012, 01, 11),
+                                       household = test_household,
+                                       unit = 'g')
+        stir_fry.amount_set.create(contained_comestible = noodles,
+                                   quantity = 500)
+        stir_fry.amount_set.create(contained_comestible = sauce,
+                                   quantity = 250)
+        stir_fry.amount_set.create(contained_comestible = peanuts,
+                                   quantity = 50)
+        dinner = Meal.objects.create(name = 'dinner',
+                                     date = datetime.date(2012, 01, 11),
+                                     time = datetime.time(19, 0),
+                                     household = test_household,
+                                     user = test_user)
+        dinner.portion_set.create(comestible = stir_fry, quantity = 300)
+        lunch = Meal.objects.create(name = 'lunch',
+                                    date = datetime.date(2012, 02, 1),
+                                    time = datetime.time(13, 0),
+                                    household = test_household,
+                                    user = test_user)
+        lunch.portion_set.create(comestible = sauce, quantity = 100)
+        lunch.portion_set.create(comestible = peanuts, quantity = 10)
+
+        # Peanuts are in the stir fry through the sauce as well as directly
+        self.assertEqual(DishIngredient.objects.get(dish=stir_fry,
+                                                    ingredient=peanuts).quantity,
+                         100)
+        self.client.login(username='testuser', password='testpassword')
+        # (and the session, the user, and the user's profile with its
+        # household)
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('ingredient_uses',
+                                               kwargs={'pk': peanuts.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/ingredient_uses.html')
+        self.assertEqual([(total.dish, total.quantity)
+                          for total in response.context['dish_totals']],
+                         [(stir_fry, 100), (sauce, 100)])
+        self.assertEqual([(total.meal, total.quantity)
+                          for total in response.context['meal_totals']],
+                         [(lunch, 30), (dinner, 30)])
+
+        # Filtered by date and quantity
+        response = self.client.get(reverse('ingredient_uses',
+                                           kwargs={'pk': peanuts.id}),
+                                   {'date_from': '2012-01-11',
+                                    'date_to': '2012-01-31'})
+        self.assertEqual([total.dish for total in response.context['dish_totals']],
+                         [stir_fry])
+        self.assertEqual([total.meal for total in response.context['meal_totals']],
+                         [dinner])
+        response = self.client.get(reverse('ingredient_uses',
+                                           kwargs={'pk': noodles.id}),
+                                   {'min_quantity': '200'})
+        self.assertEqual([total.dish for total in response.context['dish_totals']],
+                         [stir_fry])
+        self.assertEqual(list(response.context['meal_totals']), [])
+
+        # Only the user's household's dishes and meals are listed
+        User.objects.create_user('otheruser', 'other@example.com', 'otherpassword')
+        other_client = Client()
+        other_client.login(username='otheruser', password='otherpassword')
+        response = other_client.get(reverse('ingredient_uses',
+                                            kwargs={'pk': peanuts.id}))
+        self.assertEqual(list(response.context['dish_totals']), [])
+        self.assertEqual(list(response.context['meal_totals']), [])
+
+        # Editing, scaling and duplicating keep the index up to date, the
+        # same as rebuilding it from scratch
+        amount = sauce.amount_set.get()
+        amount.quantity = 200
+        amount.save()
+        stir_fry.scale(2)
+        stir_fry.duplicate([datetime.date(2012, 01, 12)])
+        lunch.duplicate([datetime.date(2012, 02, 2)])
+        copy_week(datetime.date(2012, 01, 9), datetime.date(2012, 01, 16),
+                  test_household)
+        self.assertEqual(MealIngredient.objects.get(meal=dinner,
+                                                    ingredient=peanuts).quantity,
+                         45)
+        index = lambda: sorted(
+            list(DishIngredient.objects.values_list('dish', 'ingredient', 'quantity')) +
+            list(MealIngredient.objects.values_list('meal', 'ingredient', 'quantity')))
+        maintained = index()
+        DishIngredient.objects.all().delete()
+        MealIngredient.objects.all().delete()
+        call_command('rebuild_ingredient_index')
+        self.assertEqual(index(), maintained)
+
+        # Deleting the sauce removes it from everything containing it
+        sauce.delete()
+        self.assertEqual(MealIngredient.objects.get(meal=dinner,
+                                                    ingredient=peanuts).quantity,
+                         15)
+        self.assertRaises(ObjectDoesNotExist, MealIngredient.objects.get,
+                          meal=lunch, ingredient=noodles)
+
+        response = self.client.get(reverse('ingredient_uses',
+                                           kwargs={'pk': fake_pk}))
+        self.assertEqual(response.status_code, 404)
+
     def test_ingredient_edit(self):
         # Create an ingredient
         ingredient = Ingredient.objects.create(name = 'Test ingredient',
@@ -481,8 +1027,8 @@ class FoodViewsTestCase(TestCase):
                                     follow=True)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.templates), 2)
-        # Redirects to ingredient_list
-        self.assertTemplateUsed(response, 'food/ingredient_list.html')
+        # Redirects back to ingredient_manage
+        self.assertTemplateUsed(response, 'food/ingredient_manage.html')
         self.assertTemplateUsed(response, 'food/base.html')
         self.assertEqual(Ingredient.objects.count(), 3)
         edited_ingredient_one = Ingredient.objects.get(pk=ingredient_one.id)
@@ -499,8 +1045,7 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
         containing_dish = Dish.objects.create(name = "Containing dish",
                                               quantity = 500,
                                               date_cooked = datetime.date(2012, 01, 18),
@@ -552,8 +1097,8 @@ class FoodViewsTestCase(TestCase):
                                     follow=True)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.templates), 2)
-        # Redirects to ingredient_list
-        self.assertTemplateUsed(response, 'food/ingredient_list.html')
+        # Redirects back to ingredient_manage
+        self.assertTemplateUsed(response, 'food/ingredient_manage.html')
         self.assertTemplateUsed(response, 'food/base.html')
         edited_ingredient_one = Ingredient.objects.get(pk=ingredient_one.id)
         updated_amount = Amount.objects.get(pk=amount.id)
@@ -645,6 +1190,85 @@ class FoodViewsTestCase(TestCase):
         self.assertTrue(expected_error in
                             response.context['formset'][1]['comestible_ptr'].errors)
 
+    def test_ingredient_manage_pages(self):
+        user = User.objects.create_user('jenny', 'jenny@example.com', 'jenny')
+        self.client.login(username='jenny', password='jenny')
+
+        # Create one more page's worth of ingredients than fits on page 1
+        for i in range(INGREDIENT_MANAGE_PAGINATE_BY + 2):
+            Ingredient.objects.create(name = 'Test ingredient %03d' % i,
+                                      quantity = 100,
+                                      unit = 'g',
+                                      calories = i)
+
+        # Only the first page of ingredients is in the formset (plus the 3
+        # extra forms)
+        response = self.client.get(reverse('ingredient_manage'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['formset'].forms),
+                         INGREDIENT_MANAGE_PAGINATE_BY + 3)
+        page = response.context['page']
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+
+        response = self.client.get(reverse('ingredient_manage'),
+                                   {'after': page.next_cursor()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['formset'].forms), 2 + 3)
+        self.assertEqual(response.context['formset'][0].instance.name,
+                         'Test ingredient %03d' % INGREDIENT_MANAGE_PAGINATE_BY)
+        self.assertTrue(response.context['page'].has_previous)
+        self.assertFalse(response.context['page'].has_next)
+
+        # Nonsense cursors don't exist
+        response = self.client.get(reverse('ingredient_manage'),
+                                   {'after': 'last'})
+        self.assertEqual(response.status_code, 404)
+
+        # Filter by the start of the name
+        response = self.client.get(reverse('ingredient_manage'),
+                                   {'q': 'test ingredient 00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['formset'].forms), 10 + 3)
+        self.assertEqual(response.context['search'], 'test ingredient 00')
+        self.assertFalse(response.context['page'].has_next)
+        response = self.client.get(reverse('ingredient_manage'),
+                                   {'q': 'ingredient 00'})
+        self.assertEqual(len(response.context['formset'].forms), 3)
+
+        # Edit an ingredient on the second page of a search, posting only that
+        # page, and come back to the same page and search
+        Ingredient.objects.create(name='Other ingredient', quantity=100,
+                                  unit='g', calories=1)
+        last_ingredient = Ingredient.objects.get(
+            name='Test ingredient %03d' % (INGREDIENT_MANAGE_PAGINATE_BY + 1))
+        penultimate_ingredient = Ingredient.objects.get(
+            name='Test ingredient %03d' % INGREDIENT_MANAGE_PAGINATE_BY)
+        query = {'q': 'test', 'after': page.next_cursor()}
+        url = '%s?%s' % (reverse('ingredient_manage'), urllib.urlencode(query))
+        response = self.client.post(url,
+                                    data={'form-TOTAL_FORMS': 2,
+                                          'form-INITIAL_FORMS': 2,
+                                          'form-0-comestible_ptr': penultimate_ingredient.id,
+                                          'form-0-name': penultimate_ingredient.name,
+                                          'form-0-quantity': 100,
+                                          'form-0-unit': 'g',
+                                          'form-0-calories': penultimate_ingredient.calories,
+                                          'form-1-comestible_ptr': last_ingredient.id,
+                                          'form-1-name': last_ingredient.name,
+                                          'form-1-quantity': 100,
+                                          'form-1-unit': 'g',
+                                          'form-1-calories': 500})
+        self.assertEqual(response.status_code, 302)
+        location = urlparse.urlparse(response['Location'])
+        self.assertEqual(location.path, reverse('ingredient_manage'))
+        self.assertEqual(urlparse.parse_qs(location.query),
+                         dict((key, [value]) for key, value in query.items()))
+        self.assertEqual(Ingredient.objects.get(pk=last_ingredient.id).calories,
+                         500)
+        self.assertEqual(Ingredient.objects.count(),
+                         INGREDIENT_MANAGE_PAGINATE_BY + 3)
+
 ################################################################################
 # Dish views tests
 
@@ -656,13 +1280,91 @@ class FoodViewsTestCase(TestCase):
         self.assertTemplateUsed(response, 'food/base.html')
         self.assertTrue('dish_list' in response.context)
 
+    def test_list_pages(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        # Several dishes cooked on each day, so that the pages have to split
+        # dishes with the same date
+        for day in range(1, 6):
+            for number in range(3):
+                Dish.objects.create(name = 'Dish %s-%s' % (day, number),
+                                    quantity = 500,
+                                    date_cooked = datetime.date(2012, 01, day),
+                                    household = test_user.profile.household,
+                                    unit = 'g')
+        all_dishes = list(Dish.objects.order_by('-date_cooked', 'pk'))
+        self.assertEqual(len(all_dishes), 15)
+
+        # Forwards through the pages, then back again
+        old_paginate_by = DishListView.paginate_by
+        DishListView.paginate_by = 4
+        try:
+            pages = []
+            response = self.client.get(reverse('dish_list'))
+            self.assertFalse(response.context['page_obj'].has_previous)
+            while True:
+                pages.append(response.context['dish_list'])
+                page = response.context['page_obj']
+                if not page.has_next:
+                    break
+                # Every page costs the same (one query for the dishes, after
+                # the session and the user, whose household is cached)
+                with self.assertNumQueries(3):
+                    response = self.client.get(reverse('dish_list'),
+                                               {'after': page.next_cursor()})
+            self.assertEqual([len(dishes) for dishes in pages], [4, 4, 4, 3])
+            self.assertEqual(sum(pages, []), all_dishes)
+            for dishes in reversed(pages[:-1]):
+                response = self.client.get(reverse('dish_list'),
+                    {'before': response.context['page_obj'].previous_cursor()})
+                self.assertEqual(response.context['dish_list'], dishes)
+            self.assertFalse(response.context['page_obj'].has_previous)
+
+            # The next page doesn't shift when dishes are added before it
+            next_cursor = response.context['page_obj'].next_cursor()
+            Dish.objects.create(name = 'Newest dish',
+                                quantity = 500,
+                                date_cooked = datetime.date(2012, 01, 6),
+                                household = test_user.profile.household,
+                                unit = 'g')
+            response = self.client.get(reverse('dish_list'),
+                                       {'after': next_cursor})
+            self.assertEqual(response.context['dish_list'], pages[1])
+        finally:
+            DishListView.paginate_by = old_paginate_by
+
+        for bad_cursor in ['nonsense', encode_cursor(['2012-01-01'])]:
+            response = self.client.get(reverse('dish_list'),
+                                       {'after': bad_cursor})
+            self.assertEqual(response.status_code, 404)
+
+        # Meals, in date order in the list and latest first in the archive
+        for day in range(1, 4):
+            for hour in (8, 13):
+                Meal.objects.create(name = 'lunch',
+                                    date = datetime.date(2012, 01, day),
+                                    time = datetime.time(hour, 0),
+                                    household = test_user.profile.household,
+                                    user = test_user)
+        meals = list(Meal.objects.order_by('date', 'time', 'pk'))
+        page = KeysetPage(Meal.objects.all(), MealListView.keyset_ordering, 4)
+        self.assertEqual(page.object_list, meals[:4])
+        page = KeysetPage(Meal.objects.all(), MealListView.keyset_ordering, 4,
+                          after=page.next_cursor())
+        self.assertEqual(page.object_list, meals[4:])
+        response = self.client.get(reverse('meal_archive'))
+        self.assertEqual(response.context['latest'], list(reversed(meals)))
+        response = self.client.get(reverse('meal_list'))
+        self.assertEqual(response.context['meal_list'], meals)
+
     def test_dish_detail(self):
         # Create a user, household, ingredients, dish & amounts
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
         ingredient_one = Ingredient.objects.create(name = 'Test ingredient 1',
                                                    quantity = 100,
                                                    unit = 'g',
@@ -683,7 +1385,10 @@ class FoodViewsTestCase(TestCase):
         dish.amount_set.create(contained_comestible = ingredient_two,
                                quantity = 150)
 
-        with self.assertNumQueries(6):
+        self.client.login(username='testuser', password='testpassword')
+        # (including the session, the user, and the user's profile with its
+        # household)
+        with self.assertNumQueries(9):
             response = self.client.get(reverse('dish_detail',
                                            kwargs={'pk': dish.id}))
         self.assertEqual(response.status_code, 200)
@@ -702,13 +1407,208 @@ class FoodViewsTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, '404.html')
 
+        # Other households' dishes aren't shown
+        User.objects.create_user('otheruser', 'other@example.com', 'otherpassword')
+        self.client.login(username='otheruser', password='otherpassword')
+        response = self.client.get(reverse('dish_detail',
+                                           kwargs={'pk': dish.id}))
+        self.assertEqual(response.status_code, 404)
+        self.client.logout()
+        response = self.client.get(reverse('dish_detail',
+                                           kwargs={'pk': dish.id}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail_cache(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        inner_dish = Dish.objects.create(name = 'Inner dish',
+                                         quantity = 500,
+                                         date_cooked = datetime.date(2012, 01, 17),
+                                         household = test_household,
+                                         unit = 'g')
+        inner_dish.amount_set.create(contained_comestible = ingredient,
+                                     quantity = 500)
+        dish = Dish.objects.create(name = 'Test dish',
+                                   quantity = 1000,
+                                   date_cooked = datetime.date(2012, 01, 18),
+                                   household = test_household,
+                                   unit = 'g')
+        dish.cooks.add(test_user)
+        dish.amount_set.create(contained_comestible = inner_dish,
+                               quantity = 250)
+        meal = Meal.objects.create(name = 'dinner',
+                                   date = datetime.date(2012, 01, 18),
+                                   time = datetime.time(19, 0),
+                                   household = test_household,
+                                   user = test_user)
+        meal.portion_set.create(comestible = dish, quantity = 300)
+        dish_url = reverse('dish_detail', kwargs={'pk': dish.id})
+        inner_dish_url = reverse('dish_detail', kwargs={'pk': inner_dish.id})
+        meal_url = reverse('meal_detail', kwargs={'pk': meal.id})
+        self.client.login(username='testuser', password='testpassword')
+
+        # The content is only rendered (with its queries) the first time
+        response = self.client.get(dish_url)
+        self.assertContains(response, 'Inner dish')
+        # (one for the dish, after the session and the user, whose household
+        # is cached)
+        with self.assertNumQueries(3):
+            response = self.client.get(dish_url)
+        self.assertContains(response, 'Inner dish')
+        self.assertContains(response, 'Dinner')
+        self.client.get(inner_dish_url)
+        response = self.client.get(meal_url)
+        self.assertContains(response, 'Test dish')
+        # (one for the meal's Last-Modified, one for the meal)
+        with self.assertNumQueries(4):
+            response = self.client.get(meal_url)
+        self.assertContains(response, 'Test dish')
+
+        # Changes are shown straight away on every page they affect
+        ingredient.name = 'Renamed ingredient'
+        ingredient.save()
+        self.assertContains(self.client.get(inner_dish_url), 'Renamed ingredient')
+        meal.name = 'lunch'
+        meal.save()
+        self.assertContains(self.client.get(dish_url), 'Lunch')
+        self.assertContains(self.client.get(meal_url), 'lunch')
+        dish.name = 'Renamed dish'
+        dish.save()
+        self.assertContains(self.client.get(inner_dish_url), 'Renamed dish')
+        self.assertContains(self.client.get(meal_url), 'Renamed dish')
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'testpassword')
+        dish.cooks.add(other_user)
+        self.assertContains(self.client.get(dish_url), 'testuser and otheruser')
+        test_household.name = 'Renamed household'
+        test_household.save()
+        self.assertContains(self.client.get(dish_url), 'Renamed household')
+
+        # ...including changes made in bulk, without saving each object
+        dish.scale(2)
+        self.assertContains(self.client.get(inner_dish_url), '<td>500 g</td>')
+        self.assertContains(self.client.get(dish_url), '2,000g')
+        Ingredient.objects.filter(pk=ingredient.id).update(calories=100)
+        recalculate_calories([ingredient.id])
+        self.assertContains(self.client.get(meal_url), '75 calories')
+        meal.duplicate([datetime.date(2012, 01, 19)])
+        self.assertContains(self.client.get(dish_url), 'Lunch', count=2)
+        Portion.objects.get(meal=meal).delete()
+        self.assertContains(self.client.get(dish_url), 'Lunch', count=1)
+        self.assertContains(self.client.get(meal_url), "Don't skip meals!")
+
+    def test_conditional_get(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        dish = Dish.objects.create(name = 'Test dish',
+                                   quantity = 1000,
+                                   date_cooked = datetime.date(2012, 01, 16),
+                                   household = test_household,
+                                   unit = 'g')
+        dish.amount_set.create(contained_comestible = ingredient,
+                               quantity = 500)
+        meal = Meal.objects.create(name = 'dinner',
+                                   date = datetime.date(2012, 01, 18),
+                                   time = datetime.time(19, 0),
+                                   household = test_household,
+                                   user = test_user)
+        meal.portion_set.create(comestible = dish, quantity = 300)
+        week_url = reverse('meal_archive_week', kwargs={'year': 2012,
+                                                        'week': '03'})
+        self.client.login(username='testuser', password='testpassword')
+
+        def revalidate(url, response):
+            return self.client.get(url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        # An unchanged page isn't rendered again
+        response = self.client.get(week_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        # (and the session and the user, whose household is cached)
+        with self.assertNumQueries(5):
+            self.assertEqual(revalidate(week_url, response).status_code, 304)
+
+        # Anything changing in the week, or the nearest meals either side of
+        # it changing, or a different user, means a new page
+        meal.portion_set.create(comestible = ingredient, quantity = 10)
+        self.assertEqual(revalidate(week_url, response).status_code, 200)
+        response = self.client.get(week_url)
+        Meal.objects.create(name = 'lunch',
+                            date = datetime.date(2012, 01, 26),
+                            time = datetime.time(13, 0),
+                            household = test_household,
+                            user = test_user)
+        self.assertEqual(revalidate(week_url, response).status_code, 200)
+        response = self.client.get(week_url)
+        Ingredient.objects.filter(pk=ingredient.id).update(calories=80)
+        recalculate_calories([ingredient.id])
+        self.assertEqual(revalidate(week_url, response).status_code, 200)
+        response = self.client.get(week_url)
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'testpassword')
+        profile = other_user.profile
+        profile.household = test_household
+        profile.save()
+        self.client.login(username='otheruser', password='testpassword')
+        self.assertEqual(revalidate(week_url, response).status_code, 200)
+        response = self.client.get(week_url)
+        meal.delete()
+        # (the week is empty now)
+        self.assertEqual(revalidate(week_url, response).status_code, 404)
+
+        # The other archive pages
+        for url in [reverse('meal_archive'),
+                    reverse('meal_archive_year', kwargs={'year': 2012}),
+                    reverse('meal_archive_month', kwargs={'year': 2012,
+                                                          'month': '01'}),
+                    reverse('meal_archive_day', kwargs={'year': 2012,
+                                                        'month': '01',
+                                                        'day': 26})]:
+            response = self.client.get(url)
+            self.assertEqual(revalidate(url, response).status_code, 304)
+        response = self.client.get(reverse('meal_archive_day',
+                                           kwargs={'year': 2012,
+                                                   'month': '02',
+                                                   'day': 30}))
+        self.assertEqual(response.status_code, 404)
+
+        # Detail pages use the versions of their cached content
+        dish_url = reverse('dish_detail', kwargs={'pk': dish.id})
+        response = self.client.get(dish_url)
+        self.assertEqual(self.client.get(dish_url,
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        dish.name = 'Renamed dish'
+        dish.save()
+        self.assertEqual(self.client.get(dish_url,
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        response = self.client.get(dish_url)
+        dish.delete()
+        self.assertEqual(self.client.get(dish_url,
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
     def test_dish_delete(self):
         # Create a user, household, ingredients, dish & amounts
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
         ingredient_one = Ingredient.objects.create(name = 'Test ingredient 1',
                                                    quantity = 100,
                                                    unit = 'g',
@@ -784,9 +1684,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -899,9 +1798,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -1202,9 +2100,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -1291,6 +2188,97 @@ class FoodViewsTestCase(TestCase):
         self.assertEqual(dish.quantity, 500)
         self.assertEqual(amount_one.quantity, 50)
         self.assertEqual(amount_two.quantity, 150)
+        self.assertEqual(dish.calories, 1279.5)
+
+        # Put some of the dish in another dish and in a meal, to check that
+        # they're updated after scaling
+        containing_dish = Dish.objects.create(name = 'Containing dish',
+                                              quantity = 1000,
+                                              date_cooked = datetime.date(2012, 01, 19),
+                                              household = test_household,
+                                              unit = 'g')
+        containing_dish.amount_set.create(contained_comestible = dish,
+                                          quantity = 200)
+        meal = Meal.objects.create(name = 'dinner',
+                                   date = datetime.date(2012, 01, 18),
+                                   time = datetime.time(19, 0),
+                                   household = test_household,
+                                   user = test_user)
+        meal.portion_set.create(comestible = dish, quantity = 100)
+        self.assertEqual(Dish.objects.get(pk=containing_dish.id).calories, Decimal('511.8'))
+        self.assertEqual(Meal.objects.get(pk=meal.id).calories, Decimal('255.9'))
+
+        # Scale a dish to a target quantity
+        response = self.client.post(reverse('dish_multiply',
+                                            kwargs={'dish_id': dish.id}),
+                                    data={'operation': 'quantity',
+                                          'factor': 1000},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/dish_detail.html')
+        dish = Dish.objects.get(pk=dish.id)
+        amount_one = Amount.objects.get(contained_comestible=ingredient_one)
+        amount_two = Amount.objects.get(contained_comestible=ingredient_two)
+        self.assertEqual(dish.quantity, 1000)
+        self.assertEqual(dish.calories, 2559)
+        self.assertEqual(amount_one.quantity, 100)
+        self.assertEqual(amount_one.calories, 75)
+        self.assertEqual(amount_two.quantity, 300)
+        self.assertEqual(amount_two.calories, 2484)
+        # The calories per gram of the dish haven't changed
+        self.assertEqual(Dish.objects.get(pk=containing_dish.id).calories, Decimal('511.8'))
+        self.assertEqual(Meal.objects.get(pk=meal.id).calories, Decimal('255.9'))
+
+        # Scale a dish to a target number of calories
+        response = self.client.post(reverse('dish_multiply',
+                                            kwargs={'dish_id': dish.id}),
+                                    data={'operation': 'calories',
+                                          'factor': '1279.5'},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/dish_detail.html')
+        dish = Dish.objects.get(pk=dish.id)
+        amount_one = Amount.objects.get(contained_comestible=ingredient_one)
+        amount_two = Amount.objects.get(contained_comestible=ingredient_two)
+        self.assertEqual(dish.quantity, 500)
+        self.assertEqual(dish.calories, 1279.5)
+        self.assertEqual(amount_one.quantity, 50)
+        self.assertEqual(amount_two.quantity, 150)
+
+        # Scaling by a factor which doesn't divide exactly still leaves values
+        # with 2 decimal places
+        response = self.client.post(reverse('dish_multiply',
+                                            kwargs={'dish_id': dish.id}),
+                                    data={'operation': 'divide',
+                                          'factor': 3},
+                                    follow=True)
+        dish = Dish.objects.get(pk=dish.id)
+        amount_one = Amount.objects.get(contained_comestible=ingredient_one)
+        self.assertEqual(dish.quantity, Decimal('166.67'))
+        self.assertEqual(amount_one.quantity, Decimal('16.67'))
+        self.assertEqual(amount_one.calories, Decimal('12.5'))
+        response = self.client.post(reverse('dish_multiply',
+                                            kwargs={'dish_id': dish.id}),
+                                    data={'operation': 'quantity',
+                                          'factor': 500},
+                                    follow=True)
+
+        # Try to scale a dish without any calories to a target number of
+        # calories
+        empty_dish = Dish.objects.create(name = 'Empty dish',
+                                         quantity = 500,
+                                         date_cooked = datetime.date(2012, 01, 18),
+                                         household = test_household,
+                                         unit = 'g')
+        response = self.client.post(reverse('dish_multiply',
+                                            kwargs={'dish_id': empty_dish.id}),
+                                    data={'operation': 'calories',
+                                          'factor': 100},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/dish_multiply.html')
+        self.assertTrue(u'This dish has no calories to scale from.' in
+                                response.context['form'].non_field_errors())
 
         # Try to multiply a dish with an invalid factor value
         response = self.client.post(reverse('dish_multiply',
@@ -1318,9 +2306,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -1410,6 +2397,30 @@ class FoodViewsTestCase(TestCase):
         self.assertEqual(Dish.objects.count(), 2)
         self.assertEqual(Amount.objects.count(), 4)
 
+        # Duplicate a dish on every Sunday for four weeks
+        response = self.client.post(reverse('dish_duplicate',
+                                            kwargs={'dish_id': old_dish.id}),
+                                    data={'date': datetime.date(2011, 12, 1),
+                                          'until': datetime.date(2011, 12, 28),
+                                          'weekdays': ['6']},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/dish_detail.html')
+        self.assertEqual(response.context['dish'].date_cooked,
+                         datetime.date(2011, 12, 4))
+        new_dishes = Dish.objects.filter(date_cooked__gte=datetime.date(2011, 12, 1))
+        self.assertEqual([dish.date_cooked for dish in new_dishes.order_by('date_cooked')],
+                         [datetime.date(2011, 12, 4), datetime.date(2011, 12, 11),
+                          datetime.date(2011, 12, 18), datetime.date(2011, 12, 25)])
+        self.assertEqual(Amount.objects.count(), 4 + 8)
+        old_dish = Dish.objects.get(pk=old_dish.id)
+        for new_dish in new_dishes:
+            self.assertEqual(new_dish.calories, old_dish.calories)
+            self.assertTrue(new_dish.is_dish)
+            self.assertEqual(new_dish.comestible.child, new_dish)
+            self.assertEqual(new_dish.amount_set.get(contained_comestible=ingredient_two).quantity,
+                             150)
+
         # Try to duplicate a dish which doesn't exist
         self.assertRaises(ObjectDoesNotExist, Dish.objects.get, pk=fake_pk)
         response = self.client.get(reverse('dish_duplicate',
@@ -1433,8 +2444,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
+        self.client.login(username='testuser', password='testpassword')
         meal = Meal.objects.create(name = 'breakfast',
                                    date = datetime.date(2011, 01, 01),
                                    time = datetime.time(7, 30),
@@ -1462,8 +2473,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
+        self.client.login(username='testuser', password='testpassword')
         meal = Meal.objects.create(name = 'breakfast',
                                    date = datetime.date(2011, 01, 01),
                                    time = datetime.time(7, 30),
@@ -1495,8 +2506,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
+        self.client.login(username='testuser', password='testpassword')
         meal = Meal.objects.create(name = 'breakfast',
                                    date = datetime.date(2011, 01, 01),
                                    time = datetime.time(7, 30),
@@ -1562,8 +2573,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
+        self.client.login(username='testuser', password='testpassword')
         meal = Meal.objects.create(name = 'breakfast',
                                    date = datetime.date(2012, 01, 03), # Tuesday
                                    time = datetime.time(7, 30),
@@ -1647,8 +2658,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
+        self.client.login(username='testuser', password='testpassword')
         meal = Meal.objects.create(name = 'breakfast',
                                    date = datetime.date(2011, 01, 01),
                                    time = datetime.time(7, 30),
@@ -1668,6 +2679,16 @@ class FoodViewsTestCase(TestCase):
                                             time = datetime.time(7, 30),
                                             household = test_household,
                                             user = test_user)
+        # Another household's meals aren't shown or counted
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'otherpassword')
+        Meal.objects.create(name = 'breakfast',
+                            date = datetime.date(2011, 01, 01),
+                            time = datetime.time(8, 0),
+                            household = other_user.profile.household,
+                            user = other_user,
+                            calories = 500)
 
         response = self.client.get(reverse('meal_archive_day',
                                            kwargs={'year': 2011,
@@ -1712,8 +2733,7 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
         ingredient_one = Ingredient.objects.create(name = 'Test ingredient 1',
                                                    quantity = 100,
                                                    unit = 'g',
@@ -1742,6 +2762,7 @@ class FoodViewsTestCase(TestCase):
                                          meal = meal,
                                          quantity = 300)
 
+        self.client.login(username='testuser', password='testpassword')
         response = self.client.get(reverse('meal_detail',
                                            kwargs={'pk': meal.id}))
         self.assertEqual(response.status_code, 200)
@@ -1762,8 +2783,7 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser',
                                              'test@example.com',
                                              'testpassword')
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        test_household = test_user.profile.household
         ingredient_one = Ingredient.objects.create(name = 'Test ingredient 1',
                                                    quantity = 100,
                                                    unit = 'g',
@@ -1802,6 +2822,15 @@ class FoodViewsTestCase(TestCase):
                                                meal = extra_meal,
                                                quantity = 100)
 
+        # Other households can't delete the meal
+        User.objects.create_user('otheruser', 'other@example.com', 'otherpassword')
+        self.client.login(username='otheruser', password='otherpassword')
+        response = self.client.post(reverse('meal_delete',
+                                            kwargs={'pk': meal.id}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Meal.objects.count(), 2)
+
+        self.client.login(username='testuser', password='testpassword')
         response = self.client.get(reverse('meal_delete',
                                            kwargs={'pk': meal.id}))
         self.assertEqual(response.status_code, 200)
@@ -1838,9 +2867,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -2047,9 +3075,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -2405,9 +3432,8 @@ class FoodViewsTestCase(TestCase):
         test_user = User.objects.create_user('testuser', # username
                                              'test@example.com', # email
                                              'testpassword') # password
-        # Create a household
-        test_household = Household.objects.create(name = 'Test household',
-                                                  admin = test_user)
+        # The user's household (the views only show its dishes and meals)
+        test_household = test_user.profile.household
 
         # Login correctly
         response = self.client.post(reverse('login'),
@@ -2508,6 +3534,52 @@ class FoodViewsTestCase(TestCase):
         self.assertEqual(Meal.objects.count(), 2)
         self.assertEqual(Portion.objects.count(), 4)
 
+        # Duplicate a meal on every weekday for two weeks
+        response = self.client.post(reverse('meal_duplicate',
+                                            kwargs={'meal_id': old_meal.id}),
+                                    data={'date': datetime.date(2012, 01, 23),
+                                          'until': datetime.date(2012, 02, 05),
+                                          'weekdays': ['0', '1', '2', '3', '4']},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/meal_detail.html')
+        self.assertEqual(response.context['meal'].date,
+                         datetime.date(2012, 01, 23))
+        new_meals = Meal.objects.filter(date__gte=datetime.date(2012, 01, 23))
+        self.assertEqual(new_meals.count(), 10)
+        self.assertFalse(new_meals.filter(date=datetime.date(2012, 01, 28)))
+        self.assertEqual(Portion.objects.count(), 4 + 20)
+        old_meal = Meal.objects.get(pk=old_meal.id)
+        for new_meal in new_meals:
+            self.assertEqual(new_meal.calories, old_meal.calories)
+            self.assertEqual(new_meal.portion_set.count(), 2)
+            self.assertEqual(new_meal.portion_set.get(comestible=ingredient_one).calories,
+                             old_portion_one.calories)
+
+        # Try to duplicate a meal until a date before the first date
+        response = self.client.post(reverse('meal_duplicate',
+                                            kwargs={'meal_id': old_meal.id}),
+                                    data={'date': datetime.date(2012, 01, 23),
+                                          'until': datetime.date(2012, 01, 22)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/meal_duplicate.html')
+        self.assertTrue(u"The last date can't be before the first date." in
+                                response.context['form'].non_field_errors())
+
+        # Try to duplicate a meal over a range without any of the chosen days
+        response = self.client.post(reverse('meal_duplicate',
+                                            kwargs={'meal_id': old_meal.id}),
+                                    data={'date': datetime.date(2012, 01, 23),
+                                          'until': datetime.date(2012, 01, 24),
+                                          'weekdays': ['6']},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/meal_duplicate.html')
+        self.assertTrue(u"None of these dates are on the chosen days of the week." in
+                                response.context['form'].non_field_errors())
+        self.assertEqual(Meal.objects.count(), 12)
+
         # Try to duplicate a meal which doesn't exist
         self.assertRaises(ObjectDoesNotExist, Meal.objects.get, pk=fake_pk)
         response = self.client.get(reverse('meal_duplicate',
@@ -2515,6 +3587,1186 @@ class FoodViewsTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, '404.html')
 
+    def test_meal_week_copy(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        # Meals in the week beginning Monday 2nd January 2012
+        for day in range(2, 9):
+            meal = Meal.objects.create(name = 'breakfast',
+                                       date = datetime.date(2012, 01, day),
+                                       time = datetime.time(7, 30),
+                                       household = test_household,
+                                       user = test_user)
+            meal.portion_set.create(comestible = ingredient, quantity = 100)
+            meal.portion_set.create(comestible = ingredient, quantity = 100 * day)
+        # A meal in another household, which shouldn't be copied
+        Meal.objects.create(name = 'lunch',
+                            date = datetime.date(2012, 01, 04),
+                            time = datetime.time(13, 0),
+                            household = other_user.profile.household,
+                            user = other_user)
+
+        response = self.client.get(reverse('meal_week_copy',
+                                           kwargs={'year': 2012, 'week': '1'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/meal_week_copy.html')
+        self.assertEqual(response.context['week'], datetime.date(2012, 01, 02))
+        self.assertIsInstance(response.context['form'], MealWeekCopyForm)
+
+        # A week can't be copied to itself
+        response = self.client.post(reverse('meal_week_copy',
+                                            kwargs={'year': 2012, 'week': '1'}),
+                                    data={'date': datetime.date(2012, 01, 05)})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/meal_week_copy.html')
+        self.assertTrue(response.context['form'].errors['date'])
+        self.assertEqual(Meal.objects.count(), 8)
+        self.assertRaises(ValueError, copy_week, datetime.date(2012, 01, 02),
+                          datetime.date(2012, 01, 02), test_household)
+
+        # Copy the week to the week after next (any date in the week will do)
+        response = self.client.post(reverse('meal_week_copy',
+                                            kwargs={'year': 2012, 'week': '1'}),
+                                    data={'date': datetime.date(2012, 01, 19)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'food/meal_archive_week.html')
+        self.assertEqual(response.context['week'], datetime.date(2012, 01, 16))
+        new_meals = Meal.objects.filter(date__range=(datetime.date(2012, 01, 16),
+                                                     datetime.date(2012, 01, 22)))
+        self.assertEqual(new_meals.count(), 7)
+        for new_meal in new_meals:
+            old_meal = Meal.objects.get(date=new_meal.date - datetime.timedelta(weeks=2),
+                                        household=test_household)
+            self.assertEqual(new_meal.calories, old_meal.calories)
+            self.assertEqual(new_meal.time, old_meal.time)
+            self.assertEqual(new_meal.user, test_user)
+            self.assertEqual(sorted(p.quantity for p in new_meal.portion_set.all()),
+                             sorted(p.quantity for p in old_meal.portion_set.all()))
+        self.assertEqual(get_sum_day_calories(datetime.date(2012, 01, 16)),
+                         get_sum_day_calories(datetime.date(2012, 01, 02)))
+
+        # The same thing from the management command, for one user
+        call_command('copy_week', '2012-01-04', '2012-01-25', user='testuser')
+        self.assertEqual(Meal.objects.filter(date__range=(datetime.date(2012, 01, 23),
+                                                          datetime.date(2012, 01, 29))).count(),
+                         7)
+        self.assertEqual(Portion.objects.count(), 3 * 14)
+
+        # Try to copy from a week which doesn't exist
+        response = self.client.get(reverse('meal_week_copy',
+                                           kwargs={'year': 2012, 'week': '60'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_views_without_household(self):
+        # A user without a profile has no household, so can't see or change
+        # any household's dishes and meals (not everyone's)
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'testpassword')
+        other_household = other_user.profile.household
+        dish = Dish.objects.create(name = 'Test dish', quantity = 100,
+                                   unit = 'g', household = other_household)
+        meal = Meal.objects.create(name = 'lunch',
+                                   date = datetime.date(2012, 01, 04),
+                                   time = datetime.time(13, 0),
+                                   household = other_household,
+                                   user = other_user)
+        Profile.objects.filter(user=test_user).delete()
+        cache.delete(profile_cache_key(test_user.id))
+        self.client.login(username='testuser', password='testpassword')
+
+        for url in (reverse('dish_add'),
+                    reverse('dish_edit', kwargs={'dish_id': dish.id}),
+                    reverse('meal_add'),
+                    reverse('meal_edit', kwargs={'meal_id': meal.id})):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.post(reverse('meal_add'),
+                                    data={'name': 'lunch',
+                                          'date': '2012-01-05',
+                                          'time': '13:00',
+                                          'household': other_household.id,
+                                          'user': other_user.id})
+        self.assertEqual(response.status_code, 404)
+
+        url = reverse('meal_week_copy', kwargs={'year': 2012, 'week': '1'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.post(url, data={'date': datetime.date(2012, 01, 11)})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Meal.objects.count(), 1)
+        self.assertEqual(copy_week(datetime.date(2012, 01, 02),
+                                   datetime.date(2012, 01, 9), None), [])
+        form = MealForm()
+        limit_to_household(form, None)
+        self.assertEqual(list(form.fields['household'].queryset), [])
+        self.assertEqual(list(form.fields['user'].queryset), [])
+
+    def test_meal_export(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'testpassword')
+        # Put the other user in the same household
+        other_user.profile.household = test_household
+        other_user.profile.save()
+
+        # Needs login
+        response = self.client.get(reverse('meal_export',
+                                           kwargs={'format': 'csv'}))
+        self.assertEqual(response.status_code, 302)
+        self.client.login(username='testuser', password='testpassword')
+
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        dish = Dish.objects.create(name = 'Test dish',
+                                   quantity = 500,
+                                   date_cooked = datetime.date(2012, 01, 18),
+                                   household = test_household,
+                                   unit = 'g')
+        dish.amount_set.create(contained_comestible = ingredient,
+                               quantity = 500)
+        # Created out of order, to check that they're exported in order
+        lunch = Meal.objects.create(name = 'lunch',
+                                    date = datetime.date(2012, 01, 18),
+                                    time = datetime.time(13, 0),
+                                    household = test_household,
+                                    user = test_user)
+        lunch.portion_set.create(comestible = dish, quantity = 200)
+        lunch.portion_set.create(comestible = ingredient, quantity = 100)
+        breakfast = Meal.objects.create(name = 'breakfast',
+                                        date = datetime.date(2012, 01, 18),
+                                        time = datetime.time(7, 30),
+                                        household = test_household,
+                                        user = test_user)
+        Meal.objects.create(name = 'dinner',
+                            date = datetime.date(2012, 01, 17),
+                            time = datetime.time(19, 0),
+                            household = test_household,
+                            user = other_user)
+
+        response = self.client.get(reverse('meal_export',
+                                           kwargs={'format': 'csv'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(response.content.splitlines()))
+        self.assertEqual(rows[0], ['date', 'time', 'meal', 'user',
+                                   'meal calories', 'comestible', 'quantity',
+                                   'unit', 'calories'])
+        self.assertEqual([row[2] for row in rows[1:]],
+                         ['breakfast', 'lunch', 'lunch'])
+        self.assertEqual(rows[2][5:], ['Test dish', '200', 'g', '150'])
+        self.assertEqual(rows[3][5:], ['Test ingredient', '100', 'g', '75'])
+        self.assertEqual(rows[2][4], '225')
+
+        # The whole household's meals, as JSON Lines
+        response = self.client.get(reverse('meal_export',
+                                           kwargs={'format': 'jsonl'}),
+                                   {'household': 1})
+        self.assertEqual(response.status_code, 200)
+        meals = [simplejson.loads(line) for line in response.content.splitlines()]
+        self.assertEqual([(meal['meal'], meal['user']) for meal in meals],
+                         [('dinner', 'otheruser'), ('breakfast', 'testuser'),
+                          ('lunch', 'testuser')])
+        self.assertEqual(meals[2]['date'], '2012-01-18')
+        self.assertEqual(meals[2]['portions'][0]['comestible'], 'Test dish')
+        self.assertEqual(meals[1]['portions'], [])
+
+        # Meals are read a chunk at a time, in order, without missing any
+        meals = Meal.objects.filter(household=test_household)
+        self.assertEqual([meal.name for meal, portions in iter_meals(meals, chunk_size=1)],
+                         ['dinner', 'breakfast', 'lunch'])
+        with self.assertNumQueries(2 * 2 + 1):
+            list(iter_meals(meals, chunk_size=2))
+
+        # And from the management command
+        output = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('export_meals', user='otheruser', format='jsonl',
+                     output=output.name)
+        lines = open(output.name).read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(simplejson.loads(lines[0])['meal'], 'dinner')
+
+    def test_comestible_search(self):
+        # The index is kept by the process, so start from an empty one
+        search_index.clear()
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        for name in ['Broccoli', 'Broccoli soup', 'Carrot', 'Carrot cake',
+                     'Rice, brown']:
+            Ingredient.objects.create(name = name, quantity = 100,
+                                      unit = 'g', calories = 50)
+        dish = Dish.objects.create(name = 'Brocolli bake',
+                                   quantity = 500,
+                                   household = test_user.profile.household,
+                                   unit = 'g')
+        self.client.login(username='testuser', password='testpassword')
+
+        # Typos still match, and the closest name comes first
+        response = self.client.get(reverse('comestible_search'),
+                                   {'q': 'brocoli'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['name'] for result in response.context['results']],
+                         ['Broccoli', 'Brocolli bake', 'Broccoli soup'])
+        self.assertEqual(response.context['results'][1]['url'],
+                         reverse('dish_detail', args=[dish.id]))
+        self.assertEqual(search_index.search('carrot')[0][1], 'Carrot')
+        self.assertEqual(search_index.search('BROWN rice')[0][1], 'Rice, brown')
+        self.assertEqual(search_index.search('xyz'), [])
+        self.assertEqual(search_index.search('  '), [])
+
+        # Only ingredients or dishes
+        response = self.client.get(reverse('comestible_search_json'),
+                                   {'q': 'brocoli', 'type': 'dish'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        results = simplejson.loads(response.content)
+        self.assertEqual([(result['name'], result['type']) for result in results],
+                         [('Brocolli bake', 'dish')])
+
+        # Other households only find the ingredients
+        other_user = User.objects.create_user('otheruser',
+                                              'other@example.com',
+                                              'otherpassword')
+        self.assertEqual([result[1] for result in search_index.search(
+                              'brocoli', household=other_user.profile.household)],
+                         ['Broccoli', 'Broccoli soup'])
+        self.assertEqual([result[1] for result in search_index.search(
+                              'brocoli', household=test_user.profile.household)],
+                         ['Broccoli', 'Brocolli bake', 'Broccoli soup'])
+
+        # The index follows renames, deletions and new comestibles, including
+        # those inserted without signals
+        broccoli = Ingredient.objects.get(name='Broccoli')
+        broccoli.name = 'Green broccoli'
+        broccoli.save()
+        Ingredient.objects.get(name='Carrot').delete()
+        insert_without_signals(Ingredient(name='Carrots', quantity=100,
+                                          unit='g', calories=40, is_dish=False))
+        names = [result[1] for result in search_index.search('brocoli')]
+        self.assertTrue('Green broccoli' in names)
+        self.assertFalse('Broccoli' in names)
+        self.assertEqual([result[1] for result in search_index.search('carrot')],
+                         ['Carrot cake', 'Carrots'])
+
+
+    def test_query_budgets(self):
+        reset_stats()
+        old_budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        settings.QUERY_BUDGETS = {'dish_list': {'queries': 0}}
+        self.addCleanup(setattr, settings, 'QUERY_BUDGETS', old_budgets)
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('food.query_budget')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(setattr, logger, 'propagate', True)
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+        # Going over budget is logged with the SQL
+        response = self.client.get(reverse('dish_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(messages), 1)
+        self.assertTrue('/food/dishes/ went over its budget with' in messages[0])
+        self.assertTrue('SELECT' in messages[0])
+
+        # Staying within it isn't, but both are counted
+        self.client.get(reverse('ingredient_list'))
+        self.assertEqual(len(messages), 1)
+        stats = view_stats()
+        self.assertEqual(stats['dish_list']['requests'], 1)
+        self.assertEqual(stats['dish_list']['over_budget'], 1)
+        self.assertTrue(stats['dish_list']['max_queries'] > 0)
+        self.assertEqual(stats['ingredient_list']['over_budget'], 0)
+
+        # Repeated SQL is counted
+        request_stats = RequestStats('dish_detail', [
+            {'sql': 'SELECT 1', 'time': '0.010'},
+            {'sql': 'SELECT 2', 'time': '0.020'},
+            {'sql': 'SELECT 1', 'time': '0.010'}], 0.5)
+        self.assertEqual((request_stats.queries, request_stats.duplicates),
+                         (3, 1))
+        self.assertEqual(request_stats.over_budget({'queries': 3, 'time': 1}), [])
+        self.assertEqual(len(request_stats.over_budget({'db_time': 0.03})), 1)
+
+        # The aggregates are only shown to staff
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(response.status_code, 302)
+        test_user.is_staff = True
+        test_user.save()
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(simplejson.loads(response.content)['dish_list']['requests'], 1)
+
+    def test_profiling(self):
+        old_profiling = getattr(settings, 'FOOD_PROFILING', False)
+        settings.FOOD_PROFILING = True
+        self.addCleanup(setattr, settings, 'FOOD_PROFILING', old_profiling)
+        old_dir = profiling.PROFILE_DIR
+        profiling.PROFILE_DIR = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiling.PROFILE_DIR)
+        self.addCleanup(setattr, profiling, 'PROFILE_DIR', old_dir)
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Carrot', quantity = 100,
+                                               unit = 'g', calories = 40)
+        dish = Dish.objects.create(name = 'Soup', quantity = 500,
+                                   household = household, unit = 'g')
+        Amount.objects.create(containing_dish = dish,
+                              contained_comestible = ingredient, quantity = 300)
+        meal = Meal.objects.create(name = 'lunch', time = datetime.time(13, 0),
+                                   household = household, user = test_user)
+        Portion.objects.create(meal = meal, comestible = dish, quantity = 250)
+        self.client.login(username='testuser', password='testpassword')
+
+        # Only staff users' requests are profiled
+        self.client.get(reverse('meal_detail', args=[meal.id]), {'profile': '1'})
+        self.assertEqual(profiling.recent_profiles(), [])
+        test_user.is_staff = True
+        test_user.save()
+        response = self.client.get(reverse('meal_detail', args=[meal.id]),
+                                   {'profile': '1'})
+        self.assertContains(response, 'Soup')
+        summaries = profiling.recent_profiles()
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0]['view'], 'meal_detail')
+        self.assertTrue(summaries[0]['query_count'] > 0)
+        self.assertTrue(summaries[0]['functions'])
+        self.assertTrue(os.path.exists(os.path.join(profiling.PROFILE_DIR,
+                                                    summaries[0]['name'] + '.prof')))
+
+        # The header needs the right token, and the cascade of saves is traced
+        url = reverse('ingredient_edit', args=[ingredient.id])
+        data = {'name': 'Carrot', 'quantity': '100', 'unit': 'g', 'calories': '50'}
+        self.client.post(url, data, HTTP_X_FOOD_PROFILE='wrong')
+        self.assertEqual(len(profiling.recent_profiles()), 1)
+        self.client.post(url, data,
+                         HTTP_X_FOOD_PROFILE=profiling.profile_token('testuser'))
+        summary = profiling.recent_profiles()[0]
+        self.assertEqual((summary['method'], summary['status']), ('POST', 302))
+        self.assertEqual([(signal['action'], signal['model'], signal['level'])
+                          for signal in summary['signals']],
+                         [('save', 'Ingredient', 0), ('save', 'Amount', 1),
+                          ('save', 'Dish', 2), ('save', 'Portion', 3),
+                          ('save', 'Meal', 4)])
+        output = StringIO()
+        call_command('list_profiles', summary['name'], stdout=output)
+        self.assertTrue('        save Portion' in output.getvalue())
+
+        # Only the most recent profiles are kept
+        profiling.rotate_profiles(keep=1)
+        self.assertEqual([summary['name'] for summary in profiling.recent_profiles()],
+                         [summary['name']])
+        self.assertEqual(len(os.listdir(profiling.PROFILE_DIR)), 2)
+
+    def test_metrics(self):
+        def metric_values():
+            # {line before the value: value} from /metrics
+            response = self.client.get(reverse('metrics'))
+            self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+            return dict(line.rsplit(' ', 1) for line in response.content.splitlines()
+                        if not line.startswith('#'))
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Carrot', quantity = 100,
+                                               unit = 'g', calories = 40)
+        dish = Dish.objects.create(name = 'Soup', quantity = 500,
+                                   household = household, unit = 'g')
+        Amount.objects.create(containing_dish = dish,
+                              contained_comestible = ingredient, quantity = 300)
+        meal = Meal.objects.create(name = 'lunch', time = datetime.time(13, 0),
+                                   household = household, user = test_user)
+        Portion.objects.create(meal = meal, comestible = dish, quantity = 250)
+        self.client.login(username='testuser', password='testpassword')
+        before = metric_values()
+
+        # Requests are timed and counted by view, and so are cache lookups
+        self.client.get(reverse('meal_detail', args=[meal.id]))
+        self.client.get(reverse('meal_detail', args=[meal.id]))
+        # and the saves of an ingredient's amount, dish, portion and meal
+        self.client.post(reverse('ingredient_edit', args=[ingredient.id]),
+                         {'name': 'Carrot', 'quantity': '100', 'unit': 'g',
+                          'calories': '50'})
+        after = metric_values()
+        def increase(name):
+            return float(after[name]) - float(before.get(name, 0))
+        self.assertEqual(increase('food_request_duration_seconds_count{view="meal_detail"}'), 2)
+        self.assertEqual(increase('food_request_queries_count{view="meal_detail"}'), 2)
+        # (the version is looked up for the ETag and for the content)
+        self.assertEqual(increase('food_detail_cache_lookups_total{kind="meal",result="miss"}'), 1)
+        self.assertEqual(increase('food_detail_cache_lookups_total{kind="meal",result="hit"}'), 3)
+        for model in ['amount', 'dish', 'portion', 'meal']:
+            self.assertEqual(increase('food_cascade_saves_total{model="%s"}' % model), 1)
+        self.assertEqual(increase('food_request_cascade_saves_sum{view="ingredient_edit"}'), 4)
+        self.assertEqual(increase('food_request_cascade_saves_bucket{view="ingredient_edit",le="5"}'), 1)
+        self.assertEqual(increase('food_request_cascade_saves_bucket{view="ingredient_edit",le="2"}'), 0)
+
+        # Other processes' metrics are added from their files
+        old_dir = metrics.METRICS_DIR
+        metrics.METRICS_DIR = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics.METRICS_DIR)
+        self.addCleanup(setattr, metrics, 'METRICS_DIR', old_dir)
+        metrics.write_process_file()
+        own_file = metrics._process_file()
+        def other_file(pid, token):
+            path = os.path.join(metrics.METRICS_DIR, 'metrics-%s-%s.json' % (pid, token))
+            shutil.copy(own_file, path)
+            return path
+        def dish_saves():
+            return float(metric_values()['food_cascade_saves_total{model="dish"}'])
+        saves = float(after['food_cascade_saves_total{model="dish"}'])
+        other_file(os.getppid(), 'running')
+        self.assertEqual(dish_saves(), 2 * saves)
+
+        # Exited processes' files are added into one file and deleted
+        process = subprocess.Popen(['true'])
+        process.wait()
+        exited_path = other_file(process.pid, 'exited')
+        self.assertEqual(dish_saves(), 3 * saves)
+        self.assertFalse(os.path.exists(exited_path))
+        self.assertEqual(dish_saves(), 3 * saves)
+        # (not again if the file wasn't deleted)
+        other_file(process.pid, 'exited')
+        self.assertEqual(dish_saves(), 3 * saves)
+        self.assertFalse(os.path.exists(exited_path))
+        # A later process with the same pid has a file of its own
+        other_file(process.pid, 'reused')
+        self.assertEqual(dish_saves(), 4 * saves)
+        self.assertEqual(sorted(os.path.basename(path) for path, pid in metrics._process_files()),
+                         sorted([os.path.basename(own_file),
+                                 'metrics-%s-running.json' % os.getppid()]))
+
+        # Only for internal addresses
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_slow_query_log(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        Meal.objects.create(name = 'lunch', date = datetime.date(2011, 3, 4),
+                            time = datetime.time(13, 0),
+                            household = test_user.profile.household,
+                            user = test_user)
+        self.client.login(username='testuser', password='testpassword')
+        # Log every query
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        log_path = os.path.join(log_dir, 'slow.log')
+        handler = SlowQueryHandler(log_path, threshold=0)
+        db_logger = logging.getLogger('django.db.backends')
+        old_level = db_logger.level
+        db_logger.setLevel(logging.DEBUG)
+        db_logger.addHandler(handler)
+        try:
+            response = self.client.get(reverse('meal_archive_day',
+                                               args=['2011', '03', '04']))
+        finally:
+            db_logger.removeHandler(handler)
+            db_logger.setLevel(old_level)
+            handler.close()
+        self.assertEqual(response.status_code, 200)
+
+        # Each query is logged with its view and the code which made it
+        entries = read_entries(log_path)
+        self.assertTrue(entries)
+        meal_queries = [entry for entry in entries if 'food_meal' in entry['sql']]
+        self.assertTrue(meal_queries)
+        for entry in meal_queries:
+            self.assertEqual(entry['view'], 'meal_archive_day')
+        self.assertTrue([entry for entry in meal_queries
+                         if [frame for frame in entry['stack']
+                             if frame.startswith('food/views.py:')]])
+        self.assertFalse([frame for entry in entries for frame in entry['stack']
+                          if frame.startswith('food/middleware.py:')])
+
+        # and the same statements with different values are grouped
+        self.assertEqual(normalise_sql("SELECT * FROM t WHERE a = 'x''s' AND b IN (1, 2.5)"),
+                         "SELECT * FROM t WHERE a = ? AND b IN (...)")
+        statements = summarise(entries)
+        self.assertEqual(sum(statement['count'] for statement in statements),
+                         len(entries))
+        self.assertEqual([statement['total'] for statement in statements],
+                         sorted([statement['total'] for statement in statements],
+                                reverse=True))
+
+        output = StringIO()
+        call_command('slow_query_report', log_path, limit=3, stdout=output)
+        self.assertTrue(output.getvalue().startswith('%s slow queries, %s statements\n'
+                                                     % (len(entries), len(statements))))
+        self.assertEqual(output.getvalue().count(' runs '), min(3, len(statements)))
+        self.assertTrue('view meal_archive_day' in output.getvalue())
+
+
+
+# Data sizes the query counts of every view are checked at: the number of
+# ingredients, of amounts in a dish, of portions in a meal, and of meals on a
+# day (see QueryCountTestCase.make_data)
+QUERY_COUNT_SIZES = (1, 10, 100)
+
+# The expected number of queries for a GET of each named URL in food/urls.py
+# and accounts/urls.py, at each of QUERY_COUNT_SIZES. A single number means
+# the count mustn't depend on the size of the data; the others grow with it,
+# and should become single numbers as they're fixed. Views showing dishes or
+# meals look up the user's profile and household first, with one query as the
+# cache is cleared before each request (see accounts/middleware.py).
+EXPECTED_QUERY_COUNTS = {
+    'food_index': 2,
+    'login': 5,
+    'logout': 8,
+    'ingredient_list': 3,
+    'ingredient_add': 2,
+    'ingredient_detail': 6,
+    'ingredient_edit': 3,
+    'ingredient_delete': 3,
+    'ingredient_uses': 7,
+    'ingredient_manage': 4,
+    'dish_list': 4,
+    # Every amount form's select lists every comestible, and each option's
+    # label looks up the ingredient or dish of the comestible
+    'dish_add': {1: 24, 10: 132, 100: 1212},
+    'dish_detail': 9,
+    'dish_edit': {1: 30, 10: 345, 100: 21315},
+    'dish_multiply': 4,
+    'dish_duplicate': 4,
+    'dish_delete': 4,
+    'comestible_search': 5,
+    'comestible_search_json': 5,
+    'query_stats': 2,
+    # The same as for the dish forms
+    'meal_add': {1: 24, 10: 132, 100: 1212},
+    'meal_edit': {1: 28, 10: 343, 100: 21313},
+    'meal_duplicate': 5,
+    'meal_week_copy': 3,
+    'meal_export': 6,
+    'meal_archive': 7,
+    'meal_archive_year': 9,
+    # (a query per day of each week in the month; see get_avg_week_calories)
+    'meal_archive_month': 54,
+    'meal_archive_week': 19,
+    # Each meal's portions are fetched separately
+    'meal_archive_day': {1: 23, 10: 68, 100: 518},
+    'meal_list': 4,
+    'meal_detail': 6,
+    'meal_delete': 4,
+    'profile_detail': 3,
+    # (the household's members and the dashboard's four summary tables; see
+    # food/dashboard.py)
+    'household_detail': 9,
+    # (the user's profile, the household, and the user's other households)
+    'household_merge': 4,
+}
+
+
+class QueryCountTestCase(TestCase):
+    def make_data(self, size):
+        """
+        Creates a logged in user, size ingredients, a dish with an amount of
+        each of them, a meal with a portion of each of them, size more
+        meals on the same day with a portion of the dish each, and size - 1
+        other dishes, and size dishes and meals of another household. Returns
+        the arguments of each named URL.
+        """
+        user = User.objects.create_user('testuser', 'test@example.com',
+                                        'testpassword')
+        user.is_staff = True
+        user.save()
+        household = user.profile.household
+        date = datetime.date(2012, 3, 14)
+        ingredients = [Ingredient.objects.create(name='Ingredient %s' % number,
+                                                 quantity=100, unit='g',
+                                                 calories=50 + number)
+                       for number in range(size)]
+        dish = Dish.objects.create(name='Stew', quantity=10 * size,
+                                   household=household, unit='g',
+                                   date_cooked=date)
+        dish.cooks.add(user)
+        for ingredient in ingredients:
+            Amount.objects.create(containing_dish=dish,
+                                  contained_comestible=ingredient, quantity=10)
+        for number in range(size - 1):
+            Dish.objects.create(name='Other dish %s' % number, quantity=100,
+                                household=household, unit='g', date_cooked=date)
+        meal = Meal.objects.create(name='lunch', date=date,
+                                   time=datetime.time(13, 0),
+                                   household=household, user=user)
+        for ingredient in ingredients:
+            Portion.objects.create(meal=meal, comestible=ingredient, quantity=10)
+        for number in range(size):
+            dinner = Meal.objects.create(name='dinner', date=date,
+                                         time=datetime.time(19, 0),
+                                         household=household, user=user)
+            Portion.objects.create(meal=dinner, comestible=dish, quantity=1)
+        # Another household's dishes and meals, which mustn't make any
+        # difference to the counts
+        other_user = User.objects.create_user('otheruser', 'other@example.com',
+                                              'otherpassword')
+        for number in range(size):
+            other_dish = Dish.objects.create(name='Their dish %s' % number,
+                                             quantity=100, unit='g',
+                                             household=other_user.profile.household,
+                                             date_cooked=date)
+            Amount.objects.create(containing_dish=other_dish,
+                                  contained_comestible=ingredients[0], quantity=10)
+            other_meal = Meal.objects.create(name='dinner', date=date,
+                                             time=datetime.time(19, 0),
+                                             household=other_user.profile.household,
+                                             user=other_user)
+            Portion.objects.create(meal=other_meal, comestible=other_dish,
+                                   quantity=10)
+        self.client.login(username='testuser', password='testpassword')
+        year, month, day = '2012', '03', '14'
+        week = date.strftime('%W')
+        return {
+            'food_index': [], 'login': [],
+            'ingredient_list': [], 'ingredient_add': [],
+            'ingredient_detail': [ingredients[0].id],
+            'ingredient_edit': [ingredients[0].id],
+            'ingredient_delete': [ingredients[0].id],
+            'ingredient_uses': [ingredients[0].id],
+            'ingredient_manage': [],
+            'dish_list': [], 'dish_add': [],
+            'dish_detail': [dish.id], 'dish_edit': [dish.id],
+            'dish_multiply': [dish.id], 'dish_duplicate': [dish.id],
+            'dish_delete': [dish.id],
+            'comestible_search': [], 'comestible_search_json': [],
+            'query_stats': [],
+            'meal_add': [], 'meal_edit': [meal.id],
+            'meal_duplicate': [meal.id], 'meal_week_copy': [year, week],
+            'meal_export': ['csv'],
+            'meal_archive': [], 'meal_archive_year': [year],
+            'meal_archive_month': [year, month],
+            'meal_archive_week': [year, week],
+            'meal_archive_day': [year, month, day],
+            'meal_list': [], 'meal_detail': [meal.id], 'meal_delete': [meal.id],
+            'profile_detail': ['testuser'], 'household_detail': [household.id],
+            'household_merge': [household.id],
+            # (last, since it logs the user out)
+            'logout': [],
+        }
+
+    def clear_data(self):
+        Meal.objects.all().delete()
+        Dish.objects.all().delete()
+        Ingredient.objects.all().delete()
+        Household.objects.all().delete()
+        User.objects.all().delete()
+
+    def count_queries(self, name, args):
+        # Caches and the search index would otherwise be left over from the
+        # previous request
+        cache.clear()
+        search_index.clear()
+        Site.objects.clear_cache()
+        connection.use_debug_cursor = True
+        try:
+            response = self.client.get(reverse(name, args=args), {'q': 'ingredient'})
+            self.assertTrue(response.status_code in (200, 302),
+                            '%s returned %s' % (name, response.status_code))
+            # (meal_export's content is generated as it's read)
+            response.content
+            return len(connection.queries)
+        finally:
+            connection.use_debug_cursor = False
+
+    def test_query_counts(self):
+        # Every named URL has an expected count
+        names = set(pattern.name for pattern in food_urls.urlpatterns +
+                    accounts_urls.urlpatterns)
+        self.assertEqual(names, set(EXPECTED_QUERY_COUNTS))
+
+        counts = {}
+        for size in QUERY_COUNT_SIZES:
+            urls = self.make_data(size)
+            self.assertEqual(set(urls), names)
+            for name in sorted(urls, key=lambda name: name == 'logout'):
+                counts.setdefault(name, {})[size] = self.count_queries(name, urls[name])
+            self.clear_data()
+        for name, expected in sorted(EXPECTED_QUERY_COUNTS.items()):
+            if isinstance(expected, int):
+                expected = dict((size, expected) for size in QUERY_COUNT_SIZES)
+            self.assertEqual(counts[name], expected,
+                             '%s made %s queries (at each data size), not %s' % (
+                                 name, counts[name], expected))
+
+
+    def test_query_budgets(self):
+        # Every view with a budget fits in it, at least with the smallest data
+        for name, budget in sorted(settings.QUERY_BUDGETS.items()):
+            expected = EXPECTED_QUERY_COUNTS[name]
+            if not isinstance(expected, int):
+                expected = expected[QUERY_COUNT_SIZES[0]]
+            self.assertTrue(budget['queries'] >= expected,
+                            "%s's budget of %s queries is less than the %s it "
+                            "makes" % (name, budget['queries'], expected))
+
+
+class ImportIngredientsTestCase(TestCase):
+    def write_csv(self, content):
+        csv_file = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+        csv_file.write(content)
+        csv_file.close()
+        self.addCleanup(os.remove, csv_file.name)
+        return csv_file.name
+
+    def test_import_reference_file(self):
+        reference_file = os.path.join(os.path.dirname(__file__), os.pardir,
+                                      'ingredients-from-reference.csv')
+        call_command('import_ingredients', reference_file, batch_size=100,
+                     verbosity=0)
+        self.assertEqual(Ingredient.objects.count(), 231)
+        apples = Ingredient.objects.get(name='Apples')
+        self.assertEqual(apples.quantity, 100)
+        self.assertEqual(apples.calories, 52)
+        self.assertEqual(apples.unit, 'g')
+        self.assertFalse(apples.is_dish)
+        self.assertEqual(apples.comestible.child, apples)
+
+        # Importing it again doesn't change anything
+        call_command('import_ingredients', reference_file, verbosity=0)
+        self.assertEqual(Ingredient.objects.count(), 231)
+
+    def test_import_in_bulk(self):
+        """
+        Tests that a batch is saved with the same number of queries however
+        many rows it has, and that more ingredients than fit in one query's
+        parameters can be changed and recalculated.
+        """
+        def write_rows(count, calories, unit):
+            return self.write_csv('name,unit,quantity,calories\n' + ''.join(
+                'Ingredient %s,%s,100,%s\n' % (number, unit, calories)
+                for number in range(count)))
+
+        # (finding the existing ingredients, the comestibles' highest id, two
+        # INSERTs, and finding the new comestibles)
+        with self.assertNumQueries(5):
+            call_command('import_ingredients', write_rows(20, 50, 'g'),
+                         verbosity=0)
+        call_command('import_ingredients', write_rows(1200, 50, 'g'),
+                     batch_size=2000, verbosity=0)
+        self.assertEqual(Ingredient.objects.count(), 1200)
+        ingredient = Ingredient.objects.get(name='Ingredient 1199')
+        self.assertEqual((ingredient.calories, ingredient.unit, ingredient.is_dish),
+                         (50, 'g', False))
+        self.assertEqual(ingredient.comestible.child, ingredient)
+
+        call_command('import_ingredients', write_rows(1200, 60, 'ml'),
+                     batch_size=2000, verbosity=0)
+        ingredient = Ingredient.objects.get(name='Ingredient 1199')
+        self.assertEqual((ingredient.calories, ingredient.unit), (60, 'ml'))
+        self.assertEqual(Ingredient.objects.filter(calories=60).count(), 1200)
+
+        # With DEBUG on, each batch's queries aren't kept
+        settings.DEBUG = True
+        try:
+            call_command('import_ingredients', write_rows(30, 70, 'ml'),
+                         batch_size=10, verbosity=0)
+            self.assertTrue(len(connection.queries) < 30)
+        finally:
+            settings.DEBUG = False
+
+    def test_import_updates_and_errors(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        apples = Ingredient.objects.create(name = 'Apples',
+                                           quantity = 100,
+                                           unit = 'g',
+                                           calories = 50)
+        dish = Dish.objects.create(name = 'Apple sauce',
+                                   quantity = 500,
+                                   date_cooked = datetime.date(2012, 01, 18),
+                                   household = test_household,
+                                   unit = 'g')
+        dish.amount_set.create(contained_comestible = apples, quantity = 200)
+        meal = Meal.objects.create(name = 'dinner',
+                                   date = datetime.date(2012, 01, 18),
+                                   time = datetime.time(19, 0),
+                                   household = test_household,
+                                   user = test_user)
+        meal.portion_set.create(comestible = dish, quantity = 250)
+        self.assertEqual(Meal.objects.get(pk=meal.id).calories, 50)
+
+        csv_name = self.write_csv('name,unit,quantity,calories\n'
+                                  'Apples,g,100,60\n'
+                                  'Pears,g,100,55\n'
+                                  'Broken,g,0,-5\n'
+                                  'Eggs,dozen,1,70\n'
+                                  'Short row\n')
+        errors_name = self.write_csv('')
+
+        # A dry run doesn't change anything
+        call_command('import_ingredients', csv_name, dry_run=True, verbosity=0)
+        self.assertEqual(Ingredient.objects.count(), 1)
+        self.assertEqual(Ingredient.objects.get(pk=apples.id).calories, 50)
+
+        call_command('import_ingredients', csv_name, errors=errors_name,
+                     verbosity=0)
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertEqual(Ingredient.objects.get(pk=apples.id).calories, 60)
+        self.assertEqual(Ingredient.objects.get(name='Pears').calories, 55)
+        # Everything containing the changed ingredient was recalculated
+        self.assertEqual(Amount.objects.get(containing_dish=dish).calories, 120)
+        self.assertEqual(Dish.objects.get(pk=dish.id).calories, 120)
+        self.assertEqual(Portion.objects.get(meal=meal).calories, 60)
+        self.assertEqual(Meal.objects.get(pk=meal.id).calories, 60)
+
+        errors = list(csv.reader(open(errors_name)))
+        self.assertEqual(errors[0], ['line', 'errors', 'name', 'unit',
+                                     'quantity', 'calories'])
+        self.assertEqual([row[0] for row in errors[1:]], ['4', '5', '6'])
+        self.assertTrue('quantity: Enter a number greater than 0' in errors[1][1])
+        self.assertTrue('calories: Enter a number not less than 0' in errors[1][1])
+        self.assertTrue(errors[2][1].startswith('unit:'))
+
+        # (call_command reports CommandErrors and exits)
+        self.assertRaises(SystemExit, call_command, 'import_ingredients',
+                          self.write_csv('name,calories\nApples,60\n'))
+
+
+class DuplicateIngredientsTestCase(TestCase):
+    def create_ingredient(self, name, calories=100, unit='g'):
+        return Ingredient.objects.create(name=name, quantity=100,
+                                         calories=calories, unit=unit)
+
+    def test_normalise_name(self):
+        self.assertEqual(normalise_name(u'Apple, raw'), u'apple')
+        self.assertEqual(normalise_name(u'Apples'), u'apple')
+        self.assertEqual(normalise_name(u'Tomatoes (tinned)'), u'tinned tomato')
+        self.assertEqual(normalise_name(u'Cherries'), u'cherry')
+        self.assertEqual(normalise_name(u'Raw'), u'raw')
+
+    def test_find_duplicate_ingredients(self):
+        apples = self.create_ingredient('Apples')
+        raw_apple = self.create_ingredient('Apple, raw')
+        # (measured differently, so not a duplicate)
+        self.create_ingredient('Apple', unit='ml')
+        broccoli = self.create_ingredient('Broccoli')
+        brocoli = self.create_ingredient('Brocoli')
+        self.create_ingredient('Beef')
+        pairs = find_duplicate_ingredients()
+        self.assertEqual([(first[0], second[0]) for similarity, first, second in pairs],
+                         [(apples.id, raw_apple.id), (broccoli.id, brocoli.id)])
+        self.assertEqual(pairs[0][0], 1)
+        self.assertTrue(0.7 < pairs[1][0] < 1)
+
+    def test_merge_ingredients(self):
+        user = User.objects.create_user('testuser', 'test@example.com',
+                                        'testpassword')
+        household = user.profile.household
+        apples = self.create_ingredient('Apples', calories=50)
+        raw_apple = self.create_ingredient('Apple, raw', calories=60)
+        cherries = self.create_ingredient('Cherries', unit='items')
+        dish = Dish.objects.create(name='Crumble', quantity=400, unit='g',
+                                   household=household)
+        for ingredient in (apples, raw_apple):
+            Amount.objects.create(containing_dish=dish,
+                                  contained_comestible=ingredient, quantity=200)
+        meal = Meal.objects.create(name='lunch', date=datetime.date(2012, 3, 14),
+                                   time=datetime.time(12, 0),
+                                   household=household, user=user)
+        Portion.objects.create(meal=meal, comestible=raw_apple, quantity=100)
+        Portion.objects.create(meal=meal, comestible=dish, quantity=100)
+        self.assertRaises(ValueError, merge_ingredients, apples, [cherries.id])
+
+        merge_ingredients(apples, [raw_apple.id])
+        self.assertFalse(Ingredient.objects.filter(pk=raw_apple.id).exists())
+        self.assertFalse(Comestible.objects.filter(pk=raw_apple.id).exists())
+        self.assertEqual(Amount.objects.filter(contained_comestible=apples).count(), 2)
+        self.assertEqual(Portion.objects.filter(comestible=apples).count(), 1)
+        self.assertEqual(Dish.objects.get(pk=dish.id).calories, 200)
+        self.assertEqual(Meal.objects.get(pk=meal.id).calories, 100)
+        self.assertEqual(list(DishIngredient.objects.filter(dish=dish).values_list(
+                                  'ingredient', 'quantity')),
+                         [(apples.id, 400)])
+        self.assertEqual(list(MealIngredient.objects.filter(meal=meal).values_list(
+                                  'ingredient', 'quantity')),
+                         [(apples.id, 200)])
+        self.assertEqual(list(HouseholdIngredient.objects.values_list(
+                                  'household', 'ingredient', 'meals')),
+                         [(household.id, apples.id, 1)])
+        self.assertEqual(MemberDay.objects.get(user=user).calories, 100)
+
+        # (call_command reports CommandErrors and exits)
+        self.assertRaises(SystemExit, call_command, 'merge_ingredients',
+                          str(apples.id), str(raw_apple.id))
+
+    def test_merge_ingredients_archive_etag(self):
+        user = User.objects.create_user('testuser', 'test@example.com',
+                                        'testpassword')
+        household = user.profile.household
+        apple = self.create_ingredient('Apple')
+        raw_apples = self.create_ingredient('Apples raw')
+        dish = Dish.objects.create(name='Crumble', quantity=100, unit='g',
+                                   household=household)
+        Amount.objects.create(containing_dish=dish,
+                              contained_comestible=raw_apples, quantity=100)
+        meal = Meal.objects.create(name='lunch', date=datetime.date(2012, 1, 2),
+                                   time=datetime.time(12, 0),
+                                   household=household, user=user)
+        Portion.objects.create(meal=meal, comestible=raw_apples, quantity=100)
+        # (so that the merge is later, whatever the resolution of the clock)
+        an_hour_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+        Dish.objects.filter(pk=dish.id).update(updated_at=an_hour_ago)
+        Meal.objects.filter(pk=meal.id).update(updated_at=an_hour_ago)
+        day_url = reverse('meal_archive_day', kwargs={'year': '2012',
+                                                      'month': '01',
+                                                      'day': '02'})
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(day_url)
+        self.assertContains(response, 'Apples raw')
+        dish_version = get_detail_version('dish', dish.id)
+
+        # The ingredient has the same calories, so nothing else changes, but
+        # the page shows the ingredient kept instead
+        merge_ingredients(apple, [raw_apples.id])
+        response = self.client.get(day_url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Apples raw')
+        self.assertTrue(Dish.objects.get(pk=dish.id).updated_at > an_hour_ago)
+        self.assertNotEqual(get_detail_version('dish', dish.id), dish_version)
+
+    def test_merge_duplicates_search(self):
+        apples = self.create_ingredient('Apples')
+        raw_apple = self.create_ingredient('Apple, raw')
+        search_index.clear()
+        self.assertEqual(sorted(result[0] for result in search_index.search('apple')),
+                         [apples.id, raw_apple.id])
+
+        # The merged duplicate isn't found any more, without the index being
+        # rebuilt
+        merge_duplicates(apples, [raw_apple.id])
+        self.assertEqual([result[0] for result in search_index.search('apple')],
+                         [apples.id])
+        search_index.clear()
+
+
+class StandInConnection(object):
+    """
+    Stands in for a connection (from django.db.connections) to PostgreSQL or
+    a connection pooler, recording what's done with it.
+    """
+    class Connection(object):
+        closed = 0
+
+    def __init__(self, managed=False, error=None):
+        self.connection = self.Connection()
+        self.managed = managed
+        self.error = error
+        self.rollbacks = 0
+
+    def is_managed(self):
+        return self.managed
+
+    def _rollback(self):
+        if self.error:
+            raise self.error
+        self.rollbacks += 1
+
+    def close(self):
+        self.connection = None
+
+
+class PersistentConnectionsTestCase(TestCase):
+    def test_finish_connection(self):
+        """
+        Tests that connections are kept at the end of a request, with their
+        transactions rolled back, until they're too old or broken.
+        """
+        conn = StandInConnection()
+        finish_connection(conn, now=1000, max_age=60)
+        finish_connection(conn, now=1059, max_age=60)
+        self.assertEqual(conn.rollbacks, 2)
+        self.assertTrue(conn.connection)
+        finish_connection(conn, now=1060, max_age=60)
+        self.assertEqual(conn.connection, None)
+        # (None keeps connections until they break)
+        conn = StandInConnection()
+        finish_connection(conn, now=1000, max_age=None)
+        finish_connection(conn, now=100000, max_age=None)
+        self.assertEqual(conn.rollbacks, 2)
+        conn.connection.closed = 1
+        finish_connection(conn, now=100001, max_age=None)
+        self.assertEqual(conn.connection, None)
+        # A connection which can't be rolled back is closed
+        conn = StandInConnection(error=DatabaseError('server closed the connection'))
+        finish_connection(conn, now=1000, max_age=60)
+        self.assertEqual(conn.connection, None)
+        # Connections in managed transactions (like this test's) are left alone
+        conn = StandInConnection(managed=True)
+        finish_connection(conn, now=1000, max_age=0)
+        self.assertEqual((conn.rollbacks, bool(conn.connection)), (0, True))
+
+    def test_middleware(self):
+        # SQLite connections are left to Django
+        self.assertRaises(MiddlewareNotUsed, PersistentConnectionMiddleware)
+
+
+class BackupTestCase(TransactionTestCase):
+    # (a TransactionTestCase, so that a failed restore is really rolled back)
+    def test_backup_and_restore_household(self):
+        test_user = User.objects.create_user('testuser',
+                                             'test@example.com',
+                                             'testpassword')
+        test_household = test_user.profile.household
+        ingredient = Ingredient.objects.create(name = 'Test ingredient',
+                                               quantity = 100,
+                                               unit = 'g',
+                                               calories = 75)
+        inner_dish = Dish.objects.create(name = 'Inner dish',
+                                         quantity = 500,
+                                         date_cooked = datetime.date(2012, 01, 17),
+                                         household = test_household,
+                                         unit = 'g')
+        inner_dish.amount_set.create(contained_comestible = ingredient,
+                                     quantity = 500)
+        dish = Dish.objects.create(name = 'Test dish',
+                                   quantity = 1000,
+                                   date_cooked = datetime.date(2012, 01, 18),
+                                   household = test_household,
+                                   unit = 'g')
+        dish.cooks.add(test_user)
+        dish.amount_set.create(contained_comestible = inner_dish,
+                               quantity = 250)
+        dish.amount_set.create(contained_comestible = ingredient,
+                               quantity = 100)
+        meal = Meal.objects.create(name = 'dinner',
+                                   date = datetime.date(2012, 01, 18),
+                                   time = datetime.time(19, 0),
+                                   household = test_household,
+                                   user = test_user)
+        meal.portion_set.create(comestible = dish, quantity = 300)
+        meal.portion_set.create(comestible = ingredient, quantity = 50)
+        meal = Meal.objects.get(pk=meal.id)
+
+        backup = StringIO()
+        backup_household(test_household, backup)
+
+        # Restoring reuses the existing user and ingredient, and creates
+        # copies of everything else in a new household
+        backup.seek(0)
+        restored_household = restore_household(backup)
+        self.assertNotEqual(restored_household.id, test_household.id)
+        self.assertEqual(restored_household.name, test_household.name)
+        self.assertEqual(restored_household.admin, test_user)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(Ingredient.objects.count(), 1)
+        restored_dish = Dish.objects.get(household=restored_household,
+                                         name='Test dish')
+        restored_inner_dish = Dish.objects.get(household=restored_household,
+                                               name='Inner dish')
+        self.assertEqual(restored_dish.calories, Dish.objects.get(pk=dish.id).calories)
+        self.assertEqual(restored_dish.comestible.child, restored_dish)
+        self.assertEqual(list(restored_dish.cooks.all()), [test_user])
+        self.assertEqual(restored_dish.amount_set.get(
+                             contained_comestible=restored_inner_dish).quantity,
+                         250)
+        restored_meal = Meal.objects.get(household=restored_household)
+        self.assertEqual(restored_meal.calories, meal.calories)
+        self.assertEqual(restored_meal.time, meal.time)
+        self.assertEqual(restored_meal.portion_set.get(
+                             comestible=restored_dish).calories,
+                         meal.portion_set.get(comestible=dish).calories)
+
+        # Restore into an empty database (as if moving to another one)
+        Meal.objects.all().delete()
+        Dish.objects.all().delete()
+        Ingredient.objects.all().delete()
+        Profile.objects.all().delete()
+        Household.objects.all().delete()
+        User.objects.all().delete()
+        backup.seek(0)
+        restored_household = restore_household(backup)
+        self.assertEqual(restored_household.admin.username, 'testuser')
+        self.assertTrue(restored_household.admin.check_password('testpassword'))
+        self.assertEqual(Profile.objects.get().household, restored_household)
+        self.assertEqual(Household.objects.count(), 1)
+        self.assertEqual(Ingredient.objects.get().calories, 75)
+        self.assertEqual(Amount.objects.count(), 3)
+        self.assertEqual(Meal.objects.get().calories, meal.calories)
+
+        # A broken backup restores nothing
+        backup.seek(0)
+        broken_backup = StringIO(backup.read()[:-50])
+        self.assertRaises(BackupError, restore_household, broken_backup)
+        self.assertEqual(Household.objects.count(), 1)
+        self.assertRaises(BackupError, restore_household,
+                          StringIO('not a backup'))
+
+
+class BenchmarkTestCase(TestCase):
+    def test_generate_dataset_and_benchmark(self):
+        counts = generate_dataset(households=2, users_per_household=2,
+                                  ingredients=20, dishes=3, depth=2, fanout=3,
+                                  days=10, meals_per_day=3, portions_per_meal=2)
+        self.assertEqual(counts, {'households': 2, 'users': 4, 'ingredients': 20,
+                                  'dishes': 18, 'amounts': 54, 'meals': 120,
+                                  'portions': 240})
+        household = User.objects.get(username='bench1_1').profile.household
+        self.assertEqual(household.admin.username, 'bench1_0')
+        self.assertEqual(Household.objects.filter(name__startswith='bench').count(), 2)
+
+        # The calories are those that saving everything would have given
+        for dish in Dish.objects.all():
+            self.assertEqual(dish.calories,
+                             sum(amount.calories for amount in dish.amount_set.all()))
+            self.assertTrue(dish.get_remaining_quantity() >= 0)
+        meal = Meal.objects.filter(portion__comestible__is_dish=True)[0]
+        self.assertEqual(meal.calories,
+                         sum(portion.calories for portion in meal.portion_set.all()))
+        # and the ingredient index has been built
+        dish = meal.portion_set.get(comestible__is_dish=True).comestible.dish
+        # (up to 3 + 2 + 2 ingredients, some of which may be the same)
+        self.assertTrue(3 <= dish.ingredient_totals.count() <= 7)
+        self.assertTrue(meal.ingredient_totals.count() >= dish.ingredient_totals.count())
+
+        # Every benchmark runs, and leaves the data as it was
+        calories = dict(Dish.objects.values_list('pk', 'calories'))
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('bench_food', repeat=3, output=output.name)
+        results = simplejson.load(open(output.name))
+        self.assertEqual(sorted(results.keys()), sorted(BENCHMARKS))
+        for result in results.values():
+            self.assertEqual(result['runs'], 3)
+            self.assertTrue(result['min_queries'] > 0)
+            self.assertTrue(result['min_ms'] <= result['p50_ms'] <= result['max_ms'])
+        self.assertEqual(dict(Dish.objects.values_list('pk', 'calories')), calories)
+        self.assertEqual(percentile([3, 1, 2, 4], 50), 3)
+        self.assertEqual(percentile([3, 1, 2, 4], 99), 4)
+
 
 class DateViewsTestCase(TestCase):
     def test_get_sum_day_calories(self):
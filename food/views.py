@@ -2,21 +2,34 @@ import datetime
 import sys
 
 from django import forms
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.exceptions import ValidationError
 from django.shortcuts import HttpResponse, HttpResponseRedirect, render_to_response, get_object_or_404, redirect
 from django.template import RequestContext
-from django.http import Http404
-from django.views.generic import ListView, CreateView, DetailView, UpdateView, DeleteView, MonthArchiveView, WeekArchiveView, DayArchiveView
+from django.conf import settings
+from django.http import Http404, HttpResponseForbidden
+from django.views.generic import ListView, CreateView, DetailView, UpdateView, DeleteView, ArchiveIndexView, YearArchiveView, MonthArchiveView, WeekArchiveView, DayArchiveView
 from django.forms.models import modelformset_factory, BaseInlineFormSet, inlineformset_factory
+from django.core.urlresolvers import reverse
+from django.utils import simplejson
+from django.utils.http import urlencode
 from django.utils.decorators import method_decorator
 
-from food.models import validate_positive, Ingredient, Dish, DishForm, Amount, Meal, MealForm, Portion
+from food.caching import DETAIL_CACHE_TIMEOUT, get_detail_version
+from food.conditional import meal_range_condition, detail_condition
+from food.export import EXPORT_FORMATS, export_meals
+from food.households import HouseholdMixin, request_household, limit_to_household, limit_comestibles
+from food.metrics import render_metrics
+from food.middleware import view_stats
+from food.pagination import KeysetPage, KeysetPaginationMixin
+from food.search import search_index
+from food.models import validate_positive, Ingredient, Dish, DishForm, Amount, Meal, MealForm, Portion, DishIngredient, MealIngredient, copy_week
 
 
-class IngredientListView(ListView):
+class IngredientListView(KeysetPaginationMixin, ListView):
 
     model = Ingredient
+    keyset_ordering = ('name',)
 
 
 class IngredientCreateView(CreateView):
@@ -38,9 +51,11 @@ class IngredientDetailView(DetailView):
         # Call the base implementation first to get a context
         context = super(IngredientDetailView, self).get_context_data(**kwargs)
 
-        # Add in amounts and portions of the ingredient
-        amounts = Amount.objects.select_related("containing_dish", "contained_comestible").filter(contained_comestible__id=self.kwargs["pk"])
-        portions = Portion.objects.select_related("comestible", "meal").filter(comestible__id=self.kwargs["pk"])
+        # Add in amounts and portions of the ingredient (in the user's
+        # household's dishes and meals)
+        household = request_household(self.request)
+        amounts = Amount.objects.select_related("containing_dish", "contained_comestible").filter(contained_comestible__id=self.kwargs["pk"], containing_dish__in=Dish.objects.for_household(household))
+        portions = Portion.objects.select_related("comestible", "meal").filter(comestible__id=self.kwargs["pk"], meal__in=Meal.objects.for_household(household))
 
         context.update({
             "amounts": amounts,
@@ -69,25 +84,103 @@ class IngredientDeleteView(DeleteView):
         return super(IngredientDeleteView, self).dispatch(*args, **kwargs)
 
 
+class IngredientUsesForm(forms.Form):
+    # optional filters for the dishes and meals containing an ingredient
+    date_from = forms.DateField(label="From", required=False)
+    date_to = forms.DateField(label="To", required=False)
+    min_quantity = forms.DecimalField(label="At least", required=False,
+                                      validators=[validate_positive])
+
+def ingredient_uses(request, pk):
+    # Lists every dish and meal containing an ingredient, including through
+    # the dishes they contain, from the ingredient index (so with one query
+    # each for the dishes and the meals, however deeply they're nested), of
+    # the user's household
+    ingredient = get_object_or_404(Ingredient, pk=pk)
+    household = request_household(request)
+    dish_totals = DishIngredient.objects.filter(ingredient=ingredient,
+                      dish__in=Dish.objects.for_household(household)).select_related(
+                      'dish').order_by('-dish__date_cooked', '-dish')
+    meal_totals = MealIngredient.objects.filter(ingredient=ingredient,
+                      meal__in=Meal.objects.for_household(household)).select_related(
+                      'meal').order_by('-meal__date', '-meal__time')
+    form = IngredientUsesForm(request.GET)
+    if form.is_valid():
+        date_from = form.cleaned_data['date_from']
+        date_to = form.cleaned_data['date_to']
+        min_quantity = form.cleaned_data['min_quantity']
+        if date_from:
+            dish_totals = dish_totals.filter(dish__date_cooked__gte=date_from)
+            meal_totals = meal_totals.filter(meal__date__gte=date_from)
+        if date_to:
+            dish_totals = dish_totals.filter(dish__date_cooked__lte=date_to)
+            meal_totals = meal_totals.filter(meal__date__lte=date_to)
+        if min_quantity:
+            dish_totals = dish_totals.filter(quantity__gte=min_quantity)
+            meal_totals = meal_totals.filter(quantity__gte=min_quantity)
+
+    return render_to_response('food/ingredient_uses.html', {
+        'ingredient': ingredient,
+        'form': form,
+        'dish_totals': dish_totals,
+        'meal_totals': meal_totals,},
+        context_instance=RequestContext(request)
+    )
+
+
+# Number of ingredients shown (and bound) on each page of ingredient_manage
+INGREDIENT_MANAGE_PAGINATE_BY = 50
+
 @login_required
 def ingredient_manage(request):
     IngredientFormSet = modelformset_factory(Ingredient, extra=3)
+    # Only the ingredients on the current page (optionally filtered by the
+    # start of their names) go into the formset, so that rendering and
+    # validating it doesn't depend on the size of the whole Ingredient table.
+    # Pages are found by name, as in IngredientListView (see food.pagination).
+    # The page and search term come from the query string for both GET and
+    # POST (the form posts back to the same query string, and is redirected
+    # back to it).
+    search = request.GET.get('q', u'').strip()
+    ingredients = Ingredient.objects.all()
+    if search:
+        ingredients = ingredients.filter(name__istartswith=search)
+    try:
+        page = KeysetPage(ingredients, IngredientListView.keyset_ordering,
+                          INGREDIENT_MANAGE_PAGINATE_BY,
+                          after=request.GET.get('after'),
+                          before=request.GET.get('before'))
+    except ValueError:
+        raise Http404
+    # (the formset needs a queryset, rather than the page's list)
+    page_ingredients = Ingredient.objects.filter(
+        pk__in=[ingredient.pk for ingredient in page.object_list]).order_by(
+        *IngredientListView.keyset_ordering)
+    query_string = urlencode([(key, request.GET[key])
+                              for key in ('after', 'before', 'q')
+                              if request.GET.get(key)])
     if request.method == 'POST':
-        formset = IngredientFormSet(request.POST, request.FILES)
+        formset = IngredientFormSet(request.POST, request.FILES,
+                                    queryset=page_ingredients)
         if formset.is_valid():
             formset.save()
-            return HttpResponseRedirect('/food/ingredients/')
+            return HttpResponseRedirect('%s?%s' % (reverse('ingredient_manage'),
+                                                   query_string))
     else:
-        formset = IngredientFormSet()
+        formset = IngredientFormSet(queryset=page_ingredients)
     return render_to_response("food/ingredient_manage.html", {
-        "formset": formset,},
+        "formset": formset,
+        "page": page,
+        "search": search,
+        "query_string": query_string,},
         context_instance=RequestContext(request) # needed for csrf token
     )
 
 
-class DishListView(ListView):
+class DishListView(HouseholdMixin, KeysetPaginationMixin, ListView):
 
     model = Dish
+    keyset_ordering = ('-date_cooked', 'pk')
 
 
 @login_required
@@ -96,9 +189,13 @@ def dish_amounts_form(request, dish_id=None):
             # I think fk_name shouldn't be needed any more, since Amount
             #  now has only one fk to Dish, but it does need to be here...
             fk_name="containing_dish", extra=6)
+    household = request_household(request)
+    if household is None:
+        # (a user without a profile has no household to add dishes to)
+        raise Http404
     if dish_id:
         try:
-            dish = Dish.objects.get(pk=dish_id)
+            dish = Dish.objects.for_household(household).get(pk=dish_id)
         except Dish.DoesNotExist:
             raise Http404
     else:
@@ -106,6 +203,8 @@ def dish_amounts_form(request, dish_id=None):
     if request.method == 'POST':
         form = DishForm(request.POST, request.FILES, instance=dish)
         formset = DishFormSet(request.POST, request.FILES, instance=dish)
+        limit_to_household(form, household)
+        limit_comestibles(formset, 'contained_comestible', household)
         if form.is_valid() and formset.is_valid():
             # dish can't calculate calories from amounts until they're saved...
             # but amounts need dish to be there first for fk...
@@ -119,6 +218,8 @@ def dish_amounts_form(request, dish_id=None):
     else:
         form = DishForm(instance=dish)
         formset = DishFormSet(instance=dish)
+        limit_to_household(form, household)
+        limit_comestibles(formset, 'contained_comestible', household)
     return render_to_response("food/dish_edit.html", {
         "form": form,
         "formset": formset,
@@ -127,11 +228,15 @@ def dish_amounts_form(request, dish_id=None):
     )
 
 
-class DishDetailView(DetailView):
+class DishDetailView(HouseholdMixin, DetailView):
 
     # prefetch_related could also get cooks - needs django 1.4, though
     queryset=Dish.objects.select_related("household").all()
 
+    @method_decorator(detail_condition('dish'))
+    def dispatch(self, *args, **kwargs):
+        return super(DishDetailView, self).dispatch(*args, **kwargs)
+
     def get_context_data(self, **kwargs):
 
         # Call the base implementation first to get a context
@@ -145,16 +250,47 @@ class DishDetailView(DetailView):
         # dish.get_remaining_quantity in the template makes another query on
         # Portion which duplicates part of portions_of_dish here - not sure that
         # this can be avoided...
+        # (None of these querysets are evaluated when the template's cached
+        # content is up to date)
 
         context.update({
             "comestibles_in_dish": comestibles_in_dish,
             "portions_of_dish": portions_of_dish,
             "amounts_of_dish": amounts_of_dish,
+            "cache_timeout": DETAIL_CACHE_TIMEOUT,
+            "cache_version": get_detail_version('dish', self.object.id),
+            # naturalday in the content depends on the date
+            "today": datetime.date.today(),
+        })
+        return context
+
+
+class MealDetailView(HouseholdMixin, DetailView):
+
+    queryset=Meal.objects.select_related("user")
+
+    @method_decorator(detail_condition('meal'))
+    def dispatch(self, *args, **kwargs):
+        return super(MealDetailView, self).dispatch(*args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+
+        # Call the base implementation first to get a context
+        context = super(MealDetailView, self).get_context_data(**kwargs)
+
+        # Only evaluated when the template's cached content is out of date
+        portions = Portion.objects.select_related("comestible__ingredient", "comestible__dish").filter(meal__id=self.kwargs["pk"])
+
+        context.update({
+            "portions": portions,
+            "cache_timeout": DETAIL_CACHE_TIMEOUT,
+            "cache_version": get_detail_version('meal', self.object.id),
+            "today": datetime.date.today(),
         })
         return context
 
 
-class DishDeleteView(DeleteView):
+class DishDeleteView(HouseholdMixin, DeleteView):
 
     model=Dish
     success_url="/food/dishes/"
@@ -217,9 +353,13 @@ class BaseMealInlineFormSet(BaseInlineFormSet):
 def meal_portions_form(request, meal_id=None):
     MealFormSet = inlineformset_factory(Meal, Portion, extra=6,
                                         formset=BaseMealInlineFormSet)
+    household = request_household(request)
+    if household is None:
+        # (a user without a profile has no household to add meals to)
+        raise Http404
     if meal_id:
         try:
-            meal = Meal.objects.get(pk=meal_id)
+            meal = Meal.objects.for_household(household).get(pk=meal_id)
         except Meal.DoesNotExist:
             raise Http404
     else:
@@ -227,6 +367,8 @@ def meal_portions_form(request, meal_id=None):
     if request.method == 'POST':
         form = MealForm(request.POST, request.FILES, instance=meal)
         formset = MealFormSet(request.POST, request.FILES, instance=meal)
+        limit_to_household(form, household)
+        limit_comestibles(formset, 'comestible', household)
         if form.is_valid() and formset.is_valid():
             # meal can't calculate calories from portions until they're saved...
             # but portions need meal to be there first for fk...
@@ -240,6 +382,8 @@ def meal_portions_form(request, meal_id=None):
     else:
         form = MealForm(instance=meal)
         formset = MealFormSet(instance=meal)
+        limit_to_household(form, household)
+        limit_comestibles(formset, 'comestible', household)
     return render_to_response("food/meal_edit.html", {
         "form": form,
         "formset": formset,
@@ -248,40 +392,57 @@ def meal_portions_form(request, meal_id=None):
     )
 
 class DishMultiplyForm(forms.Form):
-    # form for entry/selection of multiplication factor for amounts
+    # form for entry/selection of multiplication factor for amounts, or of a
+    # target quantity or calories for the whole dish
     OPERATION_CHOICES = (
         ('multiply', 'multiply'),
         ('divide', 'divide'),
+        ('quantity', 'scale to quantity'),
+        ('calories', 'scale to calories'),
     )
     operation = forms.ChoiceField(choices=OPERATION_CHOICES, initial='multiply')
     factor = forms.DecimalField(validators=[validate_positive])
 
+    def __init__(self, *args, **kwargs):
+        self.dish = kwargs.pop('dish', None)
+        super(DishMultiplyForm, self).__init__(*args, **kwargs)
+
+    def clean(self):
+        """
+        Converts the operation and factor into the factor to multiply the dish
+        by (a target quantity or calories needs the dish to already have some)
+        """
+        cleaned_data = self.cleaned_data
+        operation = cleaned_data.get('operation')
+        factor = cleaned_data.get('factor')
+        if operation and factor:
+            if operation == u'multiply':
+                cleaned_data['scale'] = factor
+            elif operation == u'divide':
+                cleaned_data['scale'] = 1 / factor
+            else:
+                current = getattr(self.dish, operation)
+                if not current:
+                    raise ValidationError, u"This dish has no %s to scale from." % operation
+                cleaned_data['scale'] = factor / current
+        return cleaned_data
+
 @login_required
 def dish_multiply(request, dish_id):
     try:
-        dish = Dish.objects.get(pk=dish_id) # select_related?
+        dish = Dish.objects.for_household(request_household(request)).get(pk=dish_id)
     except Dish.DoesNotExist:
         raise Http404
     if request.method == 'POST': # If the form has been submitted...
-        form = DishMultiplyForm(request.POST) # A form bound to the POST data
+        # A form bound to the POST data
+        form = DishMultiplyForm(request.POST, dish=dish)
         if form.is_valid(): # All validation rules pass
-            # Process the data in form.cleaned_data
-            factor = form.cleaned_data['factor']
-            operation = form.cleaned_data['operation']
-            if operation == u'multiply':
-                dish.quantity = dish.quantity * factor
-            else:
-                dish.quantity = dish.quantity / factor
-            dish.save()
-            for amount in dish.amount_set.all():
-                if operation == u'multiply':
-                    amount.quantity = amount.quantity * factor
-                else:
-                    amount.quantity = amount.quantity / factor
-                amount.save()
+            # Scales the dish and its amounts with UPDATEs, then recalculates
+            # calories once, instead of saving each amount
+            dish.scale(form.cleaned_data['scale'])
             return redirect('dish_detail', dish.id) # Redirect after POST
     else:
-        form = DishMultiplyForm() # An unbound form
+        form = DishMultiplyForm(dish=dish) # An unbound form
 #        print >> sys.stderr, form
 
     return render_to_response('food/dish_multiply.html', {
@@ -290,31 +451,69 @@ def dish_multiply(request, dish_id):
         context_instance=RequestContext(request) # needed for csrf token
     )
 
-class DishDuplicateForm(forms.Form):
-    # form for entry of date for new instance of the dish
+# Duplicating a dish or meal over a date range is limited to this many days
+MAX_DUPLICATE_DAYS = 366
+
+class DuplicateDatesForm(forms.Form):
+    # form for entry of the dates for new instances of a dish or meal: either
+    # a single date, or every chosen day of the week from date until a later
+    # date (e.g. every weekday for 4 weeks)
+    WEEKDAY_CHOICES = (
+        ('0', 'Monday'),
+        ('1', 'Tuesday'),
+        ('2', 'Wednesday'),
+        ('3', 'Thursday'),
+        ('4', 'Friday'),
+        ('5', 'Saturday'),
+        ('6', 'Sunday'),
+    )
+    date = forms.DateField(initial=datetime.date.today)
+    until = forms.DateField(required=False, label='and every day until')
+    weekdays = forms.MultipleChoiceField(choices=WEEKDAY_CHOICES,
+                                         required=False,
+                                         widget=forms.CheckboxSelectMultiple,
+                                         label='but only on (leave blank for every day)')
+
+    def clean(self):
+        """
+        Adds the list of dates for the new instances to cleaned_data
+        """
+        cleaned_data = self.cleaned_data
+        date = cleaned_data.get('date')
+        if date:
+            until = cleaned_data.get('until') or date
+            if until < date:
+                raise ValidationError, u"The last date can't be before the first date."
+            if (until - date).days >= MAX_DUPLICATE_DAYS:
+                raise ValidationError, u"You can't duplicate over more than %s days at once." % MAX_DUPLICATE_DAYS
+            weekdays = [int(weekday) for weekday in cleaned_data.get('weekdays')]
+            dates = []
+            while date <= until:
+                if not weekdays or date.weekday() in weekdays:
+                    dates.append(date)
+                date += datetime.timedelta(days=1)
+            if not dates:
+                raise ValidationError, u"None of these dates are on the chosen days of the week."
+            cleaned_data['dates'] = dates
+        return cleaned_data
+
+class DishDuplicateForm(DuplicateDatesForm):
+    # form for entry of dates for new instances of the dish
     date = forms.DateField(initial=datetime.date.today, label='Cook this dish again on')
 
 @login_required
 def dish_duplicate(request, dish_id):
-    # create copy of dish with same amounts, cooked on the given date
+    # create copies of dish with same amounts, cooked on the given dates
     try:
-        old_dish = Dish.objects.get(pk=dish_id) # select_related?
+        old_dish = Dish.objects.for_household(request_household(request)).get(pk=dish_id)
     except Dish.DoesNotExist:
         raise Http404
     if request.method == 'POST': # If the form has been submitted...
         form = DishDuplicateForm(request.POST) # A form bound to the POST data
         if form.is_valid(): # All validation rules pass
-            # Process the data in form.cleaned_data
-            date = form.cleaned_data['date']
-            # Create a new instance of the old dish using the given date
-            new_dish = old_dish.clone()
-            new_dish.date_cooked = date
-            new_dish.save()
-            for old_amount in old_dish.amount_set.all():
-                new_amount = old_amount.clone()
-                new_amount.containing_dish = new_dish
-                new_amount.save()
-            return redirect('dish_detail', new_dish.id) # Redirect after POST
+            # Create new instances of the old dish on all the given dates
+            new_dishes = old_dish.duplicate(form.cleaned_data['dates'])
+            return redirect('dish_detail', new_dishes[0].id) # Redirect after POST
     else:
         form = DishDuplicateForm() # An unbound form
 #        print >> sys.stderr, form
@@ -325,8 +524,8 @@ def dish_duplicate(request, dish_id):
         context_instance=RequestContext(request) # needed for csrf token
     )
 
-class MealDuplicateForm(forms.Form):
-    # form for entry of date for new instance of the meal
+class MealDuplicateForm(DuplicateDatesForm):
+    # form for entry of dates for new instances of the meal
     date = forms.DateField(initial=datetime.date.today, label='Eat this meal again on')
     # also get new name? e.g. for lunch as dinner
     # and another user? would make it easier to create the same meal for more
@@ -334,30 +533,22 @@ class MealDuplicateForm(forms.Form):
 
 @login_required
 def meal_duplicate(request, meal_id):
-    # Creates a copy of meal with same portions, eaten on the given date.
+    # Creates copies of meal with same portions, eaten on the given dates.
 
     # This creates new portions of the original dish, which shouldn't be
     # allowed in general - if portion.comestible.is_dish, then it should ask
     # whether to use an existing portion or create a new one, if the dish still
     # has a remaining quantity, or whether to cook the dish again
     try:
-        old_meal = Meal.objects.get(pk=meal_id) # select_related?
+        old_meal = Meal.objects.for_household(request_household(request)).get(pk=meal_id)
     except Meal.DoesNotExist:
         raise Http404
     if request.method == 'POST': # If the form has been submitted...
         form = MealDuplicateForm(request.POST) # A form bound to the POST data
         if form.is_valid(): # All validation rules pass
-            # Process the data in form.cleaned_data
-            date = form.cleaned_data['date']
-            # Create a new instance of the old meal using the given date
-            new_meal = old_meal.clone()
-            new_meal.date = date
-            new_meal.save()
-            for old_portion in old_meal.portion_set.all(): # use meal.comestibles?
-                new_portion = old_portion.clone()
-                new_portion.meal = new_meal
-                new_portion.save()
-            return redirect('meal_detail', new_meal.id) # Redirect after POST
+            # Create new instances of the old meal on all the given dates
+            new_meals = old_meal.duplicate(form.cleaned_data['dates'])
+            return redirect('meal_detail', new_meals[0].id) # Redirect after POST
     else:
         form = MealDuplicateForm() # An unbound form
 #        print >> sys.stderr, form
@@ -369,27 +560,150 @@ def meal_duplicate(request, meal_id):
     )
 
 
-def get_sum_day_calories(day):
+class MealWeekCopyForm(forms.Form):
+    # form for entry of a date in the week to copy a week's meals to
+    date = forms.DateField(label="Copy this week's meals to the week containing")
+
+    def __init__(self, *args, **kwargs):
+        self.week_start = kwargs.pop('week_start', None)
+        super(MealWeekCopyForm, self).__init__(*args, **kwargs)
+
+    def clean_date(self):
+        date = self.cleaned_data['date']
+        if _week_bounds(date)[0] == self.week_start:
+            raise ValidationError, u"Choose a date in another week."
+        return date
+
+@login_required
+def meal_week_copy(request, year, week):
+    # Copies all of the household's meals in a week, with their portions, to
+    # the same days and times in another week
+    try:
+        from_week_start = datetime.datetime.strptime(
+            '%s-%s-1' % (year, week), '%Y-%W-%w').date()
+    except ValueError:
+        raise Http404
+    household = request_household(request)
+    if household is None:
+        raise Http404
+    if request.method == 'POST': # If the form has been submitted...
+        form = MealWeekCopyForm(request.POST, # A form bound to the POST data
+                                week_start=from_week_start)
+        if form.is_valid(): # All validation rules pass
+            to_week_start = _week_bounds(form.cleaned_data['date'])[0]
+            copy_week(from_week_start, to_week_start, household)
+            return redirect('meal_archive_week', to_week_start.year,
+                            to_week_start.strftime('%W')) # Redirect after POST
+    else:
+        form = MealWeekCopyForm(week_start=from_week_start, initial={
+            'date': from_week_start + datetime.timedelta(weeks=1)})
+
+    return render_to_response('food/meal_week_copy.html', {
+        'form': form,
+        'week': from_week_start,},
+        context_instance=RequestContext(request) # needed for csrf token
+    )
+
+
+@login_required
+def meal_export(request, format):
+    # Streams the user's meals (or their household's, with ?household=1) as
+    # CSV or JSON Lines; the response content is a generator, so the first
+    # lines are sent before the rest of the history has been read
+    meals = Meal.objects.for_household(request_household(request))
+    if not request.GET.get('household'):
+        meals = meals.filter(user=request.user)
+    response = HttpResponse(export_meals(meals, format),
+                            mimetype=EXPORT_FORMATS[format])
+    response['Content-Disposition'] = 'attachment; filename=meals.%s' % format
+    return response
+
+
+# Values of ?type= for comestible_search and comestible_search_json
+SEARCH_TYPES = {
+    'ingredient': False,
+    'dish': True,
+}
+
+def _search_results(request):
+    """
+    Returns the query and a list of dicts describing the ingredients and
+    dishes whose names best match ?q= (and ?type=, if given).
+    """
+    query = request.GET.get('q', '').strip()
+    results = []
+    for pk, name, is_dish, score in search_index.search(
+            query, is_dish=SEARCH_TYPES.get(request.GET.get('type')),
+            household=request_household(request)):
+        if is_dish:
+            url = reverse('dish_detail', args=[pk])
+        else:
+            url = reverse('ingredient_detail', args=[pk])
+        results.append({
+            'id': pk,
+            'name': name,
+            'type': is_dish and 'dish' or 'ingredient',
+            'url': url,
+            'score': round(score, 2),
+        })
+    return query, results
+
+def comestible_search(request):
+    # Finds ingredients and dishes by name, allowing for typos
+    query, results = _search_results(request)
+    return render_to_response('food/comestible_search.html', {
+        'query': query,
+        'type': request.GET.get('type', ''),
+        'results': results,},
+        context_instance=RequestContext(request)
+    )
+
+def comestible_search_json(request):
+    # The same search as comestible_search, as a JSON list (for autocompletion)
+    query, results = _search_results(request)
+    return HttpResponse(simplejson.dumps(results), mimetype='application/json')
+
+
+@user_passes_test(lambda user: user.is_staff)
+def query_stats(request):
+    # The query counts and timings of recent requests to each view in this
+    # process, as JSON (see food/middleware.py)
+    return HttpResponse(simplejson.dumps(view_stats(), sort_keys=True, indent=2),
+                        mimetype='application/json')
+
+def metrics(request):
+    # The metrics in food/metrics.py in the Prometheus text format, for
+    # scraping from the addresses in INTERNAL_IPS
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def get_sum_day_calories(day, meals=None):
     """
-    Return the total calories in all meals on a date
+    Return the total calories in all meals on a date (of the queryset meals,
+    if given, e.g. a household's meals)
     """
     # FIXME poor little database sobs in the corner
     # This should use an existing queryset instead
-    meals = Meal.objects.filter(date=day)
+    if meals is None:
+        meals = Meal.objects.all()
+    meals = meals.filter(date=day)
     # meal.calories can be None if the meal is new and has no portions, so in
     # this case use 0 instead
     return sum((meal.calories or 0) for meal in meals)
 
-def get_avg_week_calories(week_start_date):
+def get_avg_week_calories(week_start_date, meals=None):
     """
-    Return the daily average calories over a week (only counting days with calories > 0)
+    Return the daily average calories over a week (only counting days with calories > 0),
+    of the queryset meals if given
     """
     total_calories = 0
     day = week_start_date
     day_count = 0
     while day < (week_start_date + datetime.timedelta(weeks=1)):
         # FIXME this queries the database many times more than necessary
-        day_calories = get_sum_day_calories(day)
+        day_calories = get_sum_day_calories(day, meals)
         if day_calories != 0: # could check if any meals exist instead...
             total_calories += day_calories
             day_count += 1
@@ -418,13 +732,70 @@ def get_week_starts_in_month(month_start_date):
         week_start += datetime.timedelta(weeks=1)
     return week_date_list
 
-class MealMonthArchiveView(MonthArchiveView):
+# Helpers for conditional GET: the range of dates shown by each archive page,
+# from the page's URL arguments (these raise ValueError for dates which don't
+# exist)
+
+def _day_range(year, month, day):
+    date = datetime.date(int(year), int(month), int(day))
+    return date, date
+
+def _week_range(year, week):
+    return _week_bounds(datetime.datetime.strptime(
+                            '%s-%s-1' % (year, week), '%Y-%W-%w').date())
+
+def _month_weeks_range(year, month):
+    # (the month page shows the average calories of every week which is at
+    # least partly in the month)
+    week_starts = get_week_starts_in_month(datetime.date(int(year), int(month), 1))
+    return week_starts[0], week_starts[-1] + datetime.timedelta(days=6)
+
+def _year_range(year):
+    return datetime.date(int(year), 1, 1), datetime.date(int(year), 12, 31)
+
+def _all_dates():
+    return None
+
+class MealListView(HouseholdMixin, KeysetPaginationMixin, ListView):
+
+    model = Meal
+    keyset_ordering = ('date', 'time', 'pk')
+
+
+class MealArchiveIndexView(HouseholdMixin, KeysetPaginationMixin, ArchiveIndexView):
+
+    model = Meal
+    date_field = "date"
+    allow_future = True
+    # latest first
+    keyset_ordering = ('-date', '-time', '-pk')
+
+    @method_decorator(meal_range_condition(_all_dates))
+    def dispatch(self, *args, **kwargs):
+        return super(MealArchiveIndexView, self).dispatch(*args, **kwargs)
+
+class MealYearArchiveView(HouseholdMixin, YearArchiveView):
+
+    model = Meal
+    date_field = "date"
+    allow_future = True
+    make_object_list = True
+
+    @method_decorator(meal_range_condition(_year_range))
+    def dispatch(self, *args, **kwargs):
+        return super(MealYearArchiveView, self).dispatch(*args, **kwargs)
+
+class MealMonthArchiveView(HouseholdMixin, MonthArchiveView):
 
     model = Meal
     date_field = "date"
     allow_future = True
     month_format = '%m'
 
+    @method_decorator(meal_range_condition(_month_weeks_range))
+    def dispatch(self, *args, **kwargs):
+        return super(MealMonthArchiveView, self).dispatch(*args, **kwargs)
+
     def get_context_data(self, **kwargs):
 
         # Call the base implementation first to get a context
@@ -443,19 +814,23 @@ class MealMonthArchiveView(MonthArchiveView):
         context.update({
             'week_list':
                 [{'date' : date,
-                  'calories': get_avg_week_calories(date)}
+                  'calories': get_avg_week_calories(date, self.get_queryset())}
                       for date in week_start_list],
             'date_list': date_list,
         })
         return context
 
-class MealWeekArchiveView(WeekArchiveView):
+class MealWeekArchiveView(HouseholdMixin, WeekArchiveView):
 
     model = Meal
     date_field = "date"
     allow_future = True
     week_format = '%W'
 
+    @method_decorator(meal_range_condition(_week_range))
+    def dispatch(self, *args, **kwargs):
+        return super(MealWeekArchiveView, self).dispatch(*args, **kwargs)
+
     def get_next_week(self, date):
         """
         Get the next valid week.
@@ -514,28 +889,38 @@ class MealWeekArchiveView(WeekArchiveView):
         date_list.sort() # into chronological order
 
         context.update({
-            'avg_week_calories': get_avg_week_calories(week_start_date),
+            'avg_week_calories': get_avg_week_calories(week_start_date,
+                                                       self.get_queryset()),
             'date_list': date_list,
             'next_week': self.get_next_week(week_start_date),
             'previous_week': self.get_previous_week(week_start_date),
         })
         return context
 
-class MealDayArchiveView(DayArchiveView):
+class MealDayArchiveView(HouseholdMixin, DayArchiveView):
 
     model = Meal
     date_field = "date"
     allow_future = True
     month_format = '%m'
 
+    @method_decorator(meal_range_condition(_day_range))
+    def dispatch(self, *args, **kwargs):
+        return super(MealDayArchiveView, self).dispatch(*args, **kwargs)
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super(MealDayArchiveView, self).get_context_data(**kwargs)
         # Add in calories sum for the day
         day = self.get_dated_items()[2]['day']
-        context['day_calories'] = get_sum_day_calories(day)
+        context['day_calories'] = get_sum_day_calories(day, self.get_queryset())
         return context
 
+class MealDeleteView(HouseholdMixin, DeleteView):
+
+    model = Meal
+    success_url = "/food/meals/"
+
 
 def _week_bounds(date):
     """
@@ -1,4 +1,5 @@
 # Django settings for everydayeating project.
+import os
 
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
@@ -9,17 +10,39 @@ ADMINS = (
 
 MANAGERS = ADMINS
 
+# The database is configured by the environment, and is a local SQLite file
+# if it isn't. SQLite only lets one process write at a time, so for more than
+# one process use PostgreSQL, e.g.
+#    DATABASE_ENGINE=postgresql_psycopg2 DATABASE_NAME=everydayeating
+#    DATABASE_USER=everydayeating DATABASE_PASSWORD=... DATABASE_HOST=localhost
+# DATABASE_HOST and DATABASE_PORT can be those of a connection pooler like
+# PgBouncer, in session pooling mode (each connection's time zone is set
+# when it's opened, which transaction pooling would lose). Tests create
+# DATABASE_TEST_NAME (by default test_ and DATABASE_NAME), which needs a
+# direct connection to PostgreSQL rather than through the pooler.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3', # Add 'postgresql_psycopg2', 'postgresql', 'mysql', 'sqlite3' or 'oracle'.
-        'NAME': '/home/jenny/Python/everydayeating/database',                      # Or path to database file if using sqlite3.
-        'USER': '',                      # Not used with sqlite3.
-        'PASSWORD': '',                  # Not used with sqlite3.
-        'HOST': '',                      # Set to empty string for localhost. Not used with sqlite3.
-        'PORT': '',                      # Set to empty string for default. Not used with sqlite3.
+        'ENGINE': 'django.db.backends.' + os.environ.get('DATABASE_ENGINE', 'sqlite3'),
+        'NAME': os.environ.get('DATABASE_NAME',
+                               '/home/jenny/Python/everydayeating/database'),
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', ''),
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+        'TEST_NAME': os.environ.get('DATABASE_TEST_NAME'),
     }
 }
 
+# Seconds that each process keeps its connections to a database server (not
+# SQLite) for, rather than opening a new one for every request; 0 to close
+# them after every request, and None to keep them until they break (see
+# food/connections.py); DATABASE_CONN_MAX_AGE can be empty or "none" for None
+FOOD_DB_CONN_MAX_AGE = os.environ.get('DATABASE_CONN_MAX_AGE', str(10 * 60)).strip()
+if FOOD_DB_CONN_MAX_AGE.lower() in ('', 'none'):
+    FOOD_DB_CONN_MAX_AGE = None
+else:
+    FOOD_DB_CONN_MAX_AGE = int(FOOD_DB_CONN_MAX_AGE)
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -100,12 +123,36 @@ STATICFILES_FINDERS = (
 SECRET_KEY = '0_frzdvlq&b%vho$!7zatuk1wdtir48)t&!qr^h@9itub-qv=n'
 
 # This is needed for django.core.context_processors.debug to add sql_queries
-# into a RequestContext.
+# into a RequestContext. These addresses can also read /metrics.
 INTERNAL_IPS = ('127.0.0.1',)
 
 # This is for django-registration
 ACCOUNT_ACTIVATION_DAYS = 7 # One-week activation window
 
+# The dish and meal detail pages cache their content (see food/caching.py).
+# Each process has its own local memory cache, so with more than one process
+# use a shared cache instead, e.g. file-based:
+#    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#    'LOCATION': '/var/tmp/everydayeating_cache',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'everydayeating',
+    }
+}
+
+# Seconds that each user's profile and household are cached for, so that the
+# views scoped to the user's household don't have to look them up (see
+# accounts/middleware.py); 0 to look them up on every request
+ACCOUNTS_PROFILE_CACHE_TIMEOUT = 5 * 60
+
+# Number of dishes, ingredients or meals on each page of their lists
+FOOD_LIST_PAGE_SIZE = 50
+
+# Days after which dishes' leftovers are no longer shown on the household
+# dashboard (see food/dashboard.py)
+FOOD_LEFTOVER_DAYS = 7
+
 # List of callables that know how to import templates from various sources.
 TEMPLATE_LOADERS = (
     'django.template.loaders.filesystem.Loader',
@@ -114,13 +161,63 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'food.connections.PersistentConnectionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'food.middleware.QueryBudgetMiddleware',
+    'food.middleware.ProfilingMiddleware',
 )
 
+# Whether staff users can have their requests profiled, by adding ?profile=1
+# or an X-Food-Profile header (see food/profiling.py). Profiles are written to
+# FOOD_PROFILE_DIR, which keeps those of the last FOOD_PROFILE_KEEP requests.
+FOOD_PROFILING = False
+FOOD_PROFILE_DIR = '/var/tmp/everydayeating_profiles'
+FOOD_PROFILE_KEEP = 50
+
+# When running in more than one process on this machine, a directory shared by
+# them all for each to write its metrics to, so that /metrics can add them up
+# (see food/metrics.py)
+FOOD_METRICS_DIR = None
+
+# Where queries slower than FOOD_SLOW_QUERY_THRESHOLD seconds are logged, with
+# the view and code which made them (see food/slowlog.py and the
+# slow_query_report command)
+FOOD_SLOW_QUERY_LOG = '/var/tmp/everydayeating_slow_queries.log'
+FOOD_SLOW_QUERY_THRESHOLD = 0.1
+
+# Most queries, seconds in the database and seconds in total each view (by
+# URL name) should take; requests over budget are logged with their SQL to
+# the food.query_budget logger (see food/middleware.py). The query counts are
+# those measured by food.tests.QueryCountTestCase (with nothing cached); for
+# the views whose count grows with the dish, meal or day shown, they're the
+# counts with 10 amounts, portions or meals.
+QUERY_BUDGETS = {
+    'ingredient_list': {'queries': 3, 'db_time': 0.1, 'time': 1.0},
+    'ingredient_detail': {'queries': 6, 'db_time': 0.1, 'time': 1.0},
+    'ingredient_uses': {'queries': 7, 'db_time': 0.2, 'time': 1.0},
+    'ingredient_manage': {'queries': 4, 'db_time': 0.5, 'time': 2.0},
+    'dish_list': {'queries': 4, 'db_time': 0.1, 'time': 1.0},
+    'dish_detail': {'queries': 9, 'db_time': 0.1, 'time': 1.0},
+    'dish_add': {'queries': 132, 'db_time': 0.2, 'time': 1.0},
+    'dish_edit': {'queries': 345, 'db_time': 0.5, 'time': 2.0},
+    'comestible_search': {'queries': 5, 'db_time': 0.1, 'time': 1.0},
+    'comestible_search_json': {'queries': 5, 'db_time': 0.1, 'time': 0.5},
+    'meal_list': {'queries': 4, 'db_time': 0.1, 'time': 1.0},
+    'meal_detail': {'queries': 6, 'db_time': 0.1, 'time': 1.0},
+    'meal_add': {'queries': 132, 'db_time': 0.2, 'time': 1.0},
+    'meal_edit': {'queries': 343, 'db_time': 0.5, 'time': 2.0},
+    'meal_archive': {'queries': 7, 'db_time': 0.1, 'time': 1.0},
+    'meal_archive_year': {'queries': 9, 'db_time': 0.1, 'time': 1.0},
+    'meal_archive_month': {'queries': 54, 'db_time': 0.2, 'time': 1.0},
+    'meal_archive_week': {'queries': 19, 'db_time': 0.1, 'time': 1.0},
+    'meal_archive_day': {'queries': 68, 'db_time': 0.1, 'time': 1.0},
+}
+
 ROOT_URLCONF = 'everydayeating.urls'
 
 TEMPLATE_DIRS = (
@@ -164,7 +261,19 @@ LOGGING = {
         'mail_admins': {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'console': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler',
+        },
+        'slow_queries': {
+            'level': 'DEBUG',
+            'class': 'food.slowlog.SlowQueryHandler',
+            'filename': FOOD_SLOW_QUERY_LOG,
+            'threshold': FOOD_SLOW_QUERY_THRESHOLD,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+        },
     },
     'loggers': {
         'django.request': {
@@ -172,5 +281,15 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'django.db.backends': {
+            'handlers': ['slow_queries'],
+            'level': 'DEBUG',
+            'propagate': False,
+        },
+        'food': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': True,
+        },
     }
 }